@@ -14,6 +14,13 @@ from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from gisaid_EpiCoV_uploader import probe_element, probe_elements, restore_session, save_session
+
+# implicit wait applied to required element lookups in seconds
+IMPLICIT_WAIT = 20
+# how long a popup window may take to show up
+POPUP_TIMEOUT = 3
+GISAID_URL = 'https://www.epicov.org/epi3/frontend'
 
 
 def parse_params():
@@ -48,6 +55,14 @@ def parse_params():
 				   metavar='[INT]', type=int, required=False, default=3,
 				   help="time interval between retries in second(s). Default is 3 seconds.")
 
+	p.add_argument('--session',
+				   metavar='[FILE]', type=str, required=False, default=None,
+				   help="keep the login session in this file and reuse it in later runs.")
+
+	p.add_argument('--url',
+				   metavar='[URL]', type=str, required=False, default=GISAID_URL,
+				   help=f"address of the GISAID site. Default is {GISAID_URL}.")
+
 	p.add_argument('--headless',
 				   action='store_true', help='turn on headless mode')
 
@@ -63,7 +78,7 @@ def waiting_sys_timer(wait, sec=1):
 		(By.XPATH,  "//div[@id='sys_timer']")))
 	time.sleep(sec)
 
-def fill_EpiCoV_upload(uname, upass, seq, metadatafile, to, rt, iv, headless):
+def fill_EpiCoV_upload(uname, upass, seq, metadatafile, to, rt, iv, headless, session=None, url=GISAID_URL):
 	
 	outdir= os.path.dirname(metadatafile.name)
 	# MIME types
@@ -91,25 +106,28 @@ def fill_EpiCoV_upload(uname, upass, seq, metadatafile, to, rt, iv, headless):
 	atexit.register(quit_driver,driver)
 	
 	# driverwait
-	driver.implicitly_wait(20)
+	driver.implicitly_wait(IMPLICIT_WAIT)
 	wait = WebDriverWait(driver, to)
 
 	# open GISAID
 	print("Opening website GISAID...")
-	driver.get('https://www.epicov.org/epi3/frontend')
+	driver.get(url)
 	waiting_sys_timer(wait)
 	print(driver.title)
 	assert 'GISAID' in driver.title
 
-	# login
-	print("Logining to GISAID...")
-	username = driver.find_element_by_name('login')
-	username.send_keys(uname)
-	password = driver.find_element_by_name('password')
-	password.send_keys(upass)
-	driver.execute_script("return doLogin();")
+	if session and restore_session(wait, driver, session, url):
+		print("Restored GISAID session...")
+	else:
+		# login
+		print("Logining to GISAID...")
+		username = driver.find_element_by_name('login')
+		username.send_keys(uname)
+		password = driver.find_element_by_name('password')
+		password.send_keys(upass)
+		driver.execute_script("return doLogin();")
 
-	waiting_sys_timer(wait)
+		waiting_sys_timer(wait)
 
 	# navigate to EpiFlu
 	print("Navigating to EpiCoV...")
@@ -118,14 +136,17 @@ def fill_EpiCoV_upload(uname, upass, seq, metadatafile, to, rt, iv, headless):
 
 	waiting_sys_timer(wait)
 
+	if session:
+		save_session(driver, session)
+
 	# access uploading page
 	# WARNING: different users might have different uploading options
 	print("Accessing batch uploading page...")
-	try:
-		batch_upload_tab = driver.find_element_by_xpath('//div[@class=sys-actionbar-action][contains(text(), "Batch Upload")]')
+	batch_upload_tab = probe_element(driver, By.XPATH, '//div[@class="sys-actionbar-action"][contains(text(), "Batch Upload")]')
+	if batch_upload_tab:
 		batch_upload_tab.click()
 		waiting_sys_timer(wait)
-	except:
+	else:
 		upload_tab = wait.until(EC.element_to_be_clickable(
 			(By.CSS_SELECTOR, 'div.sys-actionbar-action:nth-child(4)')))
 		upload_tab.click()
@@ -133,8 +154,8 @@ def fill_EpiCoV_upload(uname, upass, seq, metadatafile, to, rt, iv, headless):
 		
 	
 	try:
-		iframe = driver.find_element_by_xpath("//iframe")
-		if iframe.is_displayed() and iframe.get_attribute('id').startswith('sysoverlay'):
+		iframe = probe_element(driver, By.XPATH, "//iframe", POPUP_TIMEOUT)
+		if iframe and iframe.is_displayed() and iframe.get_attribute('id').startswith('sysoverlay'):
 			print("Popup window detected...")
 			driver.switch_to.frame(iframe)
 			button = wait.until(
@@ -197,12 +218,12 @@ def fill_EpiCoV_upload(uname, upass, seq, metadatafile, to, rt, iv, headless):
 		button.click()
 		waiting_sys_timer(wait)
 
-		warnings = driver.find_elements_by_xpath( "//div[@class='bd']")
+		warnings = probe_elements(driver, By.XPATH, "//div[@class='bd']")
 		for msg in warnings:
 			if msg.is_displayed():
 				print(msg.text)
 		
-		reportMSG = driver.find_elements_by_xpath( "//div[@class='sys-form-fi-multiline-ro']")
+		reportMSG = probe_elements(driver, By.XPATH, "//div[@class='sys-form-fi-multiline-ro']")
 		for msg in reportMSG:
 			print(msg.text)
 
@@ -223,7 +244,9 @@ def main():
 		argvs.timeout,
 		argvs.retry,
 		argvs.interval,
-		argvs.headless
+		argvs.headless,
+		argvs.session,
+		argvs.url
 	)
 	print("Completed.")
 
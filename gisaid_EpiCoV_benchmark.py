@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+__author__ = "Po-E Li, B10, LANL"
+__copyright__ = "LANL 2020"
+__license__ = "GPL"
+__version__ = "21.05.10"
+__email__ = "po-e@lanl.gov"
+
+import os
+import time
+import sys
+import argparse as ap
+import json
+import logging
+import shlex
+import shutil
+import statistics
+import subprocess
+import tempfile
+
+import gisaid_EpiCoV_mock_server as mock
+import gisaid_EpiCoV_downloader as downloader
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# flows that can be benchmarked: name -> script, None for the in-process
+# EpiCoVClient over the HTTP endpoints of the mock
+FLOWS = {
+    "download": "gisaid_EpiCoV_downloader.py",
+    "query": "gisaid_EpiCoV_downloader.py",
+    "http-download": None,
+    "upload": "gisaid_EpiCoV_uploader.py",
+    "batch-upload": "gisaid_EpiCoV_batch_uploader.py",
+}
+
+# files written next to the downloads that are not downloads themselves
+REPORT_FILES = (".json", ".jsonl", ".log", ".prom", ".png")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M',
+)
+
+
+def parse_params():
+    p = ap.ArgumentParser(prog='gisaid_EpiCoV_benchmark.py',
+                          description="""Time the download, query and upload flows end to end against a local mock EpiCoV site""")
+
+    p.add_argument('-f', '--flows',
+                   metavar='[STR]', type=str, required=False, default="download,query",
+                   help=f"comma separated flows to run: {','.join(FLOWS)}. Default is download,query.")
+
+    p.add_argument('-n', '--repeat',
+                   metavar='[INT]', type=int, required=False, default=3,
+                   help="runs per flow. Default is 3.")
+
+    p.add_argument('-o', '--outdir',
+                   metavar='[STR]', type=str, required=False, default=None,
+                   help="keep the outputs of every run here. Default is a temporary directory.")
+
+    p.add_argument('--json',
+                   metavar='[FILE]', type=str, required=False, default=None,
+                   help="write the results to this JSON file.")
+
+    p.add_argument('--args',
+                   metavar='[STR]', type=str, required=False, default="",
+                   help="extra arguments for the downloader, e.g. \"-cc --http\".")
+
+    p.add_argument('--query',
+                   metavar='[STR]', type=str, required=False, default="-cs 2020-03-01 -ce 2020-06-30 -l USA",
+                   help="filters of the query flow. Default is \"-cs 2020-03-01 -ce 2020-06-30 -l USA\".")
+
+    p.add_argument('--url',
+                   metavar='[URL]', type=str, required=False, default=None,
+                   help="benchmark an already running site instead of starting the mock.")
+
+    p.add_argument('--records',
+                   metavar='[INT]', type=int, required=False, default=1000,
+                   help="number of genomes in the mock database. Default is 1000.")
+
+    p.add_argument('--seqlen',
+                   metavar='[INT]', type=int, required=False, default=29903,
+                   help="length of the mock genomes. Default is 29903.")
+
+    p.add_argument('--size',
+                   metavar='[INT]', type=int, required=False, default=0,
+                   help="pad every nextstrain artifact with this many MB. Default is 0.")
+
+    p.add_argument('--latency',
+                   metavar='[FLOAT]', type=float, required=False, default=0.5,
+                   help="seconds the mock page stays busy after each action. Default is 0.5.")
+
+    p.add_argument('--packaging',
+                   metavar='[FLOAT]', type=float, required=False, default=1.0,
+                   help="seconds before a mock download starts. Default is 1.")
+
+    p.add_argument('--bandwidth',
+                   metavar='[FLOAT]', type=float, required=False, default=0,
+                   help="MB/s per connection of the mock downloads, 0 for unlimited. Default is 0.")
+
+    p.add_argument('--timeout',
+                   metavar='[INT]', type=int, required=False, default=1800,
+                   help="give up on a run after this many seconds. Default is 1800.")
+
+    args_parsed = p.parse_args()
+    args_parsed.flows = [flow.strip() for flow in args_parsed.flows.split(",") if flow.strip()]
+    unknown = set(args_parsed.flows) - set(FLOWS)
+    if unknown:
+        p.error(f"unknown --flows: {', '.join(sorted(unknown))}")
+    return args_parsed
+
+
+def flow_command(flow, url, rundir, argvs):
+    """the command line of one run of flow"""
+    cmd = [sys.executable, os.path.join(HERE, FLOWS[flow]), "-u", "mock", "-p", "mock", "--url", url]
+    if flow == "download":
+        return cmd + ["-o", rundir] + shlex.split(argvs.args)
+    if flow == "query":
+        return cmd + ["-o", rundir, "-nnd"] + shlex.split(argvs.query) + shlex.split(argvs.args)
+
+    # uploads need a sequence and its metadata
+    fasta = os.path.join(rundir, "sample.fasta")
+    with open(fasta, "w") as f:
+        f.write(">hCoV-19/USA/MOCK-UPLOAD/2021\n" + "ACGT" * 7500 + "\n")
+    if flow == "upload":
+        metadata = os.path.join(rundir, "sample.txt")
+        with open(metadata, "w") as f:
+            f.write("virus_name=hCoV-19/USA/MOCK-UPLOAD/2021\n"
+                    "collection_date=2021-01-01\n"
+                    "location=North America / USA / New Mexico\n"
+                    "host=Human\n")
+    else:
+        metadata = os.path.join(rundir, "sample.xls")
+        with open(metadata, "wb") as f:
+            f.write(b"mock metadata\n")
+    return cmd + ["-f", fasta, "-m", metadata, "--headless"]
+
+
+def summarize_timings(fn):
+    """mean seconds per download stage from a gisaid_timings.jsonl"""
+    stages = {}
+    if not os.path.exists(fn):
+        return stages
+    with open(fn) as f:
+        for line in f:
+            for stage, secs in json.loads(line)["stages"].items():
+                stages.setdefault(stage, []).append(secs)
+    return {stage: round(statistics.mean(secs), 3) for stage, secs in stages.items()}
+
+
+def run_http_flow(url, rundir):
+    """download the nextstrain artifacts with the HttpBackend of the mock, returns 0 if it worked"""
+    try:
+        with downloader.EpiCoVClient("mock", "mock", rundir, backend="http", url=url) as client:
+            client.download_artifacts(parallel=True)
+    except downloader.EpiCoVError as e:
+        logging.error(e)
+        return 1
+    return 0
+
+
+def run_flow(flow, url, rundir, argvs):
+    """run flow once, returns its result"""
+    os.makedirs(rundir, exist_ok=True)
+    startTime = time.time()
+    if FLOWS[flow] is None:
+        status = run_http_flow(url, rundir)
+    else:
+        cmd = flow_command(flow, url, rundir, argvs)
+        with open(os.path.join(rundir, "benchmark.log"), "w") as log:
+            try:
+                status = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=rundir,
+                                        timeout=argvs.timeout).returncode
+            except subprocess.TimeoutExpired:
+                status = "timeout"
+    secs = time.time() - startTime
+
+    received = 0
+    if flow in ("download", "query", "http-download"):
+        for name in os.listdir(rundir):
+            path = os.path.join(rundir, name)
+            if os.path.isfile(path) and not name.endswith(REPORT_FILES):
+                received += os.path.getsize(path)
+    return {
+        "status": "ok" if status == 0 else f"failed ({status})",
+        "secs": round(secs, 3),
+        "bytes": received,
+        "stages": summarize_timings(os.path.join(rundir, "gisaid_timings.jsonl")),
+    }
+
+
+def main():
+    argvs = parse_params()
+
+    server = None
+    url = argvs.url
+    if not url:
+        server = mock.start_server({
+            "username": "mock",
+            "password": "mock",
+            "records": argvs.records,
+            "seqlen": argvs.seqlen,
+            "size": argvs.size,
+            "latency": argvs.latency,
+            "packaging": argvs.packaging,
+            "bandwidth": argvs.bandwidth,
+            "seed": 2020,
+            "cachedir": None,
+        })
+        url = server.url
+        logging.info(f"Mock EpiCoV site with {argvs.records} genome(s) at {url}")
+
+    outdir = argvs.outdir or tempfile.mkdtemp(prefix="gisaid_benchmark_")
+    results = {}
+    failed = False
+    try:
+        for flow in argvs.flows:
+            runs = []
+            for num in range(argvs.repeat):
+                logging.info(f"Running {flow} #{num+1}...")
+                result = run_flow(flow, url, os.path.join(outdir, f"{flow}-{num+1}"), argvs)
+                logging.info(f" -- {result['status']} in {result['secs']:.1f} secs")
+                runs.append(result)
+            secs = [run["secs"] for run in runs if run["status"] == "ok"]
+            results[flow] = {
+                "runs": runs,
+                "failures": len(runs) - len(secs),
+                "min": min(secs) if secs else None,
+                "median": round(statistics.median(secs), 3) if secs else None,
+                "mean": round(statistics.mean(secs), 3) if secs else None,
+                "max": max(secs) if secs else None,
+            }
+            failed = failed or len(secs) < len(runs)
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+        if not argvs.outdir:
+            shutil.rmtree(outdir, ignore_errors=True)
+
+    print(f"{'flow':<14}{'runs':>6}{'failed':>8}{'min':>10}{'median':>10}{'max':>10}")
+    for flow, result in results.items():
+        cells = [f"{result[key]:.1f}" if result[key] is not None else "-" for key in ("min", "median", "max")]
+        print(f"{flow:<14}{len(result['runs']):>6}{result['failures']:>8}" + "".join(f"{c:>10}" for c in cells))
+
+    if argvs.json:
+        with open(argvs.json, "w") as f:
+            json.dump({"url": url, "args": argvs.args, "results": results}, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,26 @@ import time
 import sys
 import argparse as ap
 import json
+import re
 import logging
+import datetime
+import glob
+import hashlib
+import queue
+import shutil
+import signal
+import socket
+import socketserver
+import tempfile
+import threading
+import collections
+import concurrent.futures
+import contextlib
+import fcntl
+import random
+import sqlite3
+import http.client
+import urllib.parse
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
@@ -19,6 +38,177 @@ from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException, TimeoutException, WebDriverException
+import gisaid_EpiCoV_uploader as uploader
+from gisaid_EpiCoV_snapshot import ACCESSION_COLUMNS, SUBMISSION_COLUMNS, iter_download_members, download_kind
+from gisaid_EpiCoV_snapshot import find_snapshot, query_snapshot, update_store, index_fasta, pack_msa
+from gisaid_EpiCoV_snapshot import previous_snapshot, snapshot_stem, diff_snapshots
+
+# artifacts in the Downloads section: (--artifacts key, name, xpath of the button)
+NEXTSTRAIN_ARTIFACTS = [
+    ("metadata", "metadata", '//div[contains(text(), "metadata")]'),
+    ("fasta", "FASTA", '//div[text()="FASTA"]'),
+    ("msa-full", "MSA full", '//div[contains(text(), "MSA full")]'),
+    ("msa-unmasked", "MSA unmasked", '//div[contains(text(), "MSA unmasked")]'),
+    ("msa-masked", "MSA masked", '//div[contains(text(), "MSA masked")]'),
+]
+
+# how long each stage of a download took, one JSON line per download
+TIMINGS = "gisaid_timings.jsonl"
+TIMINGS_LOCK = threading.Lock()
+
+EPICOV_URL = 'https://www.epicov.org/epi3/frontend'
+# the --url of the command line, replaced by configure()
+GISAID_URL = EPICOV_URL
+
+# order of the date inputs in Browse
+DATE_FILTERS = ("colstart", "colend", "substart", "subend")
+
+# Browse filters in the order of the query_EpiCoV() arguments
+QUERY_KEYS = ("location", "host") + DATE_FILTERS + ("complete", "highcoverage", "lowcoverageExcl")
+
+# keys of a --manifest query besides QUERY_KEYS
+MANIFEST_KEYS = ("name", "outdir")
+MANIFEST_SUMMARY = "gisaid_manifest_summary.json"
+
+# endpoints of HttpBackend relative to the site. They are the calls the
+# frontend of gisaid_EpiCoV_mock_server.py makes, not those of GISAID, so
+# HttpBackend only runs against the mock and refuses GISAID_HOSTS
+HTTP_ENDPOINTS = {
+    "state": "/mock/state",
+    "login": "/mock/login",
+    "browse": "/mock/browse",
+    "export": "/mock/export/{option}",
+    "artifact": "/mock/artifact/{key}",
+}
+
+GISAID_HOSTS = ("epicov.org", "gisaid.org")
+
+# query keys -> parameters of the browse and export endpoints
+HTTP_BROWSE_PARAMS = {
+    "location": "location", "host": "host",
+    "colstart": "colstart", "colend": "colend", "substart": "substart", "subend": "subend",
+    "complete": "complete", "highcoverage": "highq", "lowcoverageExcl": "lowco",
+}
+
+# finished steps of a run, see Journal
+JOURNAL = "gisaid_journal.jsonl"
+
+# --sync keeps its high-water mark and the master files in the output directory
+SYNC_STATE = "gisaid_sync_state.json"
+SYNC_MASTER = "gisaid_master"
+
+# seconds between health checks of an idle daemon browser
+DAEMON_KEEPALIVE = 300
+
+# files written next to the downloads that are not downloads themselves
+TRACKER_IGNORE = (".json", ".jsonl", ".http-part", ".tmp")
+
+# --http: bytes per ranged request, per read() and seconds before a stalled socket fails
+HTTP_CHUNK_SIZE = 16 * 1024**2
+HTTP_READ_SIZE = 1024**2
+HTTP_TIMEOUT = 60
+HTTP_MAX_REDIRECTS = 5
+# transfer settings of HttpBackend without --http: one stream per file
+HTTP_SINGLE = {"connections": 1, "chunk_size": HTTP_CHUNK_SIZE}
+
+# lists the running firefox downloads (chrome context), cancelling the one saved to arguments[0]
+BROWSER_DOWNLOADS_JS = """
+const done = arguments[arguments.length - 1];
+const cancel = arguments[0];
+let mod;
+try {
+    mod = ChromeUtils.importESModule("resource://gre/modules/Downloads.sys.mjs");
+} catch (e) {
+    mod = ChromeUtils.import("resource://gre/modules/Downloads.jsm");
+}
+mod.Downloads.getList(mod.Downloads.ALL).then(async list => {
+    const found = [];
+    for (const d of await list.getAll()) {
+        if (d.stopped || (cancel && d.target.path !== cancel)) continue;
+        const ref = d.source.referrerInfo && d.source.referrerInfo.originalReferrer;
+        found.push({url: d.source.url, referrer: ref ? ref.spec : null, target: d.target.path});
+        if (cancel) {
+            await d.finalize(true);
+            await list.remove(d);
+        }
+    }
+    done(found);
+}).catch(e => done(String(e)));
+"""
+
+# implicit wait applied to required element lookups in seconds
+IMPLICIT_WAIT = 30
+
+# shared request rate limit: state file of every run of the user, burst size,
+# how far errors may slow requests down, how fast they recover (secs from the
+# slowest to full speed), the longest backoff and the most times it doubles
+RATE_STATE = os.path.join(os.path.expanduser("~"), ".cache", "gisaid_EpiCoV", "ratelimit.json")
+RATE_BURST = 5
+RATE_MIN_FACTOR = 0.125
+RATE_RECOVERY = 120
+BACKOFF_MAX = 300
+BACKOFF_DOUBLINGS = 16
+
+# what --lean turns off: images, web fonts, media, prefetching, telemetry,
+# background updates and all but one content process
+LEAN_PREFS = {
+    "permissions.default.image": 2,
+    "browser.display.use_document_fonts": 0,
+    "gfx.downloadable_fonts.enabled": False,
+    "media.autoplay.default": 5,
+    "media.mediasource.enabled": False,
+    "media.peerconnection.enabled": False,
+    "network.prefetch-next": False,
+    "network.dns.disablePrefetch": True,
+    "network.http.speculative-parallel-limit": 0,
+    "network.predictor.enabled": False,
+    "browser.urlbar.speculativeConnect.enabled": False,
+    "toolkit.telemetry.enabled": False,
+    "toolkit.telemetry.unified": False,
+    "toolkit.telemetry.archive.enabled": False,
+    "datareporting.healthreport.uploadEnabled": False,
+    "datareporting.policy.dataSubmissionEnabled": False,
+    "browser.ping-centre.telemetry": False,
+    "app.normandy.enabled": False,
+    "app.shield.optoutstudies.enabled": False,
+    "app.update.auto": False,
+    "app.update.enabled": False,
+    "extensions.update.enabled": False,
+    "browser.safebrowsing.malware.enabled": False,
+    "browser.safebrowsing.phishing.enabled": False,
+    "browser.safebrowsing.downloads.enabled": False,
+    "browser.shell.checkDefaultBrowser": False,
+    "browser.newtabpage.enabled": False,
+    "browser.startup.page": 0,
+    "browser.sessionhistory.max_total_viewers": 0,
+    "browser.sessionstore.resume_from_crash": False,
+    "dom.ipc.processCount": 1,
+    "dom.ipc.processCount.webIsolated": 1,
+    "dom.ipc.processPrelaunch.enabled": False,
+    "fission.autostart": False,
+}
+
+# adaptive polling interval bounds of wait_until() in seconds
+WAIT_POLL_MIN = 0.05
+WAIT_POLL_MAX = 1.0
+# how long the page has to stay quiet before a step counts as finished
+WAIT_SETTLE = 0.3
+# upper bound for the table to refresh after a filter is changed
+FILTER_REFRESH_TIMEOUT = 7
+
+# seconds each named wait really took and how many times it timed out
+WAIT_STATS = {}
+WAIT_TIMEOUTS = {}
+# retries per step, the StageTimer records of the downloads and the browser RSS samples
+RETRIES = {}
+DOWNLOAD_STATS = []
+BROWSER_RSS = {}
+# spans for --trace: (name, category, start, end, thread)
+TRACE_EVENTS = []
+METRICS_LOCK = threading.Lock()
+# upper bounds of the --metrics histogram buckets in seconds
+METRICS_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -90,6 +280,112 @@ def parse_params():
     p.add_argument('-nnd', '--nonextstraindata',
                    action='store_true', help='Do not download nextstrain data')
 
+    p.add_argument('--artifacts',
+                   metavar='[STR]', type=str, required=False, default=None,
+                   help="comma separated nextstrain data to download: "
+                        f"{','.join(key for key, _, _ in NEXTSTRAIN_ARTIFACTS)}. Default is all of them.")
+
+    p.add_argument('-cc', '--concurrent',
+                   action='store_true', help='request all nextstrain data at once and download them in parallel')
+
+    p.add_argument('--session',
+                   metavar='[FILE]', type=str, required=False, default=None,
+                   help="keep the login session in this file and reuse it in later runs.")
+
+    p.add_argument('--daemon',
+                   metavar='[SOCKET]', type=str, required=False, default=None,
+                   help="keep logged in browsers running and accept jobs on this Unix socket.")
+
+    p.add_argument('--connect',
+                   metavar='[SOCKET]', type=str, required=False, default=None,
+                   help="send the download/query to a daemon listening on this Unix socket.")
+
+    p.add_argument('-w', '--workers',
+                   metavar='[INT]', type=int, required=False, default=1,
+                   help="number of browsers kept by the daemon or used for shards. Default is 1.")
+
+    p.add_argument('-sd', '--sharddays',
+                   metavar='[INT]', type=int, required=False, default=None,
+                   help="split the collection (or submission) date range into windows of this many days "
+                        "and query them over --workers browsers.")
+
+    p.add_argument('-mr', '--maxrecords',
+                   metavar='[INT]', type=int, required=False, default=None,
+                   help="count the records before downloading and bisect the date range "
+                        "until no shard has more than this many records.")
+
+    p.add_argument('--manifest',
+                   metavar='[FILE]', type=str, required=False, default=None,
+                   help="run the queries of this JSON or YAML file, each into its own subfolder of --outdir, "
+                        "over one login per --workers browser, and summarize them at the end.")
+
+    p.add_argument('--local',
+                   action='store_true', help='query the metadata and sequences last downloaded to --outdir '
+                                             'with the filters above, offline, instead of browsing EpiCoV.')
+
+    p.add_argument('--store',
+                   action='store_true', help='load the downloaded metadata into an indexed SQLite store, '
+                                             'gisaid_metadata.sqlite in the output directory.')
+
+    p.add_argument('--index',
+                   action='store_true', help='build a faidx index of the downloaded FASTA files (decompressing '
+                                             'the nextstrain one once) for fast extraction by accession.')
+
+    p.add_argument('--pack',
+                   action='store_true', help='convert the downloaded MSA full/unmasked/masked to 4-bit packed, '
+                                             'memory mapped matrices (.msa4) for fast site queries.')
+
+    p.add_argument('--diff',
+                   action='store_true', help='compare the downloaded metadata and FASTA with the previous download '
+                                             'in the output directory and write the added, removed and changed '
+                                             'records to gisaid_diff_* files.')
+
+    p.add_argument('--sync',
+                   action='store_true', help='only fetch submissions since the last --sync run and append '
+                                             'them to the master FASTA/metadata in the output directory.')
+
+    p.add_argument('--resume',
+                   action='store_true', help='skip the steps that the last run with the same options finished.')
+
+    p.add_argument('--http',
+                   action='store_true', help='take downloads over from firefox and fetch them in parallel '
+                                             'byte ranges; interrupted transfers resume.')
+
+    p.add_argument('--connections',
+                   metavar='[INT]', type=int, required=False, default=4,
+                   help="number of HTTP connections per --http download. Default is 4.")
+
+    p.add_argument('--chunksize',
+                   metavar='[INT]', type=int, required=False, default=16,
+                   help="size of the byte ranges of --http downloads in MB. Default is 16.")
+
+    p.add_argument('--ratelimit',
+                   metavar='[INT]', type=int, required=False, default=0,
+                   help="at most this many requests per minute to GISAID over all workers and runs sharing "
+                        "--ratefile. Default is 0, no limit. Retries back off exponentially with jitter either way.")
+
+    p.add_argument('--ratefile',
+                   metavar='[FILE]', type=str, required=False, default=RATE_STATE,
+                   help=f"lock file holding the shared rate limit and error state. Default is {RATE_STATE}.")
+
+    p.add_argument('--metrics',
+                   metavar='[FILE]', type=str, required=False, default=None,
+                   help="write wait/download histograms, retries, bytes, throughput and browser memory "
+                        "to this Prometheus textfile at the end of the run.")
+
+    p.add_argument('--trace',
+                   metavar='[FILE]', type=str, required=False, default=None,
+                   help="write the waits and download stages of the run to this Chrome trace file.")
+
+    p.add_argument('--url',
+                   metavar='[URL]', type=str, required=False, default=EPICOV_URL,
+                   help="address of the EpiCoV site, e.g. a gisaid_EpiCoV_mock_server.py. "
+                        f"Default is {EPICOV_URL}.")
+
+    p.add_argument('--lean',
+                   action='store_true', help='run firefox without images, web fonts, media, prefetching, telemetry '
+                                             'and extra content processes.')
+
     p.add_argument('--normal',
                    action='store_true', help='run firefox in normal mode.')
 
@@ -103,6 +399,11 @@ def parse_params():
     args_parsed = p.parse_args()
     if not args_parsed.outdir:
         args_parsed.outdir = os.getcwd()
+    if args_parsed.artifacts:
+        args_parsed.artifacts = [key.strip().lower() for key in args_parsed.artifacts.split(",") if key.strip()]
+        unknown = set(args_parsed.artifacts) - set(key for key, _, _ in NEXTSTRAIN_ARTIFACTS)
+        if unknown:
+            p.error(f"unknown --artifacts: {', '.join(sorted(unknown))}")
     return args_parsed
 
 
@@ -124,10 +425,36 @@ def download_gisaid_EpiCoV(
         rt,        # num of retry
         iv,        # interval in sec
         nnd,       # do not download nextstrain data
-        ffbin      # firefox binary path
+        ffbin,     # firefox binary path
+        cc=False,  # download nextstrain data concurrently
+        session=None,  # login session file
+        sd=None,   # shard size in days
+        nw=1,      # num of browsers for shards
+        mr=None,   # max records per shard
+        sync=False,  # append new submissions to the master files
+        resume=False,  # skip the steps finished by the last attempt
+        http=None,  # hand transfers to http_download(): {"connections", "chunk_size"}
+        artifacts=None,  # keys of the nextstrain artifacts to download, all when None
+        metrics=None,  # Prometheus textfile written at the end of the run
+        trace=None,  # Chrome trace file written at the end of the run
+        lean=False,  # run firefox with LEAN_PREFS
+        store=False,  # load the downloaded metadata into the SQLite store of wd
+        index=False,  # build faidx indexes of the downloaded FASTA files
+        pack=False,  # pack the downloaded alignments into .msa4 matrices
+        diff=False  # write what changed since the previous nextstrain download
     ):
     """Download sequences and metadata from EpiCoV GISAID"""
 
+    # fetch only what was submitted since the last sync
+    if sync:
+        state = read_sync_state(os.path.abspath(wd))
+        ss = state.get("high_water_mark") or ss
+        if not ss:
+            logging.error("The first --sync run needs a submission start date (-ss).")
+            sys.exit(1)
+        nnd = True
+        logging.info(f"Syncing submissions since {ss}...")
+
     # when user doesn't download nextstrain data, it's essential to enter time range/location
     if not (cs or ce or ss or se or loc) and nnd:
         logging.error("No time range or location entered.")
@@ -141,6 +468,552 @@ def download_gisaid_EpiCoV(
     GISAID_DTL_JASON = f'{wd}/gisaid_detail_metadata.json'
     metadata = []
 
+    # start fresh
+    if not resume:
+        try:
+            os.remove(GISAID_DTL_JASON)
+        except OSError:
+            pass
+
+    journal = Journal(f'{wd}/{JOURNAL}', {
+        "location": loc, "host": host,
+        "colstart": cs, "colend": ce, "substart": ss, "subend": se,
+        "complete": cg, "highcoverage": hc, "lowcoverageExcl": le,
+        "nonextstraindata": nnd, "artifacts": artifacts, "sharddays": sd, "maxrecords": mr, "sync": sync,
+    }, resume)
+
+    started = time.time()
+    epicov = SeleniumBackend(wd, normal, ffbin, to, lean)
+    try:
+        epicov.open()
+    except EpiCoVError as e:
+        logging.error(e)
+        sys.exit(1)
+
+    status = "failed"
+    try:
+        epicov.login(uname, upass, session)
+        journal.record("login", [])
+
+        # download nextstrain data
+        if not nnd:
+            epicov.download_artifacts(rt, iv, cc, journal, http, artifacts)
+            if diff and (not artifacts or "metadata" in artifacts):
+                diff_downloads(wd, not artifacts or "fasta" in artifacts)
+            if store:
+                try:
+                    update_store(wd)
+                except (ValueError, sqlite3.Error) as e:
+                    raise EpiCoVError(f"Could not load the metadata into the store: {e}")
+            if index and find_snapshot(wd, "fasta"):
+                index_downloads([find_snapshot(wd, "fasta")])
+            if pack:
+                pack_alignments(wd)
+
+        if cs or ce or ss or se or loc:
+            fns = []
+            query = {
+                "location": loc, "host": host,
+                "colstart": cs, "colend": ce, "substart": ss, "subend": se,
+                "complete": cg, "highcoverage": hc, "lowcoverageExcl": le,
+                "http": http,
+            }
+            try:
+                if sd or mr:
+                    fns = epicov.query_sharded(query, sd, nw, rt, iv, mr, journal)
+                else:
+                    fns = epicov.query(query, rt, iv, journal, http)
+            except NoDataFound:
+                if not sync:
+                    raise
+
+            if index:
+                index_downloads(fns)
+            if sync:
+                sync_master(wd, fns, ss)
+        status = "ok"
+    except EpiCoVError as e:
+        logging.error(e)
+    finally:
+        # failed runs too, including those that crash on anything else
+        epicov.export_metrics(started, status, metrics, trace)
+        epicov.close()
+    if status != "ok":
+        sys.exit(1)
+
+
+def diff_downloads(wd, sequences=True):
+    """compare the newest metadata (and FASTA) download in wd with the previous one"""
+    new_metadata = find_snapshot(wd, "metadata")
+    old_metadata = previous_snapshot(wd, "metadata")
+    if not old_metadata:
+        logging.info("No previous metadata download to compare with.")
+        return
+    old_fasta = new_fasta = None
+    if sequences:
+        old_fasta = previous_snapshot(wd, "fasta")
+        new_fasta = find_snapshot(wd, "fasta")
+    try:
+        diff_snapshots(old_metadata, old_fasta, new_metadata, new_fasta,
+                       f"{wd}/gisaid_diff_{snapshot_stem(new_metadata)}")
+    except (OSError, ValueError) as e:
+        raise EpiCoVError(f"Could not compare the downloads: {e}")
+
+
+def index_downloads(fns):
+    """faidx index the FASTA files among fns"""
+    for fn in fns:
+        if download_kind(fn) == "fasta" or fn.endswith((".tar", ".tar.xz", ".tar.gz", ".tar.bz2")):
+            try:
+                index_fasta(fn)
+            except (OSError, ValueError) as e:
+                raise EpiCoVError(f"Could not index {os.path.basename(fn)}: {e}")
+
+
+def pack_alignments(wd):
+    """pack the newest download of each MSA artifact in wd"""
+    for key in ("msa-full", "msa-unmasked", "msa-masked"):
+        fn = find_snapshot(wd, key)
+        if fn:
+            try:
+                pack_msa(fn)
+            except (OSError, ValueError) as e:
+                raise EpiCoVError(f"Could not pack {os.path.basename(fn)}: {e}")
+
+
+def make_backend(backend, wd, normal, ffbin, to, lean=False, url=None, limiter=None):
+    """the SeleniumBackend, or for "http" the HttpBackend of the mock site"""
+    if backend == "http":
+        return HttpBackend(wd, url=url, limiter=limiter)
+    return SeleniumBackend(wd, normal, ffbin, to, lean, url, limiter)
+
+
+class SeleniumBackend:
+    """run the EpiCoV steps in firefox, the way a user would
+
+    url is the EpiCoV site and limiter the RateLimiter of its requests, those
+    of the command line (--url, --ratelimit) when None.
+    """
+
+    def __init__(self, wd, normal, ffbin, to, lean=False, url=None, limiter=None):
+        self.wd = wd
+        self.site_url = url or GISAID_URL
+        self.limiter = limiter or RATE_LIMITER
+        self.normal = normal
+        self.ffbin = ffbin
+        self.to = to
+        self.lean = lean
+        self.driver = None
+        self.credentials = None
+
+    def open(self):
+        self.driver = open_browser(self.wd, self.normal, self.ffbin, self.lean)
+
+    def login(self, uname, upass, session=None):
+        self.credentials = (uname, upass, session)
+        login_EpiCoV(self.driver, self.to, uname, upass, session, self.site_url, self.limiter)
+        sample_browser_rss(self.driver)
+
+    def download_artifacts(self, rt, iv, cc=False, journal=None, http=None, keys=None):
+        fns = download_nextstrain(self.driver, self.to, self.wd, rt, iv, cc, journal, http, keys, self.limiter)
+        sample_browser_rss(self.driver)
+        return fns
+
+    def query(self, query, rt, iv, journal=None, http=None):
+        return query_EpiCoV(self.driver, self.to, self.wd, *[query.get(key) for key in QUERY_KEYS],
+                            rt, iv, journal, http, self.limiter)
+
+    def start_browser(self, num):
+        """open and log in another browser for run_job_pool()"""
+        staging = os.path.join(self.wd, f".shard-worker-{num}")
+        os.makedirs(staging, exist_ok=True)
+        driver = open_browser(staging, self.normal, self.ffbin, self.lean)
+        try:
+            login_EpiCoV(driver, self.to, *self.credentials, self.site_url, self.limiter)
+        except Exception:
+            quit_driver(driver)
+            raise
+        return driver, self.to, staging
+
+    def query_sharded(self, query, days, nw, rt, iv, mr=None, journal=None):
+        return query_EpiCoV_sharded(self.wd, query, days, nw, rt, iv, [(self.driver, self.to, self.wd)],
+                                    self.start_browser, mr, journal, self.site_url, self.limiter)
+
+    def run_jobs(self, jobs, nw, rt, iv, journal=None, report=None):
+        return run_job_pool(jobs, nw, rt, iv, [(self.driver, self.to, self.wd)], self.start_browser,
+                            journal, report, self.site_url, self.limiter)
+
+    def reset(self):
+        navigate_EpiCoV(self.driver, self.to, self.site_url, self.limiter)
+
+    def upload(self, seq, metadata):
+        try:
+            wait = WebDriverWait(self.driver, self.to)
+            return uploader.upload_EpiCoV(wait, self.driver, dict(metadata, sequence=seq))
+        finally:
+            # the uploader probes with its own implicit wait
+            self.driver.implicitly_wait(IMPLICIT_WAIT)
+
+    def export_metrics(self, started, status, metrics=None, trace=None):
+        export_metrics(self.wd, self.driver, started, status, metrics, trace)
+
+    def close(self):
+        quit_driver(self.driver)
+
+
+class HttpBackend:
+    """run the EpiCoV steps as plain HTTP calls to HTTP_ENDPOINTS, without a browser
+
+    Only the mock site serves these endpoints, so this backend is for the
+    mock and gisaid_EpiCoV_benchmark.py (EpiCoVClient(backend="http")), not
+    the command line; open() refuses GISAID and any site whose state
+    endpoint does not answer like the mock's.
+    Logs in with a form POST and keeps the session cookies, reads the record
+    count from the browse endpoint and fetches the exports and artifacts with
+    http_download(). The --session file has the format of
+    uploader.save_session(), so both backends can share it.
+    """
+
+    def __init__(self, wd, endpoints=None, url=None, limiter=None):
+        self.wd = wd
+        self.endpoints = endpoints or HTTP_ENDPOINTS
+        self.site_url = url or GISAID_URL
+        self.limiter = limiter or RATE_LIMITER
+        self.cookies = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def open(self):
+        logging.info(f"Talking to {self.site_url} over HTTP...")
+        mock_only = f"HttpBackend only works with gisaid_EpiCoV_mock_server.py, not with {self.site_url}."
+        host = urllib.parse.urlsplit(self.site_url).hostname or ""
+        if any(host == name or host.endswith(f".{name}") for name in GISAID_HOSTS):
+            raise EpiCoVError(mock_only)
+        # never post credentials to a site that does not serve the endpoints
+        try:
+            state = self.call("state")
+        except (OSError, http.client.HTTPException, ValueError, EpiCoVError):
+            state = None
+        if not isinstance(state, dict) or "logged_in" not in state:
+            raise EpiCoVError(mock_only)
+
+    def url(self, endpoint, params=None, **kwargs):
+        url = urllib.parse.urljoin(self.site_url, self.endpoints[endpoint].format(**kwargs))
+        return f"{url}?{urllib.parse.urlencode(params)}" if params else url
+
+    def headers(self, url):
+        with self.lock:
+            return {"Cookie": cookie_header(self.cookies, url)}
+
+    def call(self, endpoint, params=None, form=None):
+        """request an endpoint, returns its JSON answer"""
+        self.limiter.acquire()
+        url = self.url(endpoint, params)
+        headers = self.headers(url)
+        body = None
+        if form is not None:
+            body = urllib.parse.urlencode(form, doseq=True)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        resp, url = http_get(self.local, url, headers, "GET" if body is None else "POST", body)
+        data = resp.read()
+        self.keep_cookies(resp, url)
+        if resp.status in (401, 403):
+            raise SessionExpired(f"Not logged in to {self.site_url}.")
+        if resp.status != 200:
+            raise EpiCoVError(f"HTTP {resp.status} {resp.reason} for {url}")
+        return json.loads(data)
+
+    def keep_cookies(self, resp, url):
+        """add the cookies set by resp to the session"""
+        host = urllib.parse.urlsplit(url).hostname
+        with self.lock:
+            for header in resp.msg.get_all("Set-Cookie") or []:
+                name, _, value = header.split(";", 1)[0].strip().partition("=")
+                self.cookies = [c for c in self.cookies if c["name"] != name]
+                self.cookies.append({"name": name, "value": value, "path": "/", "domain": host})
+
+    def login(self, uname, upass, session=None):
+        if session:
+            state = uploader.read_session(session)
+            if state:
+                self.cookies = [{k: v for k, v in c.items() if k in uploader.SESSION_COOKIE_KEYS}
+                                for c in state.get("cookies", [])]
+                if self.call("state").get("logged_in"):
+                    logging.info("Restored GISAID session.")
+                    return
+                logging.info("Saved session expired.")
+                self.cookies = []
+
+        logging.info("Logining to GISAID...")
+        result = self.call("login", form={"login": uname, "password": upass})
+        if not result.get("ok"):
+            raise EpiCoVError(f"Login failed: {result.get('error')}")
+
+        if session:
+            uploader.write_session(session, {
+                "saved": time.strftime('%Y-%m-%d %H:%M:%S'),
+                "url": self.site_url,
+                "cookies": self.cookies,
+                "localStorage": {},
+            })
+
+    def fetch(self, url, timer, settings, rt, iv):
+        """download url into wd, named after its Content-Disposition, returns the path"""
+        headers = self.headers(url)
+        retry = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                url, size, ranged, name = http_probe(self.local, url, headers)
+                timer.lap("start")
+                fn = http_download(url, os.path.join(self.wd, name), headers, size, ranged,
+                                   settings["connections"], settings["chunk_size"], rt, iv, self.limiter)
+                timer.lap("complete")
+                return fn
+            except (OSError, http.client.HTTPException, EpiCoVError) as e:
+                http_close(self.local)
+                if retry == rt:
+                    raise EpiCoVError(f"{timer.name} failed: {e!r}")
+                retry += 1
+                delay = retry_delay("http backend", retry, iv, self.limiter)
+                logging.info(f"retrying {timer.name}...#{retry} in {delay:.1f} sec(s)")
+                time.sleep(delay)
+
+    def download_all(self, steps, settings, rt, iv, workers, journal=None):
+        """fetch (step, url) pairs over up to `workers` threads, recording each step when done"""
+        def download(step):
+            name, url = step
+            timer = StageTimer(self.wd, name)
+            try:
+                fn = self.fetch(url, timer, settings, rt, iv)
+            except Exception:
+                timer.write(None)
+                raise
+            timer.write(fn)
+            logging.info(f" -- downloaded to {fn}.")
+            if journal:
+                journal.record(name, [fn])
+            return fn
+
+        with concurrent.futures.ThreadPoolExecutor(max(1, workers)) as executor:
+            return list(executor.map(download, steps))
+
+    def download_artifacts(self, rt, iv, cc=False, journal=None, http=None, keys=None):
+        artifacts, fns = pending_artifacts(journal, keys)
+        if not artifacts:
+            return fns
+        logging.info(f"Downloading {len(artifacts)} nextstrain artifact(s)...")
+        steps = [(f"artifact:{name}", self.url("artifact", key=key)) for key, name, _ in artifacts]
+        return fns + self.download_all(steps, http or HTTP_SINGLE, rt, iv, len(steps) if cc else 1, journal)
+
+    def browse_params(self, query):
+        params = {}
+        for key, param in HTTP_BROWSE_PARAMS.items():
+            value = query.get(key)
+            if value:
+                params[param] = "1" if value is True else value
+        return params
+
+    def query(self, query, rt, iv, journal=None, http=None):
+        num_download_options, pending, fns = pending_options(journal)
+        if num_download_options and not pending:
+            return fns
+
+        logging.info("Browsing EpiCoV...")
+        params = self.browse_params(query)
+        result = self.call("browse", params)
+        if not result["count"]:
+            raise NoDataFound("No data found.")
+        logging.info(f"{result['count']} record(s) pass the filters.")
+
+        if num_download_options is None:
+            pending = list(range(len(result["options"])))
+            if journal:
+                journal.record("options", [], {"count": len(pending)})
+        steps = [(f"option:{option}", self.url("export", params, option=option)) for option in pending]
+        return fns + self.download_all(steps, http or HTTP_SINGLE, rt, iv, len(steps), journal)
+
+    def query_sharded(self, query, days, nw, rt, iv, mr=None, journal=None):
+        def preflight(windows, start_key, end_key):
+            def count(start, end):
+                n = self.call("browse", self.browse_params(dict(query, **{start_key: start, end_key: end})))["count"]
+                logging.info(f" -- {start} to {end}: {n} record(s)")
+                return n
+
+            logging.info(f"Counting records to keep every shard under {mr}...")
+            return bisect_windows(windows, count, mr)
+
+        start_key, end_key, start, end, windows = plan_shards(query, days, journal, preflight if mr else None)
+        logging.info(f"Querying {start} to {end} in {len(windows)} shard(s) over up to {nw} connection(s)...")
+        results = self.run_jobs(shard_jobs(self.wd, query, start_key, end_key, windows), nw, rt, iv, journal)
+        fns = [fn for files in results for fn in files]
+        return merge_downloads(fns, os.path.join(self.wd, f"gisaid_{start_key[:3]}_{start}_{end}"))
+
+    def run_jobs(self, jobs, nw, rt, iv, journal=None, report=None):
+        """run query jobs into their outdir over up to nw connections, see run_job_pool()"""
+        def run(idx):
+            job = jobs[idx]
+            done = journal.done(job["step"]) if journal and "step" in job else None
+            if done is not None:
+                logging.info(f"{job['step']} downloaded already.")
+                if report is not None:
+                    report[idx] = {"status": "resumed", "files": done}
+                return done
+            startTime = time.time()
+            backend = HttpBackend(job["outdir"], self.endpoints, self.site_url, self.limiter)
+            backend.cookies = self.cookies
+            os.makedirs(backend.wd, exist_ok=True)
+            try:
+                try:
+                    fns = backend.query(job, rt, iv, None, job.get("http"))
+                except NoDataFound:
+                    fns = []
+            except Exception as e:
+                if report is not None:
+                    report[idx] = {"status": "failed", "secs": round(time.time() - startTime, 3), "error": repr(e)}
+                raise
+            if report is not None:
+                report[idx] = {"status": "ok", "files": fns, "secs": round(time.time() - startTime, 3)}
+            if journal and "step" in job:
+                journal.record(job["step"], fns)
+            return fns
+
+        with concurrent.futures.ThreadPoolExecutor(max(1, nw)) as executor:
+            futures = [executor.submit(run, idx) for idx in range(len(jobs))]
+        # the jobs share the session, log in again rather than fail them all
+        expired = [future.exception() for future in futures if isinstance(future.exception(), SessionExpired)]
+        if expired:
+            raise expired[0]
+        errors = [f"job {idx}: {future.exception()!r}" for idx, future in enumerate(futures) if future.exception()]
+        if errors:
+            raise EpiCoVError(f"{len(errors)} job(s) failed: " + "; ".join(errors))
+        return [future.result() for future in futures]
+
+    def reset(self):
+        pass
+
+    def upload(self, seq, metadata):
+        raise EpiCoVError("Uploads need the selenium backend.")
+
+    def export_metrics(self, started, status, metrics=None, trace=None):
+        export_metrics(self.wd, None, started, status, metrics, trace)
+
+    def close(self):
+        http_close(self.local)
+
+
+# what an EpiCoVClient operation returns: the downloaded files, the StageTimer
+# records of its downloads, its wall time and the messages of an upload
+Result = collections.namedtuple("Result", ["files", "timings", "secs", "messages"])
+
+
+class EpiCoVClient:
+    """one logged in EpiCoV session for running many operations in a process
+
+        with EpiCoVClient(uname, upass, "/data/gisaid") as client:
+            client.download_artifacts(["metadata"])
+            result = client.query({"location": "USA", "colstart": "2021-05-01"})
+
+    The browser (or HTTP session) is started and logged in on first use and
+    kept until close(). Operations return a Result and raise EpiCoVError,
+    NoDataFound, DownloadTimeout, ... instead of exiting; an expired session
+    is logged in again once.
+
+    url is the EpiCoV site and limiter the RateLimiter of the requests of
+    this client, those of the command line (--url, --ratelimit) when None.
+    """
+
+    def __init__(self, uname, upass, wd, backend="selenium", session=None, normal=False, ffbin=None,
+                 to=90, rt=5, iv=3, http=None, lean=False, url=None, limiter=None):
+        self.uname = uname
+        self.upass = upass
+        self.session = session
+        self.wd = os.path.abspath(wd)
+        self.rt = rt
+        self.iv = iv
+        self.http = http
+        os.makedirs(self.wd, exist_ok=True)
+        self.backend = make_backend(backend, self.wd, normal, ffbin, to, lean, url, limiter)
+        self.opened = False
+        self.logged_in = False
+        self.moved = False
+
+    def __enter__(self):
+        self.login()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def login(self):
+        if not self.opened:
+            self.backend.open()
+            self.opened = True
+        self.backend.login(self.uname, self.upass, self.session)
+        self.logged_in = True
+        self.moved = False
+
+    def run(self, operation):
+        """run operation() in the logged in session, returns its Result"""
+        if not self.logged_in:
+            self.login()
+        startTime = time.time()
+        with METRICS_LOCK:
+            first = len(DOWNLOAD_STATS)
+        for attempt in range(2):
+            try:
+                # back to the start page when an earlier operation left it
+                if self.moved:
+                    self.backend.reset()
+                self.moved = True
+                files = operation()
+                break
+            except SessionExpired:
+                if attempt:
+                    raise
+                logging.info("GISAID session expired, logging in again...")
+                self.login()
+        with METRICS_LOCK:
+            timings = DOWNLOAD_STATS[first:]
+        return Result(files, timings, round(time.time() - startTime, 3), [])
+
+    def download_artifacts(self, keys=None, parallel=False):
+        """download the nextstrain artifacts, all or those in keys (see NEXTSTRAIN_ARTIFACTS)"""
+        return self.run(lambda: self.backend.download_artifacts(self.rt, self.iv, parallel, None, self.http, keys))
+
+    def query(self, filters, days=None, workers=1, max_records=None):
+        """download the genomes that pass filters, a dict with keys of QUERY_KEYS
+
+        days, workers and max_records shard the query like -sd, -w and -mr.
+        """
+        unknown = set(filters) - set(QUERY_KEYS)
+        if unknown:
+            raise ValueError(f"unknown filters: {', '.join(sorted(unknown))}")
+        query = dict({key: None for key in QUERY_KEYS}, **filters)
+        if days or max_records:
+            query["http"] = self.http
+            return self.run(lambda: self.backend.query_sharded(query, days, workers, self.rt, self.iv,
+                                                               max_records, None))
+        return self.run(lambda: self.backend.query(query, self.rt, self.iv, None, self.http))
+
+    def upload(self, seq, metadata):
+        """submit one sequence with its metadata (keys of the uploader's metadata file)"""
+        messages = []
+
+        def submit():
+            messages[:] = self.backend.upload(seq, metadata)
+            return []
+
+        return self.run(submit)._replace(messages=messages)
+
+    def close(self):
+        if self.opened:
+            self.backend.close()
+        self.opened = self.logged_in = False
+
+
+def open_browser(wd, normal, ffbin, lean=False):
+    """start a firefox webdriver that saves downloads to wd, with LEAN_PREFS for lean"""
     # MIME types
     mime_types = "application/octet-stream"
     mime_types += ",application/excel,application/vnd.ms-excel"
@@ -148,14 +1021,12 @@ def download_gisaid_EpiCoV(
     mime_types += ",application/x-bzip2"
     mime_types += ",application/x-gzip,application/gzip"
 
-    # start fresh
-    try:
-        os.remove(GISAID_DTL_JASON)
-    except OSError:
-        pass
-
     logging.info("Opening browser...")
+    startTime = time.time()
     profile = webdriver.FirefoxProfile()
+    if lean:
+        for name, value in LEAN_PREFS.items():
+            profile.set_preference(name, value)
     profile.set_preference("browser.download.folderList", 2)
     profile.set_preference("browser.download.manager.showWhenStarting", False)
     profile.set_preference("browser.download.dir", wd)
@@ -172,325 +1043,450 @@ def download_gisaid_EpiCoV(
 
     driver = webdriver.Firefox(
         firefox_profile=profile, options=options, firefox_binary=ffbin)
+    record_wait("browser start", startTime, time.time())
 
     # driverwait
-    driver.implicitly_wait(30)
-    wait = WebDriverWait(driver, to)
+    driver.implicitly_wait(IMPLICIT_WAIT)
+    return driver
+
+
+def load_page(driver, url, limiter=None):
+    """open url in the browser, timing the load as the "page load" wait"""
+    (limiter or RATE_LIMITER).acquire()
+    startTime = time.time()
+    try:
+        driver.get(url)
+    finally:
+        record_wait("page load", startTime, time.time())
+
+
+def download_nextstrain(driver, to, wd, rt, iv, cc=False, journal=None, http=None, keys=None, limiter=None):
+    """download the artifacts in the Downloads section (all or those in keys), returns the downloaded files"""
+    artifacts, fns = pending_artifacts(journal, keys)
+    if not artifacts:
+        return fns
+
+    # download from downloads section
+    logging.info("Clicking downloads...")
+    pd_button = wait_until(driver, EC.element_to_be_clickable(
+        (By.XPATH, "//div[@class='sys-actionbar-bar']//div[3]")), "downloads button", to)
+    pd_button.click()
+
+    waiting_sys_timer(driver, to)
+
+    # have to click the first row twice to start the iframe
+    iframe_dl = waiting_for_iframe(driver, to, rt, iv, limiter)
+
+    if cc:
+        # queue every artifact up front and let firefox run the transfers in parallel
+        existing = scan_download_dir(wd)
+        seen = dict(existing)
+        started = {}
+        transfers = {}
+        timers = {}
+        times = {}
+        completed = []
+        for _, name, xpath in artifacts:
+            timer = StageTimer(wd, name)
+            request_artifact(driver, to, iframe_dl, name, xpath, rt, iv, timer, limiter)
+            fn = wait_download_started(wd, seen)
+            timer.lap("start")
+            seen[fn] = 0
+            started[fn] = name
+            timers[fn] = timer
+            transfer = handoff_download(driver, wd, fn, http, rt, iv, limiter) if http else None
+            if transfer:
+                transfers[fn] = transfer
+        try:
+            completed = finish_downloads(wd, existing, list(started), transfers, 600, times)
+            pending = [fn for fn in started if os.path.join(wd, fn) not in completed]
+            if pending:
+                raise DownloadTimeout(f"{len(completed)} of {len(started)} downloads completed; pending: {pending}",
+                                      completed, [os.path.join(wd, fn) for fn in pending])
+        finally:
+            for fn in completed:
+                logging.info(f" -- downloaded to {fn}.")
+                name = started.get(os.path.basename(fn))
+                if journal and name:
+                    journal.record(f"artifact:{name}", [fn])
+            for fn, timer in timers.items():
+                path = os.path.join(wd, fn)
+                if fn in times:
+                    timer.lap("complete", times[fn])
+                timer.write(path if path in completed else None)
+        fns += completed
+    else:
+        for _, name, xpath in artifacts:
+            timer = StageTimer(wd, name)
+            try:
+                existing = scan_download_dir(wd)
+                request_artifact(driver, to, iframe_dl, name, xpath, rt, iv, timer, limiter)
+                started = wait_download_started(wd, existing)
+                timer.lap("start")
+                transfer = handoff_download(driver, wd, started, http, rt, iv, limiter) if http else None
+                fn = transfer() if transfer else track_downloads(wd, existing, 1, 600)[0]
+                timer.lap("complete")
+            except Exception:
+                timer.write(None)
+                raise
+            timer.write(fn)
+            logging.info(f" -- downloaded to {fn}.")
+            if journal:
+                journal.record(f"artifact:{name}", [fn])
+            fns.append(fn)
+
+    waiting_sys_timer(driver, to)
+
+    # go back to main frame
+    driver.switch_to.frame(iframe_dl)
+    back_button = driver.find_element_by_xpath('//button[contains(text(), "Back")]')
+    back_button.click()
+
+    driver.switch_to.default_content()
+    waiting_sys_timer(driver, to)
+    return fns
+
+
+def pending_artifacts(journal=None, keys=None):
+    """the artifacts (all or those in keys) still to download, and the files of those finished already"""
+    artifacts = []
+    fns = []
+    for key, name, xpath in NEXTSTRAIN_ARTIFACTS:
+        if keys and key not in keys:
+            continue
+        done = journal.done(f"artifact:{name}") if journal else None
+        if done is None:
+            artifacts.append((key, name, xpath))
+        else:
+            logging.info(f"{name} downloaded already.")
+            fns += done
+    return artifacts, fns
+
+
+def set_browse_filters(driver, to, loc, host, cs, ce, ss, se, cg, hc, le, limiter=None):
+    """open Browse and apply the filters"""
+    logging.info("Browsing EpiCoV...")
+    browse_tab = wait_until(driver, EC.element_to_be_clickable(
+        (By.XPATH, '//*[contains(text(), "Browse")]')), "browse tab", to)
+    (limiter or RATE_LIMITER).acquire()
+    browse_tab.click()
+    waiting_sys_timer(driver, to)
+    waiting_table_to_get_ready(driver, to)
+
+    # set location
+    if loc:
+        logging.info("Setting location...")
+        loc_input = driver.find_element_by_xpath(
+            "//td/div[contains(text(), 'Location')]/../following-sibling::td/div/div/input"
+        )
+        before = table_signature(driver)
+        loc_input.send_keys(loc)
+        waiting_table_to_change(driver, to, before)
+
+    # set host
+    if host:
+        logging.info("Setting host...")
+        host_input = driver.find_element_by_xpath(
+            "//td/div[contains(text(), 'Host')]/../following-sibling::td/div/div/input"
+        )
+        before = table_signature(driver)
+        host_input.send_keys(host)
+        waiting_table_to_change(driver, to, before)
+
+    # set dates
+    if cs or ce or ss or se:
+        logging.info("Setting date...")
+        set_date_filters(driver, to, (cs, ce, ss, se), limiter)
+
+    # complete genome only
+    if cg:
+        logging.info("complete genome only...")
+        checkbox = driver.find_element_by_xpath('//input[@value="complete"]')
+        before = table_signature(driver)
+        checkbox.click()
+        waiting_table_to_change(driver, to, before)
 
+    # high coverage only
+    if hc:
+        logging.info("high coverage only...")
+        checkbox = driver.find_element_by_xpath('//input[@value="highq"]')
+        before = table_signature(driver)
+        checkbox.click()
+        waiting_table_to_change(driver, to, before)
+
+    # excluding low coverage
+    if le:
+        logging.info("low coverage excluding...")
+        checkbox = driver.find_element_by_xpath('//input[@value="lowco"]')
+        before = table_signature(driver)
+        checkbox.click()
+        waiting_table_to_change(driver, to, before)
+
+
+def set_date_filters(driver, to, dates, limiter=None):
+    """fill in the collection and submission date inputs, clearing the empty ones"""
+    date_inputs = driver.find_elements_by_css_selector(
+        "div.sys-form-fi-date input")
+    (limiter or RATE_LIMITER).acquire()
+    before = table_signature(driver)
+    for dinput, date in zip(date_inputs, dates):
+        dinput.clear()
+        if date:
+            dinput.send_keys(date)
+
+    ActionChains(driver).send_keys(Keys.ESCAPE).perform()
+    waiting_table_to_change(driver, to, before)
+
+
+def read_record_count(driver):
+    """read how many records pass the filters from the info bar of the browse table"""
+    if probe_element(driver, By.XPATH, "//div[contains(text(), 'No data found.')]"):
+        return 0
+    info = probe_element(driver, By.CSS_SELECTOR, "td.sys-datatable-info")
+    if not info:
+        return None
+    m = re.search(r"Total:\s*([\d,.']+)", info.text) or re.search(r"(\d[\d,.']*)", info.text)
+    if not m:
+        return None
+    return int(re.sub(r"\D", "", m.group(1)))
+
+
+def query_EpiCoV(driver, to, wd, loc, host, cs, ce, ss, se, cg, hc, le, rt, iv, journal=None, http=None,
+                 limiter=None):
+    """filter genomes in Browse and download them, returns the downloaded files"""
+    num_download_options, pending, fns = pending_options(journal)
+    if num_download_options and not pending:
+        return fns
+
+    set_browse_filters(driver, to, loc, host, cs, ce, ss, se, cg, hc, le, limiter)
+
+    # check if any genomes pass filters
+    warning_message = probe_element(driver, By.XPATH, "//div[contains(text(), 'No data found.')]")
+    if warning_message:
+        raise NoDataFound("No data found.")
+    logging.info(f"{read_record_count(driver)} record(s) pass the filters.")
+
+    # select all genomes
+    logging.info("Selecting all genomes...")
+    button_sa = driver.find_element_by_css_selector("span.yui-dt-label input")
+    button_sa.click()
+    waiting_sys_timer(driver, to)
+
+    # request every pending option back to back, track the downloads together
+    # and retry the options that failed on their own
+    if num_download_options is None:
+        pending = [0]
+    retries = {}
+    while pending:
+        existing = scan_download_dir(wd)
+        seen = dict(existing)
+        started = {}
+        transfers = {}
+        timers = {}
+        times = {}
+        errors = {}
+        for option in pending:
+            timer = StageTimer(wd, f"option:{option}")
+            try:
+                logging.info(f"Requesting download option {option}...")
+                count = request_download_option(driver, to, rt, iv, option, limiter)
+                timer.lap("request")
+                fn = wait_download_started(wd, seen)
+                timer.lap("start")
+            except Exception as e:
+                errors[option] = e
+                timer.write(None)
+                driver.switch_to.default_content()
+                continue
+            seen[fn] = 0
+            started[fn] = option
+            timers[fn] = timer
+            if num_download_options is None:
+                # the dialog tells how many options there are
+                num_download_options = count
+                pending += list(range(1, count))
+                if journal:
+                    journal.record("options", [], {"count": count})
+            transfer = handoff_download(driver, wd, fn, http, rt, iv, limiter) if http else None
+            if transfer:
+                transfers[fn] = transfer
+
+        completed = finish_downloads(wd, existing, list(started), transfers, 1800, times)
+        for fn, option in started.items():
+            path = os.path.join(wd, fn)
+            if fn in times:
+                timers[fn].lap("complete", times[fn])
+            timers[fn].write(path if path in completed else None)
+            if path in completed:
+                logging.info(f"Downloaded to {path}.")
+                if journal:
+                    journal.record(f"option:{option}", [path])
+                fns.append(path)
+            else:
+                errors[option] = DownloadTimeout(f"{fn} did not complete.", [], [path])
+
+        pending = sorted(errors)
+        delay = 0
+        for option in pending:
+            retries[option] = retries.get(option, 0) + 1
+            if retries[option] > rt:
+                raise EpiCoVError(f"Download option {option} failed: {errors[option]!r}")
+            delay = max(delay, retry_delay("download option", retries[option], iv, limiter))
+        if pending:
+            logging.info(f"retrying download option(s) {', '.join(map(str, pending))} in {delay:.1f} sec(s)")
+            time.sleep(delay)
+    return fns
+
+
+def pending_options(journal=None):
+    """the download options finished by an earlier attempt of this run
+
+    Returns (number of options or None if not known yet, options still to
+    download, files of the finished ones).
+    """
+    options = journal.entry("options") if journal else None
+    num_download_options = options["data"]["count"] if options else None
+    pending = []
+    fns = []
+    for option in range(num_download_options or 0):
+        done = journal.done(f"option:{option}")
+        if done is None:
+            pending.append(option)
+        else:
+            logging.info(f"Download option {option} downloaded already.")
+            fns += done
+    return num_download_options, pending, fns
+
+
+def request_download_option(driver, to, rt, iv, option, limiter=None):
+    """request one option of the Browse download dialog, returns the number of options"""
+    button = driver.find_element_by_xpath(
+        "//td[@class='sys-datatable-info']/button[contains(text(), 'Download')]")
+    (limiter or RATE_LIMITER).acquire()
+    button.click()
+    waiting_sys_timer(driver, to)
+
+    # switch to iframe
+    iframe = waiting_for_iframe(driver, to, rt, iv, limiter)
+    driver.switch_to.frame(iframe)
+    waiting_sys_timer(driver, to)
+
+    # selecting options
+    labels = driver.find_elements_by_xpath("//label")
+    labels[option].click()
+
+    button = driver.find_element_by_xpath(
+        "//button[contains(text(), 'Download')]")
+    button.click()
+    waiting_sys_timer(driver, to)
+    driver.switch_to.default_content()
+    return len(labels)
+
+
+def login_EpiCoV(driver, to, uname, upass, session=None, url=None, limiter=None):
+    """open GISAID (url, --url when None), login and navigate to EpiCoV, reusing a saved session if possible"""
     # open GISAID
     logging.info("Opening website GISAID...")
-    driver.get('https://www.epicov.org/epi3/frontend')
-    waiting_sys_timer(wait)
+    load_page(driver, url or GISAID_URL, limiter)
+    waiting_sys_timer(driver, to)
     logging.info(driver.title)
     assert 'GISAID' in driver.title
 
-    # login
-    logging.info("Logining to GISAID...")
-    username = driver.find_element_by_name('login')
-    username.send_keys(uname)
-    password = driver.find_element_by_name('password')
-    password.send_keys(upass)
-    driver.execute_script("return doLogin();")
+    if session and restore_session(driver, to, session, url, limiter):
+        if probe_element(driver, By.XPATH, "//div[@class='sys-actionbar-bar']"):
+            logging.info("Restored EpiCoV session.")
+            return
+        logging.info("Restored GISAID session.")
+    else:
+        # login
+        logging.info("Logining to GISAID...")
+        username = driver.find_element_by_name('login')
+        username.send_keys(uname)
+        password = driver.find_element_by_name('password')
+        password.send_keys(upass)
+        (limiter or RATE_LIMITER).acquire()
+        driver.execute_script("return doLogin();")
 
-    waiting_sys_timer(wait)
+        waiting_sys_timer(driver, to)
 
     # navigate to EpiFlu
     logging.info("Navigating to EpiCoV...")
     epicov_tab = driver.find_element_by_xpath("//div[@id='main_nav']//li[3]/a")
     epicov_tab.click()
 
-    waiting_sys_timer(wait)
-
-    # download nextstrain data
-    if not nnd:
-        # download from downloads section
-        logging.info("Clicking downloads...")
-        pd_button = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, "//div[@class='sys-actionbar-bar']//div[3]")))
-        pd_button.click()
-
-        waiting_sys_timer(wait)
-
-        # have to click the first row twice to start the iframe
-        iframe_dl = waiting_for_iframe(wait, driver, rt, iv)
-
-        logging.info("Downloading metadata...")
-        driver.switch_to.frame(iframe_dl)
-        waiting_sys_timer(wait)
-        dl_button = driver.find_element_by_xpath('//div[contains(text(), "metadata")]')
-        dl_button.click()
-        waiting_sys_timer(wait)
-        # waiting for REMINDER
-        iframe = waiting_for_iframe(wait, driver, rt, iv)
-        driver.switch_to.frame(iframe)
-        waiting_sys_timer(wait)
-        # agree terms and conditions
-        logging.info(" -- agreeing terms and conditions")
-        checkbox = driver.find_element_by_xpath('//input[@class="sys-event-hook"]')
-        checkbox.click()
-        waiting_sys_timer(wait)
-        # click download button
-        dl_button = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, '//button[contains(text(), "Download")]')))
-        dl_button.click()
-        waiting_sys_timer(wait)
-        logging.info(" -- downloading")
-        # Opening Firefox downloading window
-        driver.switch_to.default_content()
-        fn = wait_downloaded_filename(wait, driver, 600)
-        logging.info(f" -- downloaded to {fn}.")
-        
-        waiting_sys_timer(wait)
-
-        logging.info("Downloading FASTA...")
-        driver.switch_to.frame(iframe_dl)
-        waiting_sys_timer(wait)
-        # click nextfasta button
-        dl_button = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, '//div[text()="FASTA"]')))
-        dl_button.click()
-        waiting_sys_timer(wait)
-        # waiting for REMINDER
-        iframe = waiting_for_iframe(wait, driver, rt, iv)
-        driver.switch_to.frame(iframe)
-        waiting_sys_timer(wait)
-        # agree terms and conditions
-        logging.info(" -- agreeing terms and conditions")
-        checkbox = driver.find_element_by_xpath('//input[@class="sys-event-hook"]')
-        checkbox.click()
-        waiting_sys_timer(wait)
-        # click download button
-        dl_button = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, '//button[contains(text(), "Download")]')))
-        dl_button.click()
-        waiting_sys_timer(wait)
-        logging.info(" -- downloading")
-        # Opening Firefox downloading window
-        driver.switch_to.default_content()
-        fn = wait_downloaded_filename(wait, driver, 600)
-        logging.info(f" -- downloaded to {fn}.")
-
-        waiting_sys_timer(wait)
-
-        logging.info("Downloading MSA full...")
-        driver.switch_to.frame(iframe_dl)
-        waiting_sys_timer(wait)
-        # click MSA full button
-        dl_button = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, '//div[contains(text(), "MSA full")]')))
-        dl_button.click()
-        waiting_sys_timer(wait)
-        # waiting for REMINDER
-        iframe = waiting_for_iframe(wait, driver, rt, iv)
-        driver.switch_to.frame(iframe)
-        waiting_sys_timer(wait)
-        # agree terms and conditions
-        logging.info(" -- agreeing terms and conditions")
-        checkbox = driver.find_element_by_xpath('//input[@class="sys-event-hook"]')
-        checkbox.click()
-        waiting_sys_timer(wait)
-        # click download button
-        dl_button = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, '//button[contains(text(), "Download")]')))
-        dl_button.click()
-        waiting_sys_timer(wait)
-        logging.info(" -- downloading")
-        # Opening Firefox downloading window
-        driver.switch_to.default_content()
-        fn = wait_downloaded_filename(wait, driver, 600)
-        logging.info(f" -- downloaded to {fn}.")
-
-
-        waiting_sys_timer(wait)
-
-        logging.info("Downloading MSA unmasked...")
-        driver.switch_to.frame(iframe_dl)
-        waiting_sys_timer(wait)
-        # click MSA unmasked button
-        dl_button = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, '//div[contains(text(), "MSA unmasked")]')))
-        dl_button.click()
-        waiting_sys_timer(wait)
-        # waiting for REMINDER
-        iframe = waiting_for_iframe(wait, driver, rt, iv)
-        driver.switch_to.frame(iframe)
-        waiting_sys_timer(wait)
-        # agree terms and conditions
-        logging.info(" -- agreeing terms and conditions")
-        checkbox = driver.find_element_by_xpath('//input[@class="sys-event-hook"]')
-        checkbox.click()
-        waiting_sys_timer(wait)
-        # click download button
-        dl_button = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, '//button[contains(text(), "Download")]')))
-        dl_button.click()
-        waiting_sys_timer(wait)
-        logging.info(" -- downloading")
-        # Opening Firefox downloading window
-        driver.switch_to.default_content()
-        fn = wait_downloaded_filename(wait, driver, 600)
-        logging.info(f" -- downloaded to {fn}.")
-
-
-        waiting_sys_timer(wait)
-
-        logging.info("Downloading MSA masked...")
-        driver.switch_to.frame(iframe_dl)
-        waiting_sys_timer(wait)
-        # click MSA masked button
-        dl_button = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, '//div[contains(text(), "MSA masked")]')))
-        dl_button.click()
-        waiting_sys_timer(wait)
-        # waiting for REMINDER
-        iframe = waiting_for_iframe(wait, driver, rt, iv)
-        driver.switch_to.frame(iframe)
-        waiting_sys_timer(wait)
-        # agree terms and conditions
-        logging.info(" -- agreeing terms and conditions")
-        checkbox = driver.find_element_by_xpath('//input[@class="sys-event-hook"]')
-        checkbox.click()
-        waiting_sys_timer(wait)
-        # click download button
-        dl_button = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, '//button[contains(text(), "Download")]')))
-        dl_button.click()
-        waiting_sys_timer(wait)
-        logging.info(" -- downloading")
-        # Opening Firefox downloading window
-        driver.switch_to.default_content()
-        fn = wait_downloaded_filename(wait, driver, 600)
-        logging.info(f" -- downloaded to {fn}.")
-
-
-        waiting_sys_timer(wait)
-
-        # go back to main frame
-        driver.switch_to.frame(iframe_dl)
-        back_button = driver.find_element_by_xpath('//button[contains(text(), "Back")]')
-        back_button.click()
-
-        driver.switch_to.default_content()
-        waiting_sys_timer(wait)
-    
-    if cs or ce or ss or se or loc:
-        logging.info("Browsing EpiCoV...")
-        browse_tab = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, '//*[contains(text(), "Browse")]')))
-        browse_tab.click()
-        waiting_sys_timer(wait)
-        waiting_table_to_get_ready(wait)
-
-        # set location
-        if loc:
-            logging.info("Setting location...")
-            loc_input = driver.find_element_by_xpath(
-                "//td/div[contains(text(), 'Location')]/../following-sibling::td/div/div/input"
-            )
-            loc_input.send_keys(loc)
-            waiting_sys_timer(wait, 7)
-
-        # set host
-        if host:
-            logging.info("Setting host...")
-            host_input = driver.find_element_by_xpath(
-                "//td/div[contains(text(), 'Host')]/../following-sibling::td/div/div/input"
-            )
-            host_input.send_keys(host)
-            waiting_sys_timer(wait, 7)
-
-        # set dates
-        date_inputs = driver.find_elements_by_css_selector(
-            "div.sys-form-fi-date input")
-        dates = (cs, ce, ss, se)
-        for dinput, date in zip(date_inputs, dates):
-            if date:
-                logging.info("Setting date...")
-                dinput.send_keys(date)
-
-        ActionChains(driver).send_keys(Keys.ESCAPE).perform()
-        waiting_sys_timer(wait, 7)
-
-        # complete genome only
-        if cg:
-            logging.info("complete genome only...")
-            checkbox = driver.find_element_by_xpath('//input[@value="complete"]')
-            checkbox.click()
-            waiting_sys_timer(wait)
-
-        # high coverage only
-        if hc:
-            logging.info("high coverage only...")
-            checkbox = driver.find_element_by_xpath('//input[@value="highq"]')
-            checkbox.click()
-            waiting_sys_timer(wait)
-
-        # excluding low coverage
-        if le:
-            logging.info("low coverage excluding...")
-            checkbox = driver.find_element_by_xpath('//input[@value="lowco"]')
-            checkbox.click()
-            waiting_sys_timer(wait)
-
-        # check if any genomes pass filters
-        warning_message = None
-        try:
-            warning_message = driver.find_element_by_xpath("//div[contains(text(), 'No data found.')]")
-        except:
-            pass
-        if warning_message:
-            logging.info("No data found.")
-            sys.exit(1)
+    waiting_sys_timer(driver, to)
 
-        # select all genomes
-        logging.info("Selecting all genomes...")
-        button_sa = driver.find_element_by_css_selector("span.yui-dt-label input")
-        button_sa.click()
-        waiting_sys_timer(wait)
+    if session:
+        uploader.save_session(driver, session)
 
-        # downloading sequence data
-        num_download_options = 1
-        current_option = 0
 
-        retry = 0
-        while retry <= rt and current_option < num_download_options:
-            try:
-                logging.info("Downloading sequences for selected genomes...")
-                button = driver.find_element_by_xpath(
-                    "//td[@class='sys-datatable-info']/button[contains(text(), 'Download')]")
-                button.click()
-                waiting_sys_timer(wait)
-
-                # switch to iframe
-                iframe = waiting_for_iframe(wait, driver, rt, iv)
-                driver.switch_to.frame(iframe)
-                waiting_sys_timer(wait)
-                
-                # selecting options
-                labels = driver.find_elements_by_xpath("//label")
-                num_download_options = len(labels)
-                labels[current_option].click()
-                current_option += 1
-
-                button = driver.find_element_by_xpath(
-                    "//button[contains(text(), 'Download')]")
-                button.click()
-                waiting_sys_timer(wait)
-                driver.switch_to.default_content()
+def restore_session(driver, to, session, url=None, limiter=None):
+    """load cookies and local storage saved by uploader.save_session(), returns True if still logged in"""
+    url = url or GISAID_URL
+    state = uploader.read_session(session)
+    if state is None:
+        return False
+    uploader.apply_session(driver, state)
 
-                fn = wait_downloaded_filename(wait, driver, 1800)
-                logging.info(f"Downloaded to {fn}.")
-            except:
-                logging.info(f"retrying...#{retry} in {iv} sec(s)")
-                if retry == rt:
-                    logging.error("Unexpected error:", sys.exc_info())
-                    sys.exit(1)
-                else:
-                    time.sleep(iv)
-                    retry += 1
+    load_page(driver, state.get("url") or url, limiter)
+    waiting_sys_timer(driver, to)
 
-    # close driver
-    driver.quit()
+    # an expired session lands on the login form again
+    if uploader.session_expired(driver, IMPLICIT_WAIT):
+        logging.info("Saved session expired.")
+        driver.delete_all_cookies()
+        load_page(driver, url, limiter)
+        waiting_sys_timer(driver, to)
+        return False
+    return True
+
+
+def navigate_EpiCoV(driver, to, url=None, limiter=None):
+    """go back to the EpiCoV start page in a logged in browser"""
+    load_page(driver, url or GISAID_URL, limiter)
+    waiting_sys_timer(driver, to)
+    if probe_element(driver, By.NAME, 'login'):
+        raise SessionExpired("GISAID session expired.")
+    epicov_tab = driver.find_element_by_xpath("//div[@id='main_nav']//li[3]/a")
+    epicov_tab.click()
+    waiting_sys_timer(driver, to)
+
+
+def request_artifact(driver, to, iframe_dl, name, xpath, rt, iv, timer=None, limiter=None):
+    """request an artifact in the Downloads section without waiting for the transfer
+
+    timer (a StageTimer) gets the "click" stage up to the terms dialog and
+    the "terms" stage up to the click on Download.
+    """
+    logging.info(f"Downloading {name}...")
+    driver.switch_to.frame(iframe_dl)
+    waiting_sys_timer(driver, to)
+    # click artifact button
+    dl_button = wait_until(driver, EC.element_to_be_clickable(
+        (By.XPATH, xpath)), "artifact button", to)
+    (limiter or RATE_LIMITER).acquire()
+    dl_button.click()
+    waiting_sys_timer(driver, to)
+    # waiting for REMINDER
+    iframe = waiting_for_iframe(driver, to, rt, iv, limiter)
+    driver.switch_to.frame(iframe)
+    waiting_sys_timer(driver, to)
+    if timer:
+        timer.lap("click")
+    # agree terms and conditions
+    logging.info(" -- agreeing terms and conditions")
+    checkbox = driver.find_element_by_xpath('//input[@class="sys-event-hook"]')
+    checkbox.click()
+    waiting_sys_timer(driver, to)
+    # click download button
+    dl_button = wait_until(driver, EC.element_to_be_clickable(
+        (By.XPATH, '//button[contains(text(), "Download")]')), "download button", to)
+    dl_button.click()
+    waiting_sys_timer(driver, to)
+    if timer:
+        timer.lap("terms")
+    logging.info(" -- downloading")
+    driver.switch_to.default_content()
 
 
 def getMetadata(record_elem):
@@ -516,85 +1512,1675 @@ def getMetadata(record_elem):
     return meta
 
 
-def waiting_sys_timer(wait, sec=1):
+def wait_until(driver, condition, name, timeout, settle=0, implicit=IMPLICIT_WAIT):
+    """wait for a DOM condition with adaptive polling and record how long it took
+
+    The condition is polled quickly at first and then less often, up to
+    WAIT_POLL_MAX. With `settle`, the condition has to hold for that many
+    seconds in a row, which catches spinners that show up right after a click.
+    The implicit wait of the caller is set back afterwards.
+    """
+    startTime = time.time()
+    heldSince = None
+    interval = WAIT_POLL_MIN
+    # the condition is polled here, lookups inside it must not block
+    driver.implicitly_wait(0)
+    try:
+        while True:
+            try:
+                value = condition(driver)
+            except (NoSuchElementException, StaleElementReferenceException):
+                value = None
+            now = time.time()
+            if value:
+                if heldSince is None:
+                    heldSince = now
+                if now - heldSince >= settle:
+                    record_wait(name, startTime, now)
+                    return value
+                interval = WAIT_POLL_MIN
+            else:
+                heldSince = None
+            if now - startTime > timeout:
+                record_wait(name, startTime, now, timed_out=True)
+                raise TimeoutException(f"{name} was not ready in {timeout} secs")
+            time.sleep(interval)
+            interval = min(interval * 2, WAIT_POLL_MAX)
+    finally:
+        driver.implicitly_wait(implicit)
+
+
+def record_wait(name, start, end, timed_out=False):
+    """add a finished wait to WAIT_STATS (and WAIT_TIMEOUTS) and the trace"""
+    with METRICS_LOCK:
+        WAIT_STATS.setdefault(name, []).append(end - start)
+        if timed_out:
+            WAIT_TIMEOUTS[name] = WAIT_TIMEOUTS.get(name, 0) + 1
+        TRACE_EVENTS.append((name, "wait", start, end, threading.get_ident()))
+
+
+def count_retry(step):
+    """count a retry of step for --metrics"""
+    with METRICS_LOCK:
+        RETRIES[step] = RETRIES.get(step, 0) + 1
+
+
+def retry_delay(step, attempt, iv, limiter=None):
+    """count a failed attempt of step and return how long to back off before the next one"""
+    count_retry(step)
+    return (limiter or RATE_LIMITER).failed(attempt, iv)
+
+
+class RateLimiter:
+    """a token bucket and adaptive backoff shared by all workers through a lock file
+
+    Every request to GISAID takes a token; tokens refill at rpm per minute
+    times a health factor. Each failed attempt halves the factor (down to
+    RATE_MIN_FACTOR) and it climbs back over RATE_RECOVERY secs, so a burst
+    of errors slows every worker down together. Backoffs grow from iv by
+    whichever is larger, doubling per attempt or the slowdown of a low
+    factor, up to BACKOFF_MAX, and are jittered so that workers do not
+    retry in waves. The state is kept in fn under flock, shared by the
+    threads and the separate runs using it; without fn it stays in this
+    process. rpm 0 does not limit the rate.
+    """
+
+    def __init__(self, fn=None, rpm=0, burst=RATE_BURST):
+        self.fn = fn
+        self.rpm = rpm
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.state = {}
+        if fn:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(fn)), exist_ok=True)
+            except OSError as e:
+                logging.warning(f"Not sharing the rate limit, {fn} is not writable: {e}")
+                self.fn = None
+
+    @contextlib.contextmanager
+    def shared_state(self):
+        """the state, refilled up to now, saved back after the block"""
+        with self.lock:
+            if not self.fn:
+                self.refill(self.state)
+                yield self.state
+                return
+            with open(os.open(self.fn, os.O_RDWR | os.O_CREAT, 0o600), "r+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    state = {}
+                self.refill(state)
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+
+    def refill(self, state):
+        now = time.time()
+        elapsed = max(0, now - state.get("updated", now))
+        factor = state.get("factor", 1.0)
+        state["factor"] = min(1.0, factor + elapsed * (1 - RATE_MIN_FACTOR) / RATE_RECOVERY)
+        state["tokens"] = min(self.burst, state.get("tokens", self.burst) + elapsed * self.rpm / 60 * factor)
+        state["updated"] = now
+
+    def acquire(self):
+        """wait for a token before a request"""
+        if not self.rpm:
+            return
+        with self.shared_state() as state:
+            # take the token now and wait for it outside the lock
+            state["tokens"] -= 1
+            delay = -state["tokens"] / (self.rpm / 60 * state["factor"]) if state["tokens"] < 0 else 0
+        if delay > 0:
+            startTime = time.time()
+            time.sleep(delay)
+            record_wait("rate limit", startTime, time.time())
+
+    def failed(self, attempt, iv):
+        """note a failed request, returns the jittered backoff before retry #attempt"""
+        with self.shared_state() as state:
+            state["factor"] = max(RATE_MIN_FACTOR, state["factor"] / 2)
+            factor = state["factor"]
+        # the two do not multiply, or a few retries during a burst of
+        # errors would all wait BACKOFF_MAX
+        delay = min(BACKOFF_MAX, iv * max(2 ** min(max(attempt - 1, 0), BACKOFF_DOUBLINGS), 1 / factor))
+        return random.uniform(delay / 2, delay)
+
+
+# replaced by configure() with the --ratelimit settings, the default of the
+# functions and clients not given a limiter
+RATE_LIMITER = RateLimiter()
+
+
+def configure(url, limiter):
+    """make url and limiter the --url and --ratelimit settings of the command line"""
+    global GISAID_URL, RATE_LIMITER
+    GISAID_URL = url
+    RATE_LIMITER = limiter
+
+
+def probe_element(driver, by, value, timeout=0):
+    """look up an element that may be absent without paying the implicit wait
+
+    Returns the element, or None if it does not show up within `timeout` secs.
+    """
+    return uploader.probe_element(driver, by, value, timeout, IMPLICIT_WAIT)
+
+
+def waiting_sys_timer(driver, to, sec=0):
     """wait for system timer"""
     try:
-        wait.until(EC.invisibility_of_element_located(
-            (By.XPATH,  "//div[@id='sys_timer']")))
-    except:
+        wait_until(driver, EC.invisibility_of_element_located(
+            (By.XPATH,  "//div[@id='sys_timer']")), "sys_timer", to, settle=WAIT_SETTLE)
+    except TimeoutException:
         pass
-    time.sleep(sec)
+    if sec:
+        time.sleep(sec)
 
 
-def waiting_table_to_get_ready(wait, sec=1):
+def waiting_table_to_get_ready(driver, to):
     """wait for the table to be loaded"""
-    wait.until(EC.invisibility_of_element_located(
-        (By.XPATH,  "//tbody[@class='yui-dt-message']")))
-    time.sleep(sec)
+    wait_until(driver, EC.invisibility_of_element_located(
+        (By.XPATH,  "//tbody[@class='yui-dt-message']")), "table", to, settle=WAIT_SETTLE)
+
+
+def table_signature(driver):
+    """summarize the record count and the first row of the browse table"""
+    return driver.execute_script("""
+        var info = document.querySelector('td.sys-datatable-info');
+        var row = document.querySelector('tbody.yui-dt-data tr');
+        return (info ? info.textContent : '') + '|' + (row ? row.textContent : '');""")
+
 
-def waiting_for_iframe(wait, driver, rt, iv):
+def waiting_table_to_change(driver, to, before, timeout=FILTER_REFRESH_TIMEOUT):
+    """wait for the browse table to refresh after a filter is changed"""
+    def table_changed(driver):
+        return table_signature(driver) != before
+    try:
+        wait_until(driver, table_changed, "table refresh", timeout)
+    except TimeoutException:
+        # the filter did not change the result
+        pass
+    waiting_sys_timer(driver, to)
+
+
+def log_wait_stats(wd):
+    """log how long the waits took and save them for tuning timeouts"""
+    stats = {}
+    for name, secs in sorted(WAIT_STATS.items()):
+        stats[name] = {
+            "count": len(secs),
+            "timeouts": WAIT_TIMEOUTS.get(name, 0),
+            "total": round(sum(secs), 3),
+            "mean": round(sum(secs)/len(secs), 3),
+            "max": round(max(secs), 3),
+            "secs": [round(s, 3) for s in secs],
+        }
+        logging.info(f"waited {stats[name]['total']:.1f} secs on {name} "
+                     f"({stats[name]['count']} times, max {stats[name]['max']:.1f} secs)")
+    with open(f'{wd}/gisaid_wait_stats.json', 'w') as f:
+        json.dump(stats, f, indent=2)
+
+
+def browser_rss(driver):
+    """resident memory of firefox and its content processes in bytes, None if unknown"""
+    if driver is None:
+        return None
+    pid = driver.capabilities.get("moz:processID")
+    if not pid or not os.path.exists("/proc"):
+        return None
+    # parent of every process, to find the children of firefox
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parents[int(entry)] = int(f.read().rpartition(")")[2].split()[1])
+            except (OSError, IndexError, ValueError):
+                pass
+    pids = {pid}
+    while True:
+        children = {p for p, parent in parents.items() if parent in pids} - pids
+        if not children:
+            break
+        pids |= children
+    rss = 0
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return rss
+
+
+def sample_browser_rss(driver):
+    """keep the last and the peak RSS of the browser for --metrics"""
+    try:
+        rss = browser_rss(driver)
+    except (OSError, WebDriverException):
+        rss = None
+    if rss is not None:
+        BROWSER_RSS["last"] = rss
+        BROWSER_RSS["peak"] = max(rss, BROWSER_RSS.get("peak", 0))
+    return rss
+
+
+def write_metrics(fn, started, status):
+    """write the metrics of this run to fn in the Prometheus text format
+
+    The file is replaced atomically, so it can sit in the directory of the
+    node_exporter textfile collector.
+    """
+    def label(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def histogram(metric, doc, key, samples):
+        lines.append(f"# HELP {metric} {doc}")
+        lines.append(f"# TYPE {metric} histogram")
+        for value, secs in sorted(samples.items()):
+            for bound in METRICS_BUCKETS:
+                lines.append(f'{metric}_bucket{{{key}="{label(value)}",le="{bound}"}} '
+                             f'{sum(1 for s in secs if s <= bound)}')
+            lines.append(f'{metric}_bucket{{{key}="{label(value)}",le="+Inf"}} {len(secs)}')
+            lines.append(f'{metric}_sum{{{key}="{label(value)}"}} {sum(secs):.3f}')
+            lines.append(f'{metric}_count{{{key}="{label(value)}"}} {len(secs)}')
+
+    def counter(metric, doc, key, values):
+        lines.append(f"# HELP {metric} {doc}")
+        lines.append(f"# TYPE {metric} counter")
+        for value, count in sorted(values.items()):
+            lines.append(f'{metric}{{{key}="{label(value)}"}} {count}')
+
+    def gauge(metric, doc, value):
+        lines.append(f"# HELP {metric} {doc}")
+        lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric} {value}")
+
+    with METRICS_LOCK:
+        waits = {name: list(secs) for name, secs in WAIT_STATS.items()}
+        timeouts = dict(WAIT_TIMEOUTS)
+        retries = dict(RETRIES)
+        downloads = list(DOWNLOAD_STATS)
+
+    stages = {}
+    statuses = {"ok": 0, "failed": 0}
+    for record in downloads:
+        statuses[record["status"]] += 1
+        for stage, secs in record["stages"].items():
+            stages.setdefault(stage, []).append(secs)
+    finished = [record for record in downloads if record["status"] == "ok"]
+    received = sum(record["bytes"] or 0 for record in finished)
+    busy = max(record["end"] for record in finished) - min(record["start"] for record in finished) if finished else 0
+
+    lines = []
+    histogram("gisaid_wait_seconds", "Time spent in each named wait.", "wait", waits)
+    counter("gisaid_wait_timeouts_total", "Waits that ran into their timeout.", "wait", timeouts)
+    histogram("gisaid_download_stage_seconds", "Time spent in each stage of a download.", "stage", stages)
+    counter("gisaid_downloads_total", "Downloads by outcome.", "status", statuses)
+    counter("gisaid_retries_total", "Retries by step.", "step", retries)
+    gauge("gisaid_downloaded_bytes", "Bytes of the completed downloads of the run.", received)
+    gauge("gisaid_download_throughput_bytes_per_second",
+          "Bytes of the completed downloads over the time they were running.",
+          f"{received / busy:.1f}" if busy else 0)
+    if BROWSER_RSS:
+        gauge("gisaid_browser_rss_bytes", "Resident memory of firefox at the end of the run.", BROWSER_RSS["last"])
+        gauge("gisaid_browser_rss_peak_bytes", "Largest sampled resident memory of firefox.", BROWSER_RSS["peak"])
+    gauge("gisaid_run_duration_seconds", "Wall time of the run.", f"{time.time() - started:.3f}")
+    gauge("gisaid_run_success", "1 if the run finished, 0 if it failed.", int(status == "ok"))
+    gauge("gisaid_run_timestamp_seconds", "When the run ended.", f"{time.time():.0f}")
+
+    tmp = f"{fn}.tmp"
+    with open(tmp, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp, fn)
+
+
+def write_trace(fn):
+    """write the waits and download stages of this run to fn in the Chrome trace format
+
+    Open it in chrome://tracing or https://ui.perfetto.dev.
+    """
+    with METRICS_LOCK:
+        events = list(TRACE_EVENTS)
+    pid = os.getpid()
+    with open(fn, "w") as f:
+        json.dump({"traceEvents": [{
+            "name": name, "cat": cat, "ph": "X", "pid": pid, "tid": tid,
+            "ts": int(start * 1e6), "dur": int((end - start) * 1e6),
+        } for name, cat, start, end, tid in events], "displayTimeUnit": "ms"}, f)
+
+
+def export_metrics(wd, driver, started, status, metrics=None, trace=None):
+    """save the wait stats and the --metrics/--trace files at the end of a run"""
+    log_wait_stats(wd)
+    sample_browser_rss(driver)
+    if BROWSER_RSS:
+        logging.info(f"firefox used {BROWSER_RSS['last']/1024**2:.0f} MB at the end of the run, "
+                     f"{BROWSER_RSS['peak']/1024**2:.0f} MB at peak")
+    if metrics:
+        write_metrics(metrics, started, status)
+        logging.info(f"Metrics written to {metrics}.")
+    if trace:
+        write_trace(trace)
+        logging.info(f"Trace written to {trace}.")
+
+
+def waiting_for_iframe(driver, to, rt, iv, limiter=None):
     iframe = None
     retry = 1
     while retry <= rt:
         try:
-            wait.until(EC.presence_of_element_located((By.XPATH, "//iframe")))
+            wait_until(driver, EC.presence_of_element_located((By.XPATH, "//iframe")), "iframe", to)
             iframe = driver.find_element_by_xpath("//iframe")
             if iframe:
                 return iframe
             else:
                 raise
         except:
-            logging.info(f"retrying...#{retry} in {iv} sec(s)")
             if retry == rt:
-                logging.info("Failed")
-                sys.exit(1)
+                raise EpiCoVError("Failed to open the download window.")
             else:
-                time.sleep(iv)
+                delay = retry_delay("iframe", retry, iv, limiter)
+                logging.info(f"retrying...#{retry} in {delay:.1f} sec(s)")
+                time.sleep(delay)
                 retry += 1
 
-def wait_downloaded_filename(wait, driver, waitTime=180):
-    # logging.info(f"Opening Firefox downloading window...")
-    driver.execute_script("window.open()")
-    wait.until(EC.new_window_is_opened)
-    driver.switch_to.window(driver.window_handles[-1])
-    driver.get("about:downloads")
-    time.sleep(1)
 
-    endTime = time.time()+waitTime
+class Journal:
+    """finished steps of a run, kept in a JSON lines file so that a rerun can skip them
+
+    The first line identifies the run by its parameters; every following line
+    is a finished step with the files it produced. With resume, the steps of
+    a journal from the same run are loaded, and a step counts as done only
+    while its files are still on disk with the recorded sizes.
+    """
+    def __init__(self, fn, params, resume=False):
+        self.fn = fn
+        self.lock = threading.Lock()
+        self.steps = {}
+        run = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+        if resume and os.path.exists(fn):
+            entries = []
+            line = ""
+            with open(fn) as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # cut short by a crash
+                        pass
+            if entries and entries[0].get("run") == run:
+                self.steps = {e["step"]: e for e in entries[1:]}
+                if not line.endswith("\n"):
+                    # or the next step would be appended to the cut line
+                    with open(fn, "a") as f:
+                        f.write("\n")
+                logging.info(f"Resuming from {fn} with {len(self.steps)} finished step(s).")
+            else:
+                logging.info(f"{fn} is from a different run, starting over.")
+
+        if not self.steps:
+            with open(fn, "w") as f:
+                f.write(json.dumps({"run": run, "params": params, "started": time.strftime('%Y-%m-%d %H:%M:%S')}) + "\n")
+
+    def entry(self, step):
+        """the journal entry of a finished step whose files are intact, or None"""
+        entry = self.steps.get(step)
+        if entry is None:
+            return None
+        for f in entry["files"]:
+            if not os.path.exists(f["path"]) or os.path.getsize(f["path"]) != f["size"]:
+                logging.info(f"{f['path']} of {step} changed, redoing it.")
+                return None
+        return entry
+
+    def done(self, step):
+        """the files of a finished step, or None if it has to be (re)done"""
+        entry = self.entry(step)
+        return None if entry is None else [f["path"] for f in entry["files"]]
+
+    def record(self, step, fns, data=None):
+        """add a finished step with its files"""
+        entry = {
+            "step": step,
+            "time": time.strftime('%Y-%m-%d %H:%M:%S'),
+            "files": [{"path": fn, "size": os.path.getsize(fn)} for fn in fns],
+        }
+        if data is not None:
+            entry["data"] = data
+        with self.lock:
+            self.steps[step] = entry
+            with open(self.fn, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+class StageTimer:
+    """time the stages of one download and append them to TIMINGS in wd"""
+
+    def __init__(self, wd, name):
+        self.fn = os.path.join(wd, TIMINGS)
+        self.name = name
+        self.start = self.last = time.time()
+        self.stages = {}
+
+    def lap(self, stage, now=None):
+        """end `stage` now (or at the time `now`) and start the next one"""
+        now = now or time.time()
+        self.stages[stage] = round(now - self.last, 3)
+        with METRICS_LOCK:
+            TRACE_EVENTS.append((f"{self.name} {stage}", "download", self.last, now, threading.get_ident()))
+        self.last = now
+
+    def write(self, path):
+        """append the stages of the download of path, None when it failed"""
+        record = {
+            "artifact": self.name,
+            "started": datetime.datetime.fromtimestamp(self.start).isoformat(timespec="seconds"),
+            "status": "ok" if path else "failed",
+            "stages": self.stages,
+            "total": round((self.last if path else time.time()) - self.start, 3),
+            "file": path,
+            "bytes": os.path.getsize(path) if path and os.path.exists(path) else None,
+        }
+        logging.info(f" -- {self.name}: " + ", ".join(f"{stage} {secs:.1f}s" for stage, secs in self.stages.items()))
+        with TIMINGS_LOCK, open(self.fn, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        with METRICS_LOCK:
+            DOWNLOAD_STATS.append(dict(record, start=self.start, end=self.last))
+
+
+class EpiCoVError(Exception):
+    """an EpiCoV step failed after all retries"""
+
+
+class SessionExpired(EpiCoVError):
+    """the browser is no longer logged in to GISAID"""
+
+
+class NoDataFound(EpiCoVError):
+    """no genomes pass the filters"""
+
+
+def scan_download_dir(wd):
+    """list files in the download directory with their sizes"""
+    files = {}
+    with os.scandir(wd) as it:
+        for entry in it:
+            if entry.is_file():
+                files[entry.name] = entry.stat().st_size
+    return files
+
+
+class DownloadTimeout(EpiCoVError, TimeoutError):
+    """downloads did not complete in time"""
+    def __init__(self, msg, completed, pending):
+        super().__init__(msg)
+        self.completed = completed
+        self.pending = pending
+
+
+def wait_download_started(wd, existing, timeout=60, poll=0.5):
+    """wait for a download that is not in `existing` to show up, returns its name"""
+    endTime = time.time() + timeout
     while True:
-        try:
-            #progress = driver.execute_script("return document.querySelector('.downloadContainer progress:first-of-type').value")
-            fileName = driver.execute_script("return document.querySelector('.downloadContainer description:first-of-type').value")
-            dldetail = driver.execute_script("return document.querySelector('.downloadDetailsNormal').value")
-
-            while "time left" in dldetail:
-                time.sleep(1)
-                dldetail = driver.execute_script("return document.querySelector('.downloadDetailsNormal').value")
-                #progress = driver.execute_script("return document.querySelector('.downloadContainer progress:first-of-type').value")
-
-            driver.close()
-            driver.switch_to.window(driver.window_handles[0])
-            time.sleep(2)
-            return fileName
-        except:
-            pass
-        time.sleep(1)
+        for name in scan_download_dir(wd):
+            if name.endswith(".part"):
+                name = name[:-5]
+            if name not in existing and not name.endswith(TRACKER_IGNORE):
+                return name
         if time.time() > endTime:
+            raise DownloadTimeout(f"No download started in {timeout} secs.", [], [])
+        time.sleep(poll)
+
+
+def track_downloads(wd, existing, num_files=1, waitTime=600, poll=1, stable=2, report=30, times=None):
+    """wait for new downloads in the download directory to complete
+
+    Firefox writes a transfer to <name>.part next to an empty <name> placeholder
+    and renames it when done. A download counts as completed once its .part file
+    is gone and the size of <name> stays the same for `stable` polls. Files in
+    `existing` (a scan_download_dir() snapshot taken before the request) are
+    ignored, .part files included. Returns the paths of the completed files in completion order; when
+    given, `times` maps each completed name to the time it completed.
+    """
+    completed = []
+    sizes = {}
+    stable_polls = {}
+    startTime = lastReport = time.time()
+    lastBytes = 0
+    endTime = startTime + waitTime
+
+    while True:
+        files = scan_download_dir(wd)
+        # a .part left over from a crashed run is in `existing` and never completes
+        parts = {name[:-5] for name in files if name.endswith(".part") and name not in existing}
+        downloads = {}
+        for name, size in files.items():
+            if name.endswith(".part"):
+                if name[:-5] in parts:
+                    downloads[name[:-5]] = size
+            elif name not in existing and not name.endswith(TRACKER_IGNORE):
+                downloads.setdefault(name, size)
+
+        for name, size in downloads.items():
+            if name in completed:
+                continue
+            if name in parts or size == 0 or sizes.get(name) != size:
+                stable_polls[name] = 0
+            else:
+                stable_polls[name] += 1
+                if stable_polls[name] >= stable:
+                    completed.append(name)
+                    if times is not None:
+                        times[name] = time.time()
+                    logging.info(f" -- {name} completed ({size/1024**2:.1f} MB)")
+            sizes[name] = size
+
+        if len(completed) >= num_files:
             break
 
+        now = time.time()
+        if now - lastReport >= report:
+            totalBytes = sum(sizes.values())
+            logging.info(f" -- {len(completed)}/{num_files} downloads completed, "
+                         f"{totalBytes/1024**2:.1f} MB received, "
+                         f"{(totalBytes-lastBytes)/1024**2/(now-lastReport):.2f} MB/s")
+            lastReport, lastBytes = now, totalBytes
+
+        if now > endTime:
+            pending = [name for name in sizes if name not in completed]
+            raise DownloadTimeout(
+                f"{len(completed)} of {num_files} downloads completed in {waitTime} secs; pending: {pending}",
+                [os.path.join(wd, name) for name in completed],
+                [os.path.join(wd, name) for name in pending])
+
+        time.sleep(poll)
+
+    elapsed = time.time() - startTime
+    totalBytes = sum(sizes[name] for name in completed)
+    logging.info(f" -- {len(completed)} download(s), {totalBytes/1024**2:.1f} MB "
+                 f"in {elapsed:.0f} secs ({totalBytes/1024**2/max(elapsed, 1e-3):.2f} MB/s)")
+    return [os.path.join(wd, name) for name in completed]
+
+
+def finish_downloads(wd, existing, names, transfers, waitTime, times=None):
+    """wait for the started downloads `names`, returns the paths that completed
+
+    `transfers` maps some of the names to the functions returned by
+    handoff_download(); they run in parallel while firefox finishes the rest.
+    Downloads that time out or fail are logged and left out. `times` gets the
+    completion time of each name as in track_downloads().
+    """
+    def run(name, transfer):
+        path = transfer()
+        if times is not None:
+            times[name] = time.time()
+        return path
+
+    completed = []
+    with concurrent.futures.ThreadPoolExecutor(max(1, len(transfers))) as executor:
+        futures = {name: executor.submit(run, name, transfer) for name, transfer in transfers.items()}
+        if len(names) > len(transfers):
+            try:
+                completed = track_downloads(wd, dict(existing, **{name: 0 for name in transfers}),
+                                            len(names) - len(transfers), waitTime, times=times)
+            except DownloadTimeout as e:
+                logging.warning(e)
+                completed = list(e.completed)
+        for name, future in futures.items():
+            try:
+                completed.append(future.result())
+            except (OSError, http.client.HTTPException, EpiCoVError) as e:
+                logging.warning(f"{name}: {e}")
+    return completed
+
+
+def browser_downloads(driver, cancel=None):
+    """list the running firefox downloads, cancelling and removing the one saved to `cancel`"""
+    with driver.context(driver.CONTEXT_CHROME):
+        result = driver.execute_async_script(BROWSER_DOWNLOADS_JS, cancel)
+    if isinstance(result, str):
+        raise EpiCoVError(f"Could not read the firefox downloads: {result}")
+    return result
+
+
+def cookie_header(cookies, url):
+    """build a Cookie header from the WebDriver cookies that apply to url"""
+    host = urllib.parse.urlsplit(url).hostname or ""
+    pairs = []
+    for cookie in cookies:
+        domain = cookie.get("domain", "").lstrip(".")
+        if host == domain or host.endswith(f".{domain}"):
+            pairs.append(f"{cookie['name']}={cookie['value']}")
+    return "; ".join(pairs)
+
+
+def handoff_download(driver, wd, name, settings, rt, iv, limiter=None):
+    """take a started firefox download over, returns a function that fetches it
+
+    The signed URL and the session cookies of the download saved to wd/name are
+    handed to http_download(). Returns None when the download is not running
+    anymore or the server refuses a second request for the URL; firefox then
+    finishes it on its own.
+    """
+    target = os.path.join(wd, name)
+    info = next((d for d in browser_downloads(driver) if d["target"] == target), None)
+    if info is None:
+        return None
+
+    headers = {
+        "User-Agent": driver.execute_script("return navigator.userAgent;"),
+        "Cookie": cookie_header(driver.get_cookies(), info["url"]),
+    }
+    if info.get("referrer"):
+        headers["Referer"] = info["referrer"]
+
+    try:
+        url, size, ranged, _ = http_probe(threading.local(), info["url"], headers)
+    except (OSError, http.client.HTTPException, EpiCoVError) as e:
+        logging.info(f" -- {name} stays with firefox: {e}")
+        return None
+
+    browser_downloads(driver, cancel=target)
+    logging.info(f" -- {name} handed over to {settings['connections']} HTTP connection(s)"
+                 f"{'' if ranged else ' (no range support)'}")
+    return lambda: http_download(url, target, headers, size, ranged,
+                                 settings["connections"], settings["chunk_size"], rt, iv, limiter)
+
+
+def http_connection(local, scheme, netloc):
+    """the keep-alive connection of this thread to scheme://netloc"""
+    pool = local.__dict__.setdefault("pool", {})
+    conn = pool.get((scheme, netloc))
+    if conn is None:
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(netloc, timeout=HTTP_TIMEOUT)
+        else:
+            conn = http.client.HTTPConnection(netloc, timeout=HTTP_TIMEOUT)
+        pool[(scheme, netloc)] = conn
+    return conn
+
+
+def http_close(local):
+    """drop the connections of this thread"""
+    for conn in local.__dict__.pop("pool", {}).values():
+        conn.close()
+
+
+def http_get(local, url, headers, method="GET", body=None):
+    """send a request over a pooled connection following redirects, returns (response, final url)"""
+    for _ in range(HTTP_MAX_REDIRECTS):
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += f"?{parts.query}"
+        conn = http_connection(local, parts.scheme, parts.netloc)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            # the server closed an idle keep-alive connection, reconnect once
+            conn.close()
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+        if resp.status in (301, 302, 303, 307, 308):
+            resp.read()
+            url = urllib.parse.urljoin(url, resp.getheader("Location"))
+            if resp.status == 303:
+                method, body = "GET", None
+            continue
+        return resp, url
+    raise EpiCoVError(f"Too many redirects for {url}")
+
+
+def http_probe(local, url, headers):
+    """ask for the first byte of url
+
+    Returns (final url, size, whether ranges are supported, file name from
+    Content-Disposition or the URL).
+    """
+    resp, url = http_get(local, url, dict(headers, Range="bytes=0-0"))
+    disposition = resp.getheader("Content-Disposition", "")
+    m = re.search(r"filename\*?=(?:UTF-8'')?\"?([^\";]+)", disposition)
+    name = os.path.basename(urllib.parse.unquote(m.group(1) if m else urllib.parse.urlsplit(url).path))
+    if resp.status == 206:
+        resp.read()
+        total = resp.getheader("Content-Range", "").rpartition("/")[2]
+        # "bytes 0-0/*" has no total, fetch the file in one stream
+        return url, int(total) if total.isdigit() else None, total.isdigit(), name
+    elif resp.status != 200:
+        resp.read()
+        raise EpiCoVError(f"HTTP {resp.status} {resp.reason} for {url}")
+    size = resp.getheader("Content-Length")
+    # do not read a whole file that was sent instead of the first byte
+    http_close(local)
+    return url, int(size) if size and size.isdigit() else None, False, name
+
+
+def fetch_url(url, target, headers=None, connections=4, chunk_size=HTTP_CHUNK_SIZE, rt=5, iv=3, limiter=None):
+    """download url to target with http_download(), returns target"""
+    headers = headers or {}
+    url, size, ranged, _ = http_probe(threading.local(), url, headers)
+    return http_download(url, target, headers, size, ranged, connections, chunk_size, rt, iv, limiter)
+
+
+def http_download(url, target, headers, size, ranged, connections=4, chunk_size=HTTP_CHUNK_SIZE, rt=5, iv=3,
+                  limiter=None):
+    """download url to target in parallel byte ranges over pooled keep-alive connections
+
+    The file is preallocated as <target>.http-part and every chunk is written at
+    its offset. Finished chunks and their sha256 are kept in <target>.http.json,
+    so a later call for the same file re-checks them and only fetches what is
+    missing or corrupt. Servers without range support are read in one stream.
+    Returns target.
+    """
+    part = f"{target}.http-part"
+    state_fn = f"{target}.http.json"
+    startTime = time.time()
+
+    if not ranged or not size:
+        local = threading.local()
+        resp, url = http_get(local, url, headers)
+        if resp.status != 200:
+            raise EpiCoVError(f"HTTP {resp.status} {resp.reason} for {url}")
+        received = 0
+        with open(part, "wb") as f:
+            while True:
+                data = resp.read(HTTP_READ_SIZE)
+                if not data:
+                    break
+                f.write(data)
+                received += len(data)
+        http_close(local)
+        if size and received != size:
+            raise EpiCoVError(f"{os.path.basename(target)}: received {received} of {size} bytes")
+        os.replace(part, target)
+        return target
+
+    # reuse the chunks of an interrupted transfer of the same file
+    state = None
+    if os.path.exists(state_fn) and os.path.exists(part):
+        with open(state_fn) as f:
+            state = json.load(f)
+        if state.get("size") != size or state.get("chunk_size") != chunk_size:
+            state = None
+    if state is None:
+        state = {"size": size, "chunk_size": chunk_size, "chunks": {}}
+        with open(part, "wb") as f:
+            f.truncate(size)
+    else:
+        with open(part, "rb") as f:
+            for i, digest in list(state["chunks"].items()):
+                f.seek(int(i) * chunk_size)
+                if hashlib.sha256(f.read(chunk_size)).hexdigest() != digest:
+                    del state["chunks"][i]
+        logging.info(f" -- resuming {os.path.basename(target)} with "
+                     f"{len(state['chunks'])} chunk(s) already downloaded")
+
+    num_chunks = -(-size // chunk_size)
+    chunks = [(i, i * chunk_size, min((i + 1) * chunk_size, size) - 1)
+              for i in range(num_chunks) if str(i) not in state["chunks"]]
+    lock = threading.Lock()
+    local = threading.local()
+    progress = {"bytes": 0, "report": time.time()}
+
+    def save_state():
+        tmp = f"{state_fn}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, state_fn)
+
+    def fetch(chunk):
+        i, start, end = chunk
+        retry = 0
+        while True:
+            try:
+                resp, _ = http_get(local, url, dict(headers, Range=f"bytes={start}-{end}"))
+                if resp.status != 206:
+                    resp.read()
+                    raise EpiCoVError(f"HTTP {resp.status} {resp.reason} for chunk {i}")
+                digest = hashlib.sha256()
+                offset = start
+                while True:
+                    data = resp.read(HTTP_READ_SIZE)
+                    if not data:
+                        break
+                    os.pwrite(fd, data, offset)
+                    digest.update(data)
+                    offset += len(data)
+                if offset != end + 1:
+                    raise EpiCoVError(f"chunk {i} ended after {offset - start} of {end - start + 1} bytes")
+                break
+            except (OSError, http.client.HTTPException, EpiCoVError) as e:
+                http_close(local)
+                if retry == rt:
+                    raise EpiCoVError(f"{os.path.basename(target)}: {e!r}")
+                retry += 1
+                time.sleep(retry_delay("http chunk", retry, iv, limiter))
+        with lock:
+            state["chunks"][str(i)] = digest.hexdigest()
+            save_state()
+            progress["bytes"] += end - start + 1
+            now = time.time()
+            if now - progress["report"] >= 30:
+                logging.info(f" -- {os.path.basename(target)}: {len(state['chunks'])}/{num_chunks} chunks, "
+                             f"{progress['bytes']/1024**2/(now-startTime):.2f} MB/s")
+                progress["report"] = now
+
+    fd = os.open(part, os.O_RDWR)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max(1, connections)) as executor:
+            for _ in executor.map(fetch, chunks):
+                pass
+    finally:
+        os.close(fd)
+
+    os.replace(part, target)
+    try:
+        os.remove(state_fn)
+    except OSError:
+        pass
+    elapsed = time.time() - startTime
+    logging.info(f" -- {os.path.basename(target)} completed ({size/1024**2:.1f} MB) "
+                 f"in {elapsed:.0f} secs ({progress['bytes']/1024**2/max(elapsed, 1e-3):.2f} MB/s)")
+    return target
+
+
+def jobs_from_args(argvs):
+    """turn command line arguments into daemon jobs"""
+    jobs = []
+    outdir = os.path.abspath(argvs.outdir)
+    if not argvs.nonextstraindata:
+        jobs.append({"type": "download", "outdir": outdir, "concurrent": argvs.concurrent,
+                     "http": http_options(argvs), "artifacts": argvs.artifacts})
+    if argvs.colstart or argvs.colend or argvs.substart or argvs.subend or argvs.location:
+        jobs.append({
+            "type": "query",
+            "outdir": outdir,
+            "location": argvs.location,
+            "host": argvs.host,
+            "colstart": argvs.colstart,
+            "colend": argvs.colend,
+            "substart": argvs.substart,
+            "subend": argvs.subend,
+            "complete": argvs.complete,
+            "highcoverage": argvs.highcoverage,
+            "lowcoverageExcl": argvs.lowcoverageExcl,
+            "http": http_options(argvs),
+        })
+    return jobs
+
+
+def http_options(argvs):
+    """the --http settings passed down to handoff_download(), None without --http"""
+    if not argvs.http:
+        return None
+    return {"connections": argvs.connections, "chunk_size": argvs.chunksize * 1024**2}
+
+
+def run_job(driver, to, wd, job, rt, iv, url=None, limiter=None):
+    """run a daemon job in a logged in browser, returns the downloaded files"""
+    navigate_EpiCoV(driver, to, url, limiter)
+    if job.get("type") == "download":
+        return download_nextstrain(driver, to, wd, rt, iv, job.get("concurrent", False), None,
+                                   job.get("http"), job.get("artifacts"), limiter)
+    elif job.get("type") == "query":
+        return query_EpiCoV(
+            driver, to, wd,
+            job.get("location"),
+            job.get("host"),
+            job.get("colstart"),
+            job.get("colend"),
+            job.get("substart"),
+            job.get("subend"),
+            job.get("complete", False),
+            job.get("highcoverage", False),
+            job.get("lowcoverageExcl", False),
+            rt, iv, None, job.get("http"), limiter)
+    raise EpiCoVError(f"Unknown job type {job.get('type')!r}.")
+
+
+def quit_driver(driver):
+    """quit a webdriver that may already be dead"""
+    if driver is None:
+        return
+    try:
+        driver.quit()
+    except Exception:
+        pass
+
+
+def driver_alive(driver):
+    """whether a webdriver still answers"""
+    if driver is None:
+        return False
+    try:
+        driver.current_url
+        return True
+    except Exception:
+        return False
+
+
+def browser_worker(num, jobs, argvs, drivers):
+    """keep one logged in browser warm and run jobs from the queue
+
+    Downloads land in a staging directory owned by the worker and are moved to
+    the job's outdir when done. A browser that crashes or loses its session is
+    restarted and the job is put back in the queue, up to --retry times.
+    """
+    staging = os.path.join(os.path.abspath(argvs.outdir), f".worker-{num}")
+    os.makedirs(staging, exist_ok=True)
+    driver = None
+    while True:
+        if driver is None:
+            try:
+                driver = open_browser(staging, argvs.normal, argvs.ffbin, argvs.lean)
+                drivers[num] = driver
+                login_EpiCoV(driver, argvs.timeout, argvs.username, argvs.password, argvs.session)
+                logging.info(f"worker {num}: ready.")
+            except Exception as e:
+                logging.error(f"worker {num}: failed to start browser: {e!r}")
+                quit_driver(driver)
+                driver = drivers[num] = None
+                time.sleep(argvs.interval)
+                continue
+
+        try:
+            job, reply = jobs.get(timeout=DAEMON_KEEPALIVE)
+        except queue.Empty:
+            # health check, also keeps the session alive
+            try:
+                navigate_EpiCoV(driver, argvs.timeout)
+            except Exception as e:
+                logging.warning(f"worker {num}: browser is not healthy, restarting: {e!r}")
+                quit_driver(driver)
+                driver = drivers[num] = None
+            continue
+
+        logging.info(f"worker {num}: running {job.get('type')} job...")
+        outdir = job.get("outdir") or os.path.abspath(argvs.outdir)
+        try:
+            # leftovers of failed jobs
+            clear_staging(staging)
+            try:
+                fns = run_job(driver, argvs.timeout, staging, job, argvs.retry, argvs.interval)
+                files = move_downloads(fns, outdir)
+            finally:
+                move_timings(staging, outdir)
+            reply.put({"status": "ok", "files": files})
+        except Exception as e:
+            if isinstance(e, EpiCoVError) and not isinstance(e, (SessionExpired, DownloadTimeout)):
+                reply.put({"status": "error", "error": str(e)})
+                continue
+            logging.error(f"worker {num}: browser failed, restarting: {e!r}")
+            quit_driver(driver)
+            driver = drivers[num] = None
+            job["attempts"] = job.get("attempts", 0) + 1
+            if job["attempts"] <= argvs.retry:
+                count_retry("daemon job")
+                jobs.put((job, reply))
+            else:
+                reply.put({"status": "error", "error": repr(e)})
+
+
+def move_downloads(fns, outdir):
+    """move downloaded files to outdir, returns the new paths"""
+    os.makedirs(outdir, exist_ok=True)
+    files = []
+    for fn in fns:
+        files.append(os.path.join(outdir, os.path.basename(fn)))
+        if fn != files[-1]:
+            shutil.move(fn, files[-1])
+    return files
+
+
+def clear_staging(staging):
+    """remove what a failed job left in the staging directory of a worker"""
+    with os.scandir(staging) as it:
+        entries = list(it)
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
+        except OSError as e:
+            logging.warning(f"Could not remove {entry.path}: {e}")
+
+
+def move_timings(staging, outdir):
+    """append the TIMINGS of a job in staging to those in outdir, pointing them at the moved files"""
+    fn = os.path.join(staging, TIMINGS)
+    if not os.path.exists(fn):
+        return
+    try:
+        os.makedirs(outdir, exist_ok=True)
+        with TIMINGS_LOCK:
+            with open(fn) as src, open(os.path.join(outdir, TIMINGS), "a") as dst:
+                for line in src:
+                    record = json.loads(line)
+                    if record.get("file"):
+                        record["file"] = os.path.join(outdir, os.path.basename(record["file"]))
+                    dst.write(json.dumps(record) + "\n")
+            os.unlink(fn)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not keep the timings of {staging}: {e}")
+
+
+def split_date_range(start, end, days):
+    """split an inclusive YYYY-MM-DD range into windows of `days` days"""
+    start = datetime.datetime.strptime(start, '%Y-%m-%d').date()
+    end = datetime.datetime.strptime(end, '%Y-%m-%d').date()
+    windows = []
+    while start <= end:
+        stop = min(start + datetime.timedelta(days=days-1), end)
+        windows.append((start.isoformat(), stop.isoformat()))
+        start = stop + datetime.timedelta(days=1)
+    return windows
+
+
+def shard_field(query):
+    """pick the date range to shard: collection dates if given, otherwise submission dates"""
+    if query.get("colstart"):
+        return "colstart", "colend"
+    if query.get("substart"):
+        return "substart", "subend"
+    return None, None
+
+
+def run_job_pool(jobs, nw, rt, iv, browsers, start_browser, journal=None, report=None, url=None, limiter=None):
+    """run query jobs over a pool of logged in browsers
+
+    `browsers` are (driver, timeout, download dir) tuples that are already logged
+    in; more are started with start_browser(num) until there are nw of them.
+    Browsers started here are restarted when they crash and closed at the end;
+    a given browser that crashes is replaced with a started one, so the jobs
+    go on with -w 1. A job is retried up to rt times. Jobs with a "step" are skipped when the
+    journal has them and recorded there when done. The outcome of each job
+    goes to report[idx] when a list is given. Returns the files of each job in
+    order.
+    """
+    todo = queue.Queue()
+    results = [None] * len(jobs)
+    errors = []
+    for idx, job in enumerate(jobs):
+        done = journal.done(job["step"]) if journal and "step" in job else None
+        if done is None:
+            todo.put((idx, job, 0))
+        else:
+            logging.info(f"{job['step']} downloaded already.")
+            results[idx] = done
+            if report is not None:
+                report[idx] = {"status": "resumed", "files": done}
+
+    def worker(num, browser):
+        started = browser is None
+        try:
+            while True:
+                try:
+                    idx, job, attempts = todo.get_nowait()
+                except queue.Empty:
+                    return
+                startTime = time.time()
+                try:
+                    if browser is None:
+                        browser = start_browser(num)
+                    driver, to, staging = browser
+                    try:
+                        fns = run_job(driver, to, staging, job, rt, iv, url, limiter)
+                    except NoDataFound:
+                        fns = []
+                    results[idx] = move_downloads(fns, job["outdir"])
+                    if report is not None:
+                        report[idx] = {"status": "ok", "files": results[idx], "attempts": attempts + 1,
+                                       "secs": round(time.time() - startTime, 3)}
+                    if journal and "step" in job:
+                        journal.record(job["step"], results[idx])
+                    continue
+                except Exception as e:
+                    if attempts < rt:
+                        delay = retry_delay("shard job", attempts + 1, iv, limiter)
+                        logging.info(f"worker {num}: job {idx} failed, retrying...#{attempts+1} in {delay:.1f} sec(s)")
+                        time.sleep(delay)
+                        todo.put((idx, job, attempts+1))
+                    else:
+                        errors.append(f"job {idx}: {e!r}")
+                        if report is not None:
+                            report[idx] = {"status": "failed", "error": repr(e), "attempts": attempts + 1,
+                                           "secs": round(time.time() - startTime, 3)}
+                    if isinstance(e, EpiCoVError) and not isinstance(e, SessionExpired):
+                        continue
+                    if not started and not isinstance(e, SessionExpired) and driver_alive(browser[0]):
+                        # a timeout on the caller's browser, run_job() starts over from Browse
+                        continue
+                # the browser is broken; the caller's one is left to the caller
+                # and replaced with one of our own
+                if started and browser:
+                    quit_driver(browser[0])
+                browser = None
+                started = True
+        finally:
+            if started and browser:
+                quit_driver(browser[0])
+
+    browsers = list(browsers)[:nw]
+    browsers += [None] * (min(nw, len(jobs)) - len(browsers))
+    threads = [threading.Thread(target=worker, args=(num, browser), daemon=True)
+               for num, browser in enumerate(browsers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    errors += [f"job {idx}: no browser left to run it" for idx, files in enumerate(results)
+               if files is None and not any(e.startswith(f"job {idx}:") for e in errors)]
+    if errors:
+        raise EpiCoVError(f"{len(errors)} job(s) failed: " + "; ".join(errors))
+    return results
+
+
+def bisect_windows(windows, count, limit):
+    """split date windows in half until count(start, end) is at most limit
+
+    Windows without records are dropped. A single day over the limit is kept
+    as it is, as is a window whose count can not be read.
+    """
+    planned = []
+    stack = list(reversed(windows))
+    while stack:
+        start, end = stack.pop()
+        n = count(start, end)
+        if n is None or n <= limit or start == end:
+            if n is None:
+                logging.warning(f"Could not read the record count of {start} to {end}.")
+            elif n > limit:
+                logging.warning(f"{start} alone has {n} records, more than {limit}.")
+            if n != 0:
+                planned.append((start, end))
+            continue
+        s = datetime.datetime.strptime(start, '%Y-%m-%d').date()
+        e = datetime.datetime.strptime(end, '%Y-%m-%d').date()
+        mid = s + (e - s) // 2
+        stack.append(((mid + datetime.timedelta(days=1)).isoformat(), end))
+        stack.append((start, mid.isoformat()))
+    return planned
+
+
+def preflight_windows(driver, to, query, start_key, end_key, windows, limit, limiter=None):
+    """count the records of each date window in Browse and bisect the oversized ones"""
+    set_browse_filters(
+        driver, to, query.get("location"), query.get("host"),
+        query.get("colstart"), query.get("colend"), query.get("substart"), query.get("subend"),
+        query.get("complete"), query.get("highcoverage"), query.get("lowcoverageExcl"), limiter)
+
+    def count(start, end):
+        dates = [query.get(key) for key in DATE_FILTERS]
+        dates[DATE_FILTERS.index(start_key)] = start
+        dates[DATE_FILTERS.index(end_key)] = end
+        set_date_filters(driver, to, dates, limiter)
+        n = read_record_count(driver)
+        logging.info(f" -- {start} to {end}: {n} record(s)")
+        return n
+
+    logging.info(f"Counting records to keep every shard under {limit}...")
+    return bisect_windows(windows, count, limit)
+
+
+def query_EpiCoV_sharded(wd, query, days, nw, rt, iv, browsers, start_browser, mr=None, journal=None, url=None,
+                         limiter=None):
+    """query a date range in windows over nw browsers and merge the results
+
+    The range is cut into windows of `days` days; with mr the windows are
+    counted in the first browser and bisected until none has more than mr
+    records.
+    """
+    def preflight(windows, start_key, end_key):
+        driver, to, _ = browsers[0]
+        return preflight_windows(driver, to, query, start_key, end_key, windows, mr, limiter)
+
+    start_key, end_key, start, end, windows = plan_shards(query, days, journal, preflight if mr else None)
+    logging.info(f"Querying {start} to {end} in {len(windows)} shard(s) over up to {nw} browser(s)...")
+    jobs = shard_jobs(wd, query, start_key, end_key, windows)
+    results = run_job_pool(jobs, nw, rt, iv, browsers, start_browser, journal, url=url, limiter=limiter)
+    fns = [fn for files in results for fn in files]
+    return merge_downloads(fns, os.path.join(wd, f"gisaid_{start_key[:3]}_{start}_{end}"))
+
+
+def shard_jobs(wd, query, start_key, end_key, windows):
+    """the query jobs of the date windows of a sharded query, each into wd/shards/<window>"""
+    jobs = []
+    for wstart, wend in windows:
+        job = dict(query, type="query", step=f"shard:{wstart}_{wend}",
+                   outdir=os.path.join(wd, "shards", f"{wstart}_{wend}"))
+        job[start_key], job[end_key] = wstart, wend
+        jobs.append(job)
+    return jobs
+
+
+def plan_shards(query, days, journal=None, preflight=None):
+    """cut the date range of query into shard windows, or take them from the journal
+
+    preflight(windows, start_key, end_key) may count the records and return
+    bisected windows. Returns (start_key, end_key, start, end, windows).
+    """
+    start_key, end_key = shard_field(query)
+    if start_key is None:
+        raise EpiCoVError("Sharding needs a collection or submission start date.")
+    start = query[start_key]
+    end = query.get(end_key) or datetime.date.today().isoformat()
+
+    windows = split_date_range(start, end, days) if days else [(start, end)]
+    plan = journal.entry("plan") if journal else None
+    if plan:
+        windows = [tuple(window) for window in plan["data"]["windows"]]
+    elif preflight:
+        windows = preflight(windows, start_key, end_key)
+    if journal and not plan:
+        journal.record("plan", [], {"windows": windows})
+    if not windows:
+        raise NoDataFound("No data found.")
+    return start_key, end_key, start, end, windows
+
+
+def merge_downloads(fns, prefix, append=False):
+    """merge downloaded sequences and metadata into one FASTA and one metadata table
+
+    Sequences are deduplicated by header and metadata rows by accession (or by
+    the whole row if there is no accession column). Tables with different
+    columns are written to separate files. With append, new records are added
+    to the merged files of earlier runs, whose keys are kept in <file>.keys.
+    Returns the merged files.
+    """
+    fasta_fn = f"{prefix}.fasta"
+    tables = {}  # table header -> (file, accession column, seen keys, keys file)
+    skip = False
+
+    def accession_column(header):
+        cols = header.rstrip("\n").split("\t")
+        return next((cols.index(c) for c in ACCESSION_COLUMNS if c in cols), None)
+
+    def load_keys(fn, key):
+        if not append or not os.path.exists(fn):
+            return set()
+        if os.path.exists(f"{fn}.keys"):
+            with open(f"{fn}.keys") as f:
+                return set(line.rstrip("\n") for line in f)
+        # rebuild the keys of a merged file
+        with open(fn) as f:
+            if fn != fasta_fn:
+                f.readline()
+            keys = set(k for k in map(key, f) if k is not None)
+        with open(f"{fn}.keys", "w") as f:
+            f.writelines(f"{k}\n" for k in keys)
+        return keys
+
+    seen_headers = load_keys(fasta_fn, lambda line: line.rstrip("\n") if line.startswith(">") else None)
+    if append:
+        for fn in sorted(glob.glob(f"{prefix}.metadata*.tsv")):
+            with open(fn) as f:
+                header = f.readline()
+            col = accession_column(header)
+            seen = load_keys(fn, lambda line: line.rstrip("\n") if col is None else line.split("\t")[col])
+            tables[header] = (open(fn, "a"), col, seen, open(f"{fn}.keys", "a"))
+    mode = "a" if append else "w"
+    fasta_keys = open(f"{fasta_fn}.keys", "a") if append else None
+    added = 0
+
+    with open(fasta_fn, mode) as fasta:
+        for fn in fns:
+            for name, f in iter_download_members(fn):
+                kind = download_kind(name)
+                if kind == "fasta":
+                    for line in f:
+                        if line.startswith(">"):
+                            key = line.rstrip("\n")
+                            skip = key in seen_headers
+                            if not skip:
+                                seen_headers.add(key)
+                                added += 1
+                                if fasta_keys:
+                                    fasta_keys.write(f"{key}\n")
+                        if not skip:
+                            fasta.write(line)
+                elif kind == "tsv":
+                    header = f.readline()
+                    if header not in tables:
+                        n = len(tables)
+                        out = open(f"{prefix}.metadata.tsv" if n == 0 else f"{prefix}.metadata.{n+1}.tsv", "w")
+                        out.write(header)
+                        keys = open(f"{out.name}.keys", "w") if append else None
+                        tables[header] = (out, accession_column(header), set(), keys)
+                    out, col, seen, keys = tables[header]
+                    for line in f:
+                        key = line.rstrip("\n") if col is None else line.split("\t")[col]
+                        if key not in seen:
+                            seen.add(key)
+                            out.write(line)
+                            if keys:
+                                keys.write(f"{key}\n")
+                else:
+                    logging.info(f" -- skipped {name} while merging")
+
+    merged = [fasta_fn]
+    for out, _, _, keys in tables.values():
+        out.close()
+        if keys:
+            keys.close()
+        merged.append(out.name)
+    if fasta_keys:
+        fasta_keys.close()
+    logging.info(f"Merged {added} new sequence(s) into {fasta_fn}.")
+    return merged
+
+
+def latest_submission_date(fns):
+    """the latest submission date in the metadata tables of the downloads"""
+    latest = None
+    for fn in fns:
+        for name, f in iter_download_members(fn):
+            if download_kind(name) != "tsv":
+                continue
+            cols = f.readline().rstrip("\n").split("\t")
+            col = next((cols.index(c) for c in SUBMISSION_COLUMNS if c in cols), None)
+            if col is None:
+                continue
+            for line in f:
+                date = line.rstrip("\n").split("\t")[col]
+                if re.match(r"\d{4}-\d{2}-\d{2}$", date) and (latest is None or date > latest):
+                    latest = date
+    return latest
+
+
+def read_sync_state(wd):
+    """read the state kept by --sync in the output directory"""
+    try:
+        with open(os.path.join(wd, SYNC_STATE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def sync_master(wd, fns, ss):
+    """append new submissions to the master FASTA and metadata and move the high-water mark"""
+    state = read_sync_state(wd)
+    merged = merge_downloads(fns, os.path.join(wd, SYNC_MASTER), append=True)
+    latest = latest_submission_date(fns)
+    mark = max(d for d in (state.get("high_water_mark"), ss, latest) if d)
+    state.update({
+        "high_water_mark": mark,
+        "last_run": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "master": merged,
+    })
+    fd, tmp = tempfile.mkstemp(dir=wd)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, os.path.join(wd, SYNC_STATE))
+    logging.info(f"Synced submissions up to {mark}.")
+    return merged
+
+
+def read_manifest(fn, argvs):
+    """turn the queries of a --manifest JSON or YAML file into query jobs
+
+    The manifest is a list of queries, or {"defaults": {...}, "queries": [...]}.
+    A query has keys of QUERY_KEYS, a name and an outdir under --outdir (the
+    name by default). Filters given on the command line, like -ht or -cg, are
+    defaults for every query.
+    """
+    with open(fn) as f:
+        text = f.read()
+    if fn.endswith((".yml", ".yaml")):
+        try:
+            import yaml
+        except ImportError:
+            raise EpiCoVError("YAML manifests need PyYAML (pip install pyyaml), or use a JSON manifest.")
+        manifest = yaml.safe_load(text)
+    else:
+        manifest = json.loads(text)
+    if isinstance(manifest, list):
+        manifest = {"queries": manifest}
+
+    outdir = os.path.abspath(argvs.outdir)
+    defaults = {key: getattr(argvs, key) for key in QUERY_KEYS}
+    defaults.update(manifest.get("defaults") or {})
+    jobs = []
+    for num, entry in enumerate(manifest.get("queries") or []):
+        entry = dict(defaults, **entry)
+        name = str(entry.pop("name", None) or f"query-{num+1}")
+        unknown = set(entry) - set(QUERY_KEYS) - set(MANIFEST_KEYS)
+        if unknown:
+            raise EpiCoVError(f"{name}: unknown keys {', '.join(sorted(unknown))}")
+        if name in [job["name"] for job in jobs]:
+            raise EpiCoVError(f"{name}: the name is used twice")
+        for key in DATE_FILTERS:
+            # YAML reads unquoted dates as dates
+            if isinstance(entry.get(key), datetime.date):
+                entry[key] = entry[key].isoformat()
+            if entry.get(key):
+                try:
+                    datetime.datetime.strptime(entry[key], '%Y-%m-%d')
+                except ValueError:
+                    raise EpiCoVError(f"{name}: {key} {entry[key]!r} is not YYYY-MM-DD")
+        if not any(entry.get(key) for key in DATE_FILTERS + ("location",)):
+            raise EpiCoVError(f"{name}: no time range or location entered")
+        job = {key: entry.get(key) for key in QUERY_KEYS}
+        job.update(type="query", name=name, step=f"query:{name}", http=http_options(argvs),
+                   outdir=os.path.join(outdir, str(entry.get("outdir") or name)))
+        jobs.append(job)
+    if not jobs:
+        raise EpiCoVError("the manifest has no queries")
+    return jobs
+
+
+def run_manifest(argvs):
+    """run the queries of --manifest over one logged in session per worker, returns True if all succeeded"""
+    wd = os.path.abspath(argvs.outdir)
+    os.makedirs(wd, exist_ok=True)
+    try:
+        jobs = read_manifest(argvs.manifest, argvs)
+    except (OSError, ValueError, EpiCoVError) as e:
+        logging.error(f"Could not read {argvs.manifest}: {e}")
+        return False
+    journal = Journal(f"{wd}/{JOURNAL}", {"manifest": jobs}, argvs.resume)
+
+    started = time.time()
+    epicov = SeleniumBackend(wd, argvs.normal, argvs.ffbin, argvs.timeout, argvs.lean)
+    try:
+        epicov.open()
+    except EpiCoVError as e:
+        logging.error(e)
+        return False
+    report = [None] * len(jobs)
+    status = "failed"
+    try:
+        epicov.login(argvs.username, argvs.password, argvs.session)
+        journal.record("login", [])
+        logging.info(f"Running {len(jobs)} manifest queries over up to {argvs.workers} worker(s)...")
+        epicov.run_jobs(jobs, argvs.workers, argvs.retry, argvs.interval, journal, report)
+        status = "ok"
+    except EpiCoVError as e:
+        logging.error(e)
+    finally:
+        summarize_manifest(wd, jobs, report)
+        epicov.export_metrics(started, status, argvs.metrics, argvs.trace)
+        epicov.close()
+    return status == "ok"
+
+
+def run_local_query(argvs):
+    """apply the filters of argvs to the last downloaded metadata and sequences, returns True if any record passed"""
+    wd = os.path.abspath(argvs.outdir or ".")
+    metadata_fn = find_snapshot(wd, "metadata")
+    fasta_fn = find_snapshot(wd, "fasta")
+    if not metadata_fn:
+        logging.error(f"No downloaded metadata in {wd}, download it first (without -nnd).")
+        return False
+    if not fasta_fn:
+        logging.warning(f"No downloaded sequences in {wd}, only selecting metadata.")
+
+    filters = {key: getattr(argvs, key) for key in QUERY_KEYS}
+    prefix = f"{wd}/gisaid_local_{time.strftime('%Y_%m_%d_%H%M%S')}"
+    try:
+        files, count = query_snapshot(metadata_fn, fasta_fn, filters, prefix)
+    except (OSError, ValueError) as e:
+        logging.error(f"Could not query {os.path.basename(metadata_fn)}: {e}")
+        return False
+    if not count:
+        logging.error("No data found.")
+        return False
+    for fn in files:
+        logging.info(f"Saved to {fn}.")
+    return True
+
+
+def summarize_manifest(wd, jobs, report):
+    """log one line per manifest query and save them to MANIFEST_SUMMARY in wd"""
+    rows = []
+    for job, outcome in zip(jobs, report):
+        outcome = outcome or {"status": "not run"}
+        files = outcome.get("files") or []
+        rows.append({
+            "name": job["name"],
+            "outdir": job["outdir"],
+            "status": outcome["status"],
+            "files": files,
+            "bytes": sum(os.path.getsize(fn) for fn in files if os.path.exists(fn)),
+            "secs": outcome.get("secs"),
+            "attempts": outcome.get("attempts"),
+            "error": outcome.get("error"),
+        })
+
+    width = max(len(row["name"]) for row in rows)
+    logging.info(f"{'query':<{width}}  {'status':<8} {'files':>5} {'MB':>9} {'secs':>8}")
+    for row in rows:
+        secs = f"{row['secs']:.1f}" if row["secs"] is not None else "-"
+        logging.info(f"{row['name']:<{width}}  {row['status']:<8} {len(row['files']):>5} "
+                     f"{row['bytes']/1024**2:>9.1f} {secs:>8}")
+        if row["error"]:
+            logging.info(f"{'':<{width}}  {row['error']}")
+    with open(os.path.join(wd, MANIFEST_SUMMARY), "w") as f:
+        json.dump(rows, f, indent=2)
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """read JSON jobs, one per line, and answer each with a JSON result line"""
+    def handle(self):
+        for line in self.rfile:
+            try:
+                job = json.loads(line)
+            except ValueError:
+                result = {"status": "error", "error": "invalid JSON job"}
+            else:
+                reply = queue.Queue()
+                self.server.jobs.put((job, reply))
+                result = reply.get()
+            self.wfile.write((json.dumps(result) + "\n").encode())
+
+
+class JobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_daemon(argvs):
+    """run a pool of logged in browsers that take jobs from a Unix socket"""
+    sock = os.path.abspath(argvs.daemon)
+    if os.path.exists(sock):
+        try:
+            submit_job(sock, None)
+        except OSError:
+            # left behind by a daemon that died
+            os.remove(sock)
+        else:
+            logging.error(f"Another daemon is listening on {sock}.")
+            sys.exit(1)
+
+    jobs = queue.Queue()
+    drivers = {}
+    for num in range(argvs.workers):
+        threading.Thread(target=browser_worker, args=(num, jobs, argvs, drivers), daemon=True).start()
+
+    server = JobServer(sock, JobHandler)
+    server.jobs = jobs
+    os.chmod(sock, 0o600)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    logging.info(f"Daemon listening on {sock} with {argvs.workers} worker(s)...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(sock)
+        for driver in list(drivers.values()):
+            quit_driver(driver)
+        log_wait_stats(os.path.abspath(argvs.outdir))
+
+
+def submit_job(sock, job):
+    """send a job to a running daemon and wait for the result"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(sock)
+        if job is None:
+            return None
+        s.sendall((json.dumps(job) + "\n").encode())
+        with s.makefile() as f:
+            line = f.readline()
+    if not line:
+        raise EpiCoVError("The daemon closed the connection.")
+    return json.loads(line)
+
 
 def main():
     argvs = parse_params()
-
     if argvs.version:
         print(f"v{__version__}")
         exit(0)
+
+    # the state file is only shared, and created, when the rate is limited;
+    # without a limit the backoff adapts within this run
+    configure(argvs.url, RateLimiter(argvs.ratefile, argvs.ratelimit) if argvs.ratelimit else RateLimiter())
+
+    if argvs.connect:
+        jobs = jobs_from_args(argvs)
+        if not jobs:
+            logging.error("No time range or location entered.")
+            exit(1)
+        for job in jobs:
+            logging.info(f"Sending {job['type']} job to {argvs.connect}...")
+            result = submit_job(argvs.connect, job)
+            if result["status"] != "ok":
+                logging.error(result["error"])
+                exit(1)
+            for fn in result["files"]:
+                logging.info(f"Downloaded to {fn}.")
+        exit(0)
+    elif argvs.local:
+        if not argvs.colstart and not argvs.colend and not argvs.substart and not argvs.subend and not argvs.location:
+            logging.error("No time range or location entered.")
+            exit(1)
+        exit(0 if run_local_query(argvs) else 1)
     else:
         if not argvs.username or not argvs.password:
             logging.error("error: the following arguments are required: -u/--username, -p/--password")
             exit(1)
 
     logging.info(f"GISAID EpiCoV Utility v{__version__}")
+    if argvs.daemon:
+        serve_daemon(argvs)
+        exit(0)
+    if argvs.manifest:
+        exit(0 if run_manifest(argvs) else 1)
+
     download_gisaid_EpiCoV(
         argvs.username,
         argvs.password,
@@ -613,7 +3199,23 @@ def main():
         argvs.retry,
         argvs.interval,
         argvs.nonextstraindata,
-        argvs.ffbin
+        argvs.ffbin,
+        argvs.concurrent,
+        argvs.session,
+        argvs.sharddays,
+        argvs.workers,
+        argvs.maxrecords,
+        argvs.sync,
+        argvs.resume,
+        http_options(argvs),
+        argvs.artifacts,
+        argvs.metrics,
+        argvs.trace,
+        argvs.lean,
+        argvs.store,
+        argvs.index,
+        argvs.pack,
+        argvs.diff
     )
     logging.info("Completed.")
 
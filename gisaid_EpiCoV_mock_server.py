@@ -0,0 +1,827 @@
+#!/usr/bin/env python3
+
+__author__ = "Po-E Li, B10, LANL"
+__copyright__ = "LANL 2020"
+__license__ = "GPL"
+__version__ = "21.05.10"
+__email__ = "po-e@lanl.gov"
+
+import os
+import time
+import argparse as ap
+import json
+import re
+import logging
+import datetime
+import hashlib
+import random
+import shutil
+import socketserver
+import tarfile
+import tempfile
+import threading
+import uuid
+import email.parser
+import email.policy
+import http.server
+import urllib.parse
+
+# the nextstrain artifacts in the Downloads section: (key, label, file name prefix)
+ARTIFACTS = [
+    ("metadata", "metadata", "metadata_tsv"),
+    ("fasta", "FASTA", "sequences_fasta"),
+    ("msa-full", "MSA full", "msa_full"),
+    ("msa-unmasked", "MSA unmasked", "msa_unmasked"),
+    ("msa-masked", "MSA masked", "msa_masked"),
+]
+
+# the download options of Browse
+EXPORT_OPTIONS = ["Sequences (FASTA)", "Patient status metadata"]
+
+LOCATIONS = [
+    "North America / USA / California",
+    "North America / USA / New York",
+    "Europe / United Kingdom / England",
+    "Europe / Germany / Bavaria",
+    "Asia / Japan / Tokyo",
+    "Oceania / Australia / Victoria",
+    "South America / Brazil / Sao Paulo",
+    "Africa / South Africa / Gauteng",
+]
+LINEAGES = [("B.1.1.7", "GRY"), ("B.1.351", "GH"), ("P.1", "GR"), ("B.1.617.2", "GK"), ("B.1.2", "GH"), ("B.1.429", "GH")]
+
+METADATA_COLUMNS = [
+    "Virus name", "Type", "Accession ID", "Collection date", "Location", "Sequence length", "Host",
+    "Patient age", "Gender", "Clade", "Pango lineage", "Submission date",
+    "Is complete?", "Is high coverage?", "Is low coverage?", "N-Content",
+]
+PATIENT_COLUMNS = [
+    "Virus name", "Accession ID", "Collection date", "Location", "Host", "Gender", "Patient age",
+    "Patient status", "Lineage", "Clade", "Submission date",
+]
+
+# rows shown in the Browse table
+PAGE_SIZE = 25
+# bytes per write when streaming a file
+SEND_BLOCK = 64 * 1024
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M',
+)
+
+
+def parse_params():
+    p = ap.ArgumentParser(prog='gisaid_EpiCoV_mock_server.py',
+                          description="""Serve a local stand-in of the EpiCoV site for tests and benchmarks""")
+
+    p.add_argument('--host',
+                   metavar='[STR]', type=str, required=False, default="127.0.0.1",
+                   help="address to listen on. Default is 127.0.0.1.")
+
+    p.add_argument('--port',
+                   metavar='[INT]', type=int, required=False, default=8080,
+                   help="port to listen on. Default is 8080.")
+
+    p.add_argument('-u', '--username',
+                   metavar='[STR]', type=str, required=False, default="mock",
+                   help="login accepted by the site. Default is mock.")
+
+    p.add_argument('-p', '--password',
+                   metavar='[STR]', type=str, required=False, default="mock",
+                   help="password accepted by the site. Default is mock.")
+
+    p.add_argument('--records',
+                   metavar='[INT]', type=int, required=False, default=1000,
+                   help="number of genomes in the database. Default is 1000.")
+
+    p.add_argument('--seqlen',
+                   metavar='[INT]', type=int, required=False, default=29903,
+                   help="length of the genomes. Default is 29903.")
+
+    p.add_argument('--size',
+                   metavar='[INT]', type=int, required=False, default=0,
+                   help="pad every nextstrain artifact with this many MB of incompressible data. Default is 0.")
+
+    p.add_argument('--latency',
+                   metavar='[FLOAT]', type=float, required=False, default=0.5,
+                   help="seconds the page stays busy after each action. Default is 0.5.")
+
+    p.add_argument('--packaging',
+                   metavar='[FLOAT]', type=float, required=False, default=1.0,
+                   help="seconds before a download starts. Default is 1.")
+
+    p.add_argument('--bandwidth',
+                   metavar='[FLOAT]', type=float, required=False, default=0,
+                   help="MB/s per connection for downloads, 0 for unlimited. Default is 0.")
+
+    p.add_argument('--seed',
+                   metavar='[INT]', type=int, required=False, default=2020,
+                   help="seed of the generated genomes. Default is 2020.")
+
+    p.add_argument('--cachedir',
+                   metavar='[STR]', type=str, required=False, default=None,
+                   help="where the generated files are kept. Default is a temporary directory.")
+
+    return p.parse_args()
+
+
+def make_records(num, seed):
+    """generate the metadata of num genomes"""
+    rng = random.Random(seed)
+    start = datetime.date(2020, 1, 1)
+    records = []
+    for i in range(num):
+        location = rng.choice(LOCATIONS)
+        country = location.split(" / ")[1]
+        collected = start + datetime.timedelta(days=rng.randrange(500))
+        submitted = collected + datetime.timedelta(days=rng.randrange(1, 40))
+        lineage, clade = rng.choice(LINEAGES)
+        complete = rng.random() < 0.9
+        records.append({
+            "index": i,
+            "Virus name": f"hCoV-19/{country}/MOCK-{i+1}/{collected.year}",
+            "Type": "betacoronavirus",
+            "Accession ID": f"EPI_ISL_{400000+i}",
+            "Collection date": collected.isoformat(),
+            "Location": location,
+            "Host": "Human" if rng.random() < 0.97 else "Environment",
+            "Patient age": str(rng.randrange(1, 95)),
+            "Gender": rng.choice(["Male", "Female", "unknown"]),
+            "Patient status": rng.choice(["Hospitalized", "Released", "unknown"]),
+            "Clade": clade,
+            "Pango lineage": lineage,
+            "Lineage": lineage,
+            "Submission date": submitted.isoformat(),
+            "Is complete?": "True" if complete else "",
+            "Is high coverage?": "True" if rng.random() < 0.7 else "",
+            "Is low coverage?": "True" if rng.random() < 0.1 else "",
+        })
+    return records
+
+
+def filter_records(records, query):
+    """the records that pass the Browse filters in query"""
+    location = query.get("location", "").strip().lower()
+    host = query.get("host", "").strip().lower()
+    dates = [query.get(key, "").strip() for key in ("colstart", "colend", "substart", "subend")]
+    selected = []
+    for record in records:
+        if location and location not in record["Location"].lower():
+            continue
+        if host and host != record["Host"].lower():
+            continue
+        if dates[0] and record["Collection date"] < dates[0]:
+            continue
+        if dates[1] and record["Collection date"] > dates[1]:
+            continue
+        if dates[2] and record["Submission date"] < dates[2]:
+            continue
+        if dates[3] and record["Submission date"] > dates[3]:
+            continue
+        if query.get("complete") and not record["Is complete?"]:
+            continue
+        if query.get("highq") and not record["Is high coverage?"]:
+            continue
+        if query.get("lowco") and record["Is low coverage?"]:
+            continue
+        selected.append(record)
+    return selected
+
+
+class Genomes:
+    """deterministic genomes: a random reference with a few substitutions per record"""
+
+    def __init__(self, seqlen, seed):
+        rng = random.Random(seed)
+        self.seqlen = seqlen
+        self.seed = seed
+        self.reference = "".join(rng.choice("ACGT") for _ in range(seqlen))
+
+    def sequence(self, record, masked=False):
+        rng = random.Random(self.seed * 1000003 + record["index"])
+        seq = list(self.reference)
+        for _ in range(self.seqlen // 1000 + 3):
+            pos = rng.randrange(self.seqlen)
+            seq[pos] = rng.choice("ACGT".replace(seq[pos], ""))
+        if not record["Is complete?"]:
+            start = rng.randrange(self.seqlen - 200)
+            seq[start:start + 200] = "N" * 200
+        if masked:
+            seq[:55] = "N" * 55
+            seq[-100:] = "N" * 100
+        return "".join(seq)
+
+
+def fasta_header(record):
+    return f">{record['Virus name']}|{record['Accession ID']}|{record['Collection date']}"
+
+
+def write_fasta(fn, records, genomes, masked=False, width=0):
+    """write the genomes of records to fn"""
+    with open(fn, "w") as f:
+        for record in records:
+            seq = genomes.sequence(record, masked)
+            f.write(f"{fasta_header(record)}\n")
+            if width:
+                for i in range(0, len(seq), width):
+                    f.write(seq[i:i + width] + "\n")
+            else:
+                f.write(seq + "\n")
+
+
+def write_table(fn, records, columns, genomes=None):
+    """write the columns of records to fn as TSV"""
+    with open(fn, "w") as f:
+        f.write("\t".join(columns) + "\n")
+        for record in records:
+            row = dict(record)
+            if genomes:
+                row["Sequence length"] = str(genomes.seqlen)
+                row["N-Content"] = "" if record["Is complete?"] else f"{200/genomes.seqlen:.6f}"
+            f.write("\t".join(row.get(col, "") for col in columns) + "\n")
+
+
+class MockServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """the mock EpiCoV site with its database, sessions and generated files"""
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, MockHandler)
+        self.config = config
+        self.records = make_records(config["records"], config["seed"])
+        self.genomes = Genomes(config["seqlen"], config["seed"])
+        self.sessions = {}
+        self.cachedir = config.get("cachedir") or tempfile.mkdtemp(prefix="gisaid_mock_")
+        self.owns_cachedir = not config.get("cachedir")
+        os.makedirs(self.cachedir, exist_ok=True)
+        self.cache_lock = threading.Lock()
+        self.stamp = datetime.date.today().strftime("%Y_%m_%d")
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/epi3/frontend"
+
+    def cached(self, name, build):
+        """path of a generated file, built by build(path) on first use"""
+        path = os.path.join(self.cachedir, name)
+        with self.cache_lock:
+            if not os.path.exists(path):
+                startTime = time.time()
+                build(f"{path}.tmp")
+                os.replace(f"{path}.tmp", path)
+                logging.info(f"generated {name} ({os.path.getsize(path)/1024**2:.1f} MB) "
+                             f"in {time.time()-startTime:.1f} secs")
+        return path
+
+    def artifact(self, key):
+        """path and download name of a nextstrain artifact"""
+        prefix = next(prefix for k, _, prefix in ARTIFACTS if k == key)
+        name = f"{prefix}_{self.stamp}.tar.xz"
+
+        def build(path):
+            staging = tempfile.mkdtemp(dir=self.cachedir)
+            try:
+                members = []
+                if key == "metadata":
+                    members.append("metadata.tsv")
+                    write_table(os.path.join(staging, members[-1]), self.records, METADATA_COLUMNS, self.genomes)
+                elif key == "fasta":
+                    members.append("sequences.fasta")
+                    write_fasta(os.path.join(staging, members[-1]), self.records, self.genomes, width=80)
+                else:
+                    members.append(f"{prefix}_{self.stamp}.fasta")
+                    write_fasta(os.path.join(staging, members[-1]), self.records, self.genomes,
+                                masked=key == "msa-masked")
+                if self.config["size"]:
+                    members.append("padding.bin")
+                    with open(os.path.join(staging, members[-1]), "wb") as f:
+                        for _ in range(self.config["size"]):
+                            f.write(os.urandom(1024**2))
+                with tarfile.open(path, "w:xz", preset=0) as tar:
+                    for member in members:
+                        tar.add(os.path.join(staging, member), arcname=member)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+
+        return self.cached(name, build), name
+
+    def export(self, option, query):
+        """path and download name of a Browse download option for query"""
+        key = hashlib.sha1(json.dumps(query, sort_keys=True).encode()).hexdigest()[:12]
+        ext = "fasta" if option == 0 else "tsv"
+        records = filter_records(self.records, query)
+
+        def build(path):
+            if option == 0:
+                write_fasta(path, records, self.genomes)
+            else:
+                write_table(path, records, PATIENT_COLUMNS)
+
+        path = self.cached(f"export_{key}_{option}.{ext}", build)
+        return path, f"gisaid_hcov-19_{self.stamp}_{time.strftime('%H%M%S')}_{option}.{ext}"
+
+    def server_close(self):
+        super().server_close()
+        if self.owns_cachedir:
+            shutil.rmtree(self.cachedir, ignore_errors=True)
+
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    """routes the pages, the JSON calls and the downloads of the mock site"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def session(self):
+        """the session of the request, None if not logged in"""
+        cookie = self.headers.get("Cookie", "")
+        m = re.search(r"(?:^|;\s*)sid=([\w-]+)", cookie)
+        return self.server.sessions.get(m.group(1)) if m else None
+
+    def query(self):
+        return {k: v[0] for k, v in urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query).items()}
+
+    def body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def send_body(self, status, body, content_type="text/html; charset=utf-8", headers=None):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data, headers=None):
+        self.send_body(200, json.dumps(data), "application/json", headers)
+
+    def send_file(self, path, name):
+        """send a file as an attachment, honouring a single byte range"""
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        status = 200
+        rng = self.headers.get("Range")
+        if rng:
+            m = re.match(r"bytes=(\d*)-(\d*)$", rng.strip())
+            if m and (m.group(1) or m.group(2)):
+                if m.group(1):
+                    start = int(m.group(1))
+                    end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+                else:
+                    start = max(size - int(m.group(2)), 0)
+                if start > end or start >= size:
+                    self.send_body(416, "", headers={"Content-Range": f"bytes */{size}"})
+                    return
+                status = 206
+        else:
+            # GISAID packs the file before the transfer starts
+            time.sleep(self.config["packaging"])
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Disposition", f'attachment; filename="{name}"')
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+
+        rate = self.config["bandwidth"] * 1024**2
+        startTime = time.time()
+        sent = 0
+        with open(path, "rb") as f:
+            f.seek(start)
+            while sent < end - start + 1:
+                data = f.read(min(SEND_BLOCK, end - start + 1 - sent))
+                if not data:
+                    break
+                self.wfile.write(data)
+                sent += len(data)
+                if rate:
+                    ahead = sent / rate - (time.time() - startTime)
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        session = self.session()
+        if path in ("/", "/epi3/frontend", "/epi3/frontend/"):
+            self.send_body(200, APP_HTML.replace("__CONFIG__", json.dumps({"latency": self.config["latency"]})))
+        elif path == "/mock/state":
+            self.send_json({"logged_in": session is not None})
+        elif session is None:
+            self.send_body(403, "Not logged in.", "text/plain")
+        elif path == "/mock/browse":
+            query = self.query()
+            records = filter_records(self.server.records, query)
+            self.send_json({
+                "count": len(records),
+                "options": EXPORT_OPTIONS,
+                "rows": [{col: r[col] for col in ("Virus name", "Accession ID", "Collection date", "Location",
+                                                  "Submission date")} for r in records[:PAGE_SIZE]],
+            })
+        elif path == "/mock/browse-download":
+            self.send_body(200, BROWSE_DOWNLOAD_HTML.replace("__OPTIONS__", "".join(
+                f'<div><label><input type="radio" name="format" value="{i}"{" checked" if i == 0 else ""}> '
+                f'{label}</label></div>' for i, label in enumerate(EXPORT_OPTIONS))).replace(
+                "__QUERY__", json.dumps(urllib.parse.urlsplit(self.path).query)))
+        elif path.startswith("/mock/export/"):
+            option = int(path.rsplit("/", 1)[1])
+            self.send_file(*self.server.export(option, self.query()))
+        elif path == "/mock/downloads":
+            self.send_body(200, DOWNLOADS_HTML.replace("__ARTIFACTS__", "".join(
+                f'<div class="sys-download-item" onclick="pick(\'{key}\')">{label}</div>'
+                for key, label, _ in ARTIFACTS)).replace("__CONFIG__", json.dumps({"latency": self.config["latency"]})))
+        elif path == "/mock/reminder":
+            self.send_body(200, REMINDER_HTML.replace("__ARTIFACT__", json.dumps(self.query().get("artifact", ""))))
+        elif path.startswith("/mock/artifact/"):
+            key = path.rsplit("/", 1)[1]
+            if key not in [k for k, _, _ in ARTIFACTS]:
+                self.send_body(404, "No such artifact.", "text/plain")
+                return
+            self.send_file(*self.server.artifact(key))
+        elif path == "/mock/upload-choice":
+            self.send_body(200, UPLOAD_CHOICE_HTML)
+        elif path == "/mock/batch-file":
+            self.send_body(200, BATCH_FILE_HTML.replace("__KIND__", self.query().get("kind", "")).replace("__STATUS__", ""))
+        else:
+            self.send_body(404, "Not found.", "text/plain")
+
+    def do_POST(self):
+        path = urllib.parse.urlsplit(self.path).path
+        body = self.body()
+        if path == "/mock/login":
+            form = {k: v[0] for k, v in urllib.parse.parse_qs(body.decode()).items()}
+            time.sleep(self.config["latency"])
+            if form.get("login") != self.config["username"] or form.get("password") != self.config["password"]:
+                self.send_json({"ok": False, "error": "Invalid login."})
+                return
+            sid = uuid.uuid4().hex
+            self.server.sessions[sid] = {"user": form["login"], "uploads": {}, "submissions": []}
+            self.send_json({"ok": True}, {"Set-Cookie": f"sid={sid}; Path=/; HttpOnly"})
+            return
+        session = self.session()
+        if session is None:
+            self.send_body(403, "Not logged in.", "text/plain")
+        elif path == "/mock/submit":
+            fields = json.loads(body.decode() or "{}")
+            session["submissions"].append(fields)
+            messages = [f"{name} is required." for name in ("Virus name", "Collection date", "Location")
+                        if not fields.get(name)]
+            if not fields.get("Sequence"):
+                messages.append("Sequence is required.")
+            if not messages:
+                messages.append(f"Submission {len(session['submissions'])} received for review.")
+            self.send_json({"messages": messages})
+        elif path == "/mock/batch-upload":
+            kind = self.query().get("kind", "")
+            parser = email.parser.BytesParser(policy=email.policy.HTTP)
+            message = parser.parsebytes(b"Content-Type: " + self.headers.get("Content-Type", "").encode()
+                                        + b"\r\n\r\n" + body)
+            status = "No file received."
+            for part in message.iter_parts():
+                if part.get_param("name", header="content-disposition") == "data":
+                    data = part.get_payload(decode=True) or b""
+                    session["uploads"][kind] = (part.get_filename(), data)
+                    status = f"Received {part.get_filename()} ({len(data)} bytes)."
+            self.send_body(200, BATCH_FILE_HTML.replace("__KIND__", kind).replace("__STATUS__", status))
+        elif path == "/mock/batch-check":
+            uploads = session["uploads"]
+            warnings = [f"Please upload the {kind} file." for kind in ("metadata", "fasta") if kind not in uploads]
+            report = ""
+            if not warnings:
+                num = uploads["fasta"][1].count(b"\n>") + uploads["fasta"][1].startswith(b">")
+                report = (f"{uploads['metadata'][0]}: {len(uploads['metadata'][1])} bytes\n"
+                          f"{uploads['fasta'][0]}: {num} sequence(s) received for review")
+                session["submissions"].append({"batch": num})
+            self.send_json({"warnings": warnings, "report": report})
+        else:
+            self.send_body(404, "Not found.", "text/plain")
+
+
+APP_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>GISAID - EpiCoV (mock)</title>
+<style>
+#sys_timer { position: fixed; top: 0; right: 0; padding: 4px; background: #fc0; }
+.sys-actionbar-action { display: inline-block; padding: 4px 8px; cursor: pointer; border: 1px solid #ccc; }
+#main_nav li { display: inline-block; margin-right: 12px; }
+iframe.overlay { position: fixed; top: 40px; right: 20px; width: 480px; height: 320px; background: #fff; border: 1px solid #999; }
+iframe.batch { width: 480px; height: 80px; }
+</style></head>
+<body>
+<div id="sys_timer" style="display:none">Please wait...</div>
+<div id="app"></div>
+<script>
+var MOCK = __CONFIG__;
+var overlays = 0;
+function $(id) { return document.getElementById(id); }
+function wait(on) { $('sys_timer').style.display = on ? 'block' : 'none'; }
+function busy(fn, secs) {
+    wait(true);
+    setTimeout(function () { wait(false); if (fn) fn(); }, 1000 * (secs === undefined ? MOCK.latency : secs));
+}
+function api(path, opts) {
+    return fetch(path, Object.assign({credentials: 'same-origin'}, opts || {})).then(function (r) { return r.json(); });
+}
+function escapeHtml(s) {
+    return String(s).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+}
+
+function start() {
+    wait(true);
+    api('/mock/state').then(function (s) { busy(s.logged_in ? showMain : showLogin); });
+}
+function showLogin() {
+    $('app').innerHTML = '<form onsubmit="return doLogin();">' +
+        'Username <input type="text" name="login"> Password <input type="password" name="password"> ' +
+        '<button type="submit">Login</button></form><div id="login_message"></div>';
+}
+function doLogin() {
+    var body = new URLSearchParams();
+    body.set('login', document.getElementsByName('login')[0].value);
+    body.set('password', document.getElementsByName('password')[0].value);
+    wait(true);
+    api('/mock/login', {method: 'POST', body: body}).then(function (r) {
+        wait(false);
+        if (r.ok) showMain(); else $('login_message').textContent = r.error;
+    });
+    return false;
+}
+function showMain() {
+    $('app').innerHTML = '<div id="main_nav"><ul>' +
+        '<li><a href="#">Home</a></li><li><a href="#">EpiFlu</a></li>' +
+        '<li><a href="#" onclick="showEpiCoV(); return false;">EpiCoV</a></li></ul></div>' +
+        '<div id="content"></div>';
+}
+function showEpiCoV() {
+    busy(function () {
+        var actions = ['Search', 'Bro' + 'wse', 'Downloads', 'Upload', 'Batch Upload'];
+        $('content').innerHTML = '<div class="sys-actionbar-bar">' + actions.map(function (label, i) {
+            return '<div class="sys-actionbar-action" onclick="act(' + i + ')">' + label + '</div>';
+        }).join('') + '</div><div id="panel"><p>Mock EpiCoV database.</p></div>';
+    });
+}
+function act(i) {
+    if (i == 1) showQuery();
+    else if (i == 2) openOverlay('/mock/downloads');
+    else if (i == 3) openOverlay('/mock/upload-choice');
+    else if (i == 4) showBatch();
+}
+
+// popups live in an iframe whose id starts with sysoverlay
+function openOverlay(src) {
+    closeOverlay();
+    busy(function () {
+        var f = document.createElement('iframe');
+        f.id = 'sysoverlay-' + (++overlays);
+        f.className = 'overlay';
+        f.src = src;
+        document.body.appendChild(f);
+    });
+}
+function closeOverlay(delay) {
+    var frames = Array.prototype.filter.call(document.getElementsByTagName('iframe'), function (f) {
+        return f.id.indexOf('sysoverlay') == 0;
+    });
+    setTimeout(function () { frames.forEach(function (f) { f.remove(); }); }, delay || 0);
+}
+function startDownload(url) {
+    var a = document.createElement('a');
+    a.href = url;
+    a.download = '';
+    document.body.appendChild(a);
+    a.click();
+    a.remove();
+}
+
+var refreshTimer = null;
+function showQuery() {
+    busy(function () {
+        function field(label, id) {
+            return '<tr><td><div>' + label + '</div></td><td><div><div><input type="text" id="' + id + '"></div></div></td></tr>';
+        }
+        function dates(label) {
+            return '<tr><td><div>' + label + '</div></td><td>' +
+                '<div class="sys-form-fi-date"><input type="text"></div>' +
+                '<div class="sys-form-fi-date"><input type="text"></div></td></tr>';
+        }
+        $('panel').innerHTML = '<table>' + field('Location', 'f_location') + field('Host', 'f_host') +
+            dates('Collection') + dates('Submission') +
+            '<tr><td colspan="2"><input type="checkbox" value="complete"> complete ' +
+            '<input type="checkbox" value="highq"> high coverage ' +
+            '<input type="checkbox" value="lowco"> low coverage excl</td></tr></table>' +
+            '<table class="yui-dt"><thead><tr><th><span class="yui-dt-label"><input type="checkbox" id="select_all"></span></th>' +
+            '<th>Virus name</th><th>Accession ID</th><th>Collection date</th><th>Location</th><th>Submission date</th></tr></thead>' +
+            '<tbody class="yui-dt-message" id="dt_message"><tr><td colspan="6">Loading...</td></tr></tbody>' +
+            '<tbody class="yui-dt-data" id="dt_data"></tbody>' +
+            '<tfoot><tr><td class="sys-datatable-info" colspan="6" id="dt_info"></td></tr></tfoot></table>';
+        Array.prototype.forEach.call($('panel').getElementsByTagName('input'), function (input) {
+            if (input.id == 'select_all') return;
+            input.addEventListener(input.type == 'checkbox' ? 'change' : 'input', refresh);
+        });
+        refresh();
+    });
+}
+function currentQuery() {
+    var q = new URLSearchParams();
+    q.set('location', $('f_location').value);
+    q.set('host', $('f_host').value);
+    var dates = document.querySelectorAll('div.sys-form-fi-date input');
+    ['colstart', 'colend', 'substart', 'subend'].forEach(function (key, i) { q.set(key, dates[i].value); });
+    ['complete', 'highq', 'lowco'].forEach(function (key) {
+        if (document.querySelector('input[value="' + key + '"]').checked) q.set(key, '1');
+    });
+    return q.toString();
+}
+function refresh() {
+    clearTimeout(refreshTimer);
+    refreshTimer = setTimeout(function () {
+        $('dt_message').style.display = '';
+        wait(true);
+        api('/mock/browse?' + currentQuery()).then(function (r) {
+            setTimeout(function () { renderTable(r); $('dt_message').style.display = 'none'; wait(false); },
+                       1000 * MOCK.latency);
+        });
+    }, 300);
+}
+function renderTable(r) {
+    if (r.count == 0) {
+        $('dt_data').innerHTML = '<tr><td colspan="6"><div>No data found.</div></td></tr>';
+    } else {
+        $('dt_data').innerHTML = r.rows.map(function (row) {
+            return '<tr><td><input type="checkbox"></td><td>' + escapeHtml(row['Virus name']) + '</td><td>' +
+                row['Accession ID'] + '</td><td>' + row['Collection date'] + '</td><td>' +
+                escapeHtml(row['Location']) + '</td><td>' + row['Submission date'] + '</td></tr>';
+        }).join('');
+    }
+    $('dt_info').innerHTML = 'Total: ' + r.count.toLocaleString('en-US') + ' viruses ' +
+        '<button onclick="openOverlay(\\'/mock/browse-download?\\' + currentQuery())">Download</button>';
+}
+
+var uploadFields = ['Virus name', 'Passage details/history', 'Collection date', 'Location',
+    'Additional location information', 'Host', 'Additional host information', 'Gender', 'Patient age',
+    'Patient status', 'Specimen source', 'Outbreak detail', 'Last vaccinated', 'Treatment',
+    'Sequencing technology', 'Assembly method', 'Coverage', 'Sample ID given by the provider',
+    'Sample ID given by the submitting laboratory'];
+var uploadAreas = ['Originating lab', 'Originating lab address', 'Submitting lab', 'Submitting lab address',
+    'Authors', 'Submitter information', 'Sequence'];
+function showUpload(kind) {
+    closeOverlay(1500);
+    if (kind == 'batch') { showBatch(); return; }
+    busy(function () {
+        $('panel').innerHTML = '<table>' + uploadFields.map(function (label) {
+            return '<tr><td>' + label + '</td><td><input type="text" data-field="' + label + '"></td></tr>';
+        }).join('') + uploadAreas.map(function (label) {
+            return '<tr><td>' + label + '</td><td><textarea data-field="' + label + '"></textarea></td></tr>';
+        }).join('') + '</table><button onclick="submitUpload()">Submit for Review</button><div id="upload_messages"></div>';
+    });
+}
+function submitUpload() {
+    var fields = {};
+    Array.prototype.forEach.call(document.querySelectorAll('[data-field]'), function (e) {
+        fields[e.getAttribute('data-field')] = e.value;
+    });
+    wait(true);
+    api('/mock/submit', {method: 'POST', body: JSON.stringify(fields)}).then(function (r) {
+        $('upload_messages').innerHTML = r.messages.map(function (m) {
+            return '<div class="sys-form-fi-message">' + escapeHtml(m) + '</div>';
+        }).join('');
+        wait(false);
+    });
+}
+function showBatch() {
+    busy(function () {
+        $('panel').innerHTML = '<div>Metadata</div><iframe class="batch" id="batch_metadata" src="/mock/batch-file?kind=metadata"></iframe>' +
+            '<div>Sequences</div><iframe class="batch" id="batch_fasta" src="/mock/batch-file?kind=fasta"></iframe>' +
+            '<div><button onclick="checkBatch()">Check and Submit</button></div><div id="batch_result"></div>';
+    });
+}
+function checkBatch() {
+    wait(true);
+    api('/mock/batch-check', {method: 'POST'}).then(function (r) {
+        $('batch_result').innerHTML = r.warnings.map(function (m) {
+            return '<div class="bd">' + escapeHtml(m) + '</div>';
+        }).join('') + (r.report ? '<div class="sys-form-fi-multiline-ro">' + escapeHtml(r.report) + '</div>' : '');
+        wait(false);
+    });
+}
+start();
+</script>
+</body></html>
+"""
+
+BROWSE_DOWNLOAD_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"></head><body>
+__OPTIONS__
+<button onclick="go()">Download</button>
+<script>
+function go() {
+    var option = document.querySelector('input[name=format]:checked').value;
+    parent.startDownload('/mock/export/' + option + '?' + __QUERY__);
+    parent.closeOverlay(1500);
+}
+</script>
+</body></html>
+"""
+
+DOWNLOADS_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"></head><body>
+<div>__ARTIFACTS__</div>
+<button onclick="parent.closeOverlay()">Back</button>
+<div id="reminder"></div>
+<script>
+var MOCK = __CONFIG__;
+function pick(key) {
+    closeReminder();
+    setTimeout(function () {
+        var f = document.createElement('iframe');
+        f.src = '/mock/reminder?artifact=' + key;
+        document.getElementById('reminder').appendChild(f);
+    }, 1000 * MOCK.latency);
+}
+function closeReminder(delay) {
+    var frames = Array.prototype.slice.call(document.getElementsByTagName('iframe'));
+    setTimeout(function () { frames.forEach(function (f) { f.remove(); }); }, delay || 0);
+}
+</script>
+</body></html>
+"""
+
+REMINDER_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"></head><body>
+<p>REMINDER: the data is subject to the GISAID Terms of Use.</p>
+<input type="checkbox" class="sys-event-hook" onchange="document.getElementById('dl').disabled = !this.checked"> I agree
+<button id="dl" disabled onclick="go()">Download</button>
+<script>
+function go() {
+    parent.parent.startDownload('/mock/artifact/' + __ARTIFACT__);
+    parent.closeReminder(1500);
+}
+</script>
+</body></html>
+"""
+
+UPLOAD_CHOICE_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"></head><body>
+<table><tr>
+<td onclick="parent.showUpload('single')">Single upload</td>
+<td onclick="parent.showUpload('batch')">Batch upload</td>
+</tr></table>
+</body></html>
+"""
+
+BATCH_FILE_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"></head><body>
+<form method="post" enctype="multipart/form-data" action="/mock/batch-upload?kind=__KIND__">
+<input type="file" name="data" onchange="this.form.submit()">
+</form>
+<div>__STATUS__</div>
+</body></html>
+"""
+
+
+def start_server(config, host="127.0.0.1", port=0):
+    """start the mock site in a background thread, returns the server"""
+    server = MockServer((host, port), config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    argvs = parse_params()
+    config = {
+        "username": argvs.username,
+        "password": argvs.password,
+        "records": argvs.records,
+        "seqlen": argvs.seqlen,
+        "size": argvs.size,
+        "latency": argvs.latency,
+        "packaging": argvs.packaging,
+        "bandwidth": argvs.bandwidth,
+        "seed": argvs.seed,
+        "cachedir": argvs.cachedir,
+    }
+    server = MockServer((argvs.host, argvs.port), config)
+    logging.info(f"Mock EpiCoV site with {argvs.records} genome(s) at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
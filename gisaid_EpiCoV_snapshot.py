@@ -0,0 +1,1216 @@
+#!/usr/bin/env python3
+
+__author__ = "Po-E Li, B10, LANL"
+__copyright__ = "LANL 2020"
+__license__ = "GPL"
+__version__ = "21.05.10"
+__email__ = "po-e@lanl.gov"
+
+import os
+import time
+import sys
+import argparse as ap
+import csv
+import io
+import glob
+import hashlib
+import heapq
+import itertools
+import json
+import mmap
+import shutil
+import sqlite3
+import struct
+import tempfile
+import gzip
+import bz2
+import lzma
+import logging
+import tarfile
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# metadata columns by meaning: names in metadata.tsv of the Downloads section
+# first, then in the older nextmeta
+NAME_COLUMNS = ("Virus name", "strain")
+ACCESSION_COLUMNS = ("Accession ID", "gisaid_epi_isl", "accession_id")
+COLLECTION_COLUMNS = ("Collection date", "date")
+SUBMISSION_COLUMNS = ("Submission date", "date_submitted")
+LOCATION_COLUMNS = ("Location",)
+HOST_COLUMNS = ("Host", "host")
+LINEAGE_COLUMNS = ("Pango lineage", "pango_lineage", "pangolin_lineage", "Lineage")
+# GISAID accessions in FASTA headers
+ACCESSION_PREFIX = "EPI_ISL_"
+# nextmeta has the location in parts instead
+LOCATION_PARTS = ("region", "country", "division", "location")
+
+# Browse filters: date filter -> (column meaning, True for a start date)
+DATE_FILTERS = {
+    "colstart": ("collection", True),
+    "colend": ("collection", False),
+    "substart": ("submission", True),
+    "subend": ("submission", False),
+}
+# Browse checkboxes: filter -> (column, whether the records with a true value are kept)
+FLAG_FILTERS = {
+    "complete": ("Is complete?", True),
+    "highcoverage": ("Is high coverage?", True),
+    "lowcoverageExcl": ("Is low coverage?", False),
+}
+TRUE_VALUES = ("true", "yes", "1")
+
+# metadata rows filtered at a time
+CHUNK_ROWS = 100000
+
+# faidx index of a plain FASTA: <fasta>.fai
+FAI_SUFFIX = ".fai"
+
+# packed alignments: 16 codes of 4 bits, a fixed header (magic, rows,
+# columns) before the rows, and the row names in <matrix>.rows
+MSA_ALPHABET = b"-ACGTRYKMSWBDHVN"
+MSA_ENCODE = bytes(MSA_ALPHABET.index(bytes([c]).upper()) if bytes([c]).upper() in MSA_ALPHABET
+                   else MSA_ALPHABET.index(b"N") for c in range(256))
+MSA_DECODE = MSA_ALPHABET + b"N" * 240
+MSA_MAGIC = b"EPICOVM4"
+MSA_HEADER = struct.Struct("<8sQQ")
+MSA_SUFFIX = ".msa4"
+MSA_ROWS_SUFFIX = ".rows"
+
+# indexed metadata store: default file name in a download directory, rows
+# inserted per batch, and the indexes created once the rows are in
+STORE_DB = "gisaid_metadata.sqlite"
+STORE_BATCH = 50000
+STORE_COLUMNS = ("accession", "name", "region", "country", "division", "location",
+                 "collection", "submission", "lineage", "record")
+STORE_INDEXES = {
+    "accession": ("accession",),
+    "name": ("name",),
+    "place": ("country", "division", "location"),
+    "region": ("region", "country"),
+    "collection": ("collection",),
+    "submission": ("submission",),
+    "lineage": ("lineage", "collection"),
+}
+# store lookups: criterion -> SQL condition, "{}" takes the placeholders of a list
+STORE_CRITERIA = {
+    "accession": "accession IN ({})",
+    "name": "name IN ({})",
+    "lineage": "lineage IN ({})",
+    "region": "region = ?",
+    "country": "country = ?",
+    "division": "division = ?",
+    "location": "location = ?",
+    "colstart": "collection >= ?",
+    "colend": "collection <= ?",
+    "substart": "submission >= ?",
+    "subend": "submission <= ?",
+}
+
+# snapshot diffs: lines sorted in memory at a time, and the delta files
+# written as <prefix>.<delta>.tsv
+DIFF_RUN_ROWS = 100000
+DIFF_DELTAS = ("added", "removed", "metadata_changed", "sequence_changed")
+
+# file names of the Downloads artifacts in a download directory, newest wins
+SNAPSHOT_PATTERNS = {
+    "metadata": ("metadata_tsv_*", "metadata*.tsv*"),
+    "fasta": ("sequences_fasta_*", "sequences*.fasta*"),
+    "msa-full": ("msa_full_*",),
+    "msa-unmasked": ("msa_unmasked_*",),
+    "msa-masked": ("msa_masked_*",),
+}
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M',
+)
+
+
+def add_filter_params(p):
+    """the Browse filters of the downloader"""
+    p.add_argument('-l', '--location',
+                   metavar='[STR]', type=str, required=False, default=None,
+                   help="sample location")
+
+    p.add_argument('-ht', '--host',
+                   metavar='[STR]', type=str, required=False, default='Human',
+                   help="Specify a host of the sample. Default is human.")
+
+    p.add_argument('-cs', '--colstart',
+                   metavar='[YYYY-MM-DD]', type=str, required=False, default=None,
+                   help="collection starts date")
+
+    p.add_argument('-ce', '--colend',
+                   metavar='[YYYY-MM-DD]', type=str, required=False, default=None,
+                   help="collection ends date")
+
+    p.add_argument('-ss', '--substart',
+                   metavar='[YYYY-MM-DD]', type=str, required=False, default=None,
+                   help="submitssion starts date")
+
+    p.add_argument('-se', '--subend',
+                   metavar='[YYYY-MM-DD]', type=str, required=False, default=None,
+                   help="submitssion ends date")
+
+    p.add_argument('-cg', '--complete',
+                   action='store_true', help='complete genome only')
+
+    p.add_argument('-hc', '--highcoverage',
+                   action='store_true', help='high coverage only')
+
+    p.add_argument('-le', '--lowcoverageExcl',
+                   action='store_true', help='low coverage excluding')
+
+
+def parse_params():
+    p = ap.ArgumentParser(prog='gisaid_EpiCoV_snapshot.py',
+                          description="""Work offline on the metadata and sequences downloaded from the Downloads section of EpiCoV""")
+    sub = p.add_subparsers(dest="command", metavar="COMMAND")
+    sub.required = True
+
+    q = sub.add_parser("query", help="select the records that pass Browse filters, like a Browse download")
+    q.add_argument('-m', '--metadata',
+                   metavar='[FILE]', type=str, required=True,
+                   help="metadata of the Downloads section (tar.xz, compressed or plain TSV)")
+    q.add_argument('-f', '--fasta',
+                   metavar='[FILE]', type=str, required=False, default=None,
+                   help="sequences of the Downloads section; without it only the metadata is selected")
+    q.add_argument('-o', '--output',
+                   metavar='[PREFIX]', type=str, required=True,
+                   help="write <PREFIX>.fasta and <PREFIX>.metadata.tsv")
+    add_filter_params(q)
+
+    st = sub.add_parser("store", help="load downloaded metadata into an indexed SQLite store")
+    st.add_argument('-m', '--metadata',
+                    metavar='[FILE]', type=str, required=True,
+                    help="metadata of the Downloads section (tar.xz, compressed or plain TSV)")
+    st.add_argument('-d', '--db',
+                    metavar='[FILE]', type=str, required=False, default=STORE_DB,
+                    help=f"SQLite store to write. Default is {STORE_DB}.")
+
+    ix = sub.add_parser("index", help="build a faidx index of a FASTA, decompressing it once if needed")
+    ix.add_argument('-f', '--fasta',
+                    metavar='[FILE]', type=str, required=True,
+                    help="sequences of the Downloads section or of a Browse download")
+
+    ex = sub.add_parser("extract", help="pull sequences by accession or virus name through the FASTA index")
+    ex.add_argument('-f', '--fasta',
+                    metavar='[FILE]', type=str, required=True,
+                    help="sequences of the Downloads section or of a Browse download, indexed on first use")
+    ex.add_argument('-a', '--accessions',
+                    metavar='[STR]', type=str, required=False, default=None,
+                    help="comma separated accessions or virus names")
+    ex.add_argument('-i', '--input',
+                    metavar='[FILE]', type=str, required=False, default=None,
+                    help="file with one accession or virus name per line")
+    ex.add_argument('-o', '--output',
+                    metavar='[FILE]', type=str, required=True,
+                    help="FASTA file to write")
+
+    pk = sub.add_parser("pack", help="convert an MSA download to a 4-bit packed, memory mapped matrix")
+    pk.add_argument('-f', '--fasta',
+                    metavar='[FILE]', type=str, required=True,
+                    help="MSA full, unmasked or masked of the Downloads section")
+
+    si = sub.add_parser("site", help="print the bases at alignment positions of a packed matrix, one row per sequence")
+    si.add_argument('-m', '--matrix',
+                    metavar='[FILE]', type=str, required=True,
+                    help="matrix written by the pack command")
+    si.add_argument('-p', '--positions',
+                    metavar='[INT]', type=str, required=True,
+                    help="comma separated 1-based alignment positions, e.g. 23403")
+    si.add_argument('-a', '--accessions',
+                    metavar='[STR]', type=str, required=False, default=None,
+                    help="comma separated accessions or virus names. Default is all sequences.")
+
+    df = sub.add_parser("diff", help="compare two snapshots and write the added, removed and changed records")
+    df.add_argument('--old-metadata',
+                    metavar='[FILE]', type=str, required=True,
+                    help="metadata of the previous snapshot")
+    df.add_argument('--old-fasta',
+                    metavar='[FILE]', type=str, required=False, default=None,
+                    help="sequences of the previous snapshot")
+    df.add_argument('--new-metadata',
+                    metavar='[FILE]', type=str, required=True,
+                    help="metadata of the new snapshot")
+    df.add_argument('--new-fasta',
+                    metavar='[FILE]', type=str, required=False, default=None,
+                    help="sequences of the new snapshot; sequences are compared when both are given")
+    df.add_argument('-o', '--output',
+                    metavar='[PREFIX]', type=str, required=True,
+                    help=f"write <PREFIX>.{{{','.join(DIFF_DELTAS)}}}.tsv and <PREFIX>.summary.json")
+    df.add_argument('--tmpdir',
+                    metavar='[DIR]', type=str, required=False, default=None,
+                    help="directory for the sorted runs. Default is the system temporary directory.")
+
+    lk = sub.add_parser("lookup", help="look records up in a store, write them as TSV to stdout")
+    lk.add_argument('-d', '--db',
+                    metavar='[FILE]', type=str, required=False, default=STORE_DB,
+                    help=f"SQLite store built by the store command. Default is {STORE_DB}.")
+    for key in ("accession", "name", "lineage"):
+        lk.add_argument(f'--{key}',
+                        metavar='[STR]', type=str, required=False, default=None,
+                        help=f"comma separated {key}s")
+    for key in ("region", "country", "division", "location"):
+        lk.add_argument(f'--{key}',
+                        metavar='[STR]', type=str, required=False, default=None,
+                        help=f"{key} of the sample location")
+    for key, (meaning, start) in DATE_FILTERS.items():
+        lk.add_argument(f'--{key}',
+                        metavar='[YYYY-MM-DD]', type=str, required=False, default=None,
+                        help=f"{meaning} {'starts' if start else 'ends'} date")
+    lk.add_argument('--limit',
+                    metavar='[INT]', type=int, required=False, default=None,
+                    help="return at most this many records")
+
+    return p.parse_args()
+
+
+def open_text(fn):
+    """open a plain or compressed text file for reading"""
+    if fn.endswith(".gz"):
+        return gzip.open(fn, "rt")
+    if fn.endswith(".xz"):
+        return lzma.open(fn, "rt")
+    if fn.endswith(".bz2"):
+        return bz2.open(fn, "rt")
+    return open(fn)
+
+
+def iter_download_members(fn):
+    """yield (name, text stream) of the files in a download, looking into tarballs"""
+    if tarfile.is_tarfile(fn):
+        with tarfile.open(fn) as tar:
+            for member in tar:
+                if member.isfile():
+                    yield member.name, io.TextIOWrapper(tar.extractfile(member))
+    else:
+        with open_text(fn) as f:
+            yield fn, f
+
+
+def download_kind(name):
+    """tell sequence files from metadata tables by their name"""
+    for ext in (".gz", ".xz", ".bz2"):
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    if name.endswith((".fasta", ".fa", ".fas", ".fna")):
+        return "fasta"
+    if name.endswith(".tsv"):
+        return "tsv"
+    return None
+
+
+def iter_members(fn, kind):
+    """yield the text streams of the `kind` files in a download"""
+    for name, f in iter_download_members(fn):
+        if download_kind(name) == kind:
+            yield f
+        else:
+            logging.info(f" -- skipped {name} of {os.path.basename(fn)}")
+
+
+def find_snapshot(wd, artifact):
+    """the newest download of an artifact (a SNAPSHOT_PATTERNS key) in wd, None if there is none"""
+    fns = set()
+    for pattern in SNAPSHOT_PATTERNS[artifact]:
+        fns.update(fn for fn in glob.glob(os.path.join(wd, pattern))
+                   if not fn.endswith((".part", ".http-part", FAI_SUFFIX, MSA_SUFFIX, MSA_ROWS_SUFFIX)))
+    return max(fns, key=os.path.getmtime) if fns else None
+
+
+def metadata_columns(names):
+    """where the columns of a metadata header are, by meaning; None for the missing ones"""
+    def find(candidates):
+        return next((names.index(c) for c in candidates if c in names), None)
+
+    cols = {
+        "name": find(NAME_COLUMNS),
+        "accession": find(ACCESSION_COLUMNS),
+        "collection": find(COLLECTION_COLUMNS),
+        "submission": find(SUBMISSION_COLUMNS),
+        "location": find(LOCATION_COLUMNS),
+        "host": find(HOST_COLUMNS),
+        "lineage": find(LINEAGE_COLUMNS),
+        "location_parts": [names.index(c) for c in LOCATION_PARTS if c in names],
+    }
+    for key, (column, _) in FLAG_FILTERS.items():
+        cols[key] = find((column,))
+    if cols["name"] is None:
+        raise ValueError(f"no virus name column ({' or '.join(NAME_COLUMNS)}) in the metadata")
+    return cols
+
+
+def filter_conditions(filters, cols):
+    """turn Browse filters into (kind, column(s), value) conditions on metadata rows
+
+    The semantics are those of Browse: the location matches anywhere in the
+    location hierarchy, the host matches exactly, both ignoring case; dates
+    are inclusive; the checkboxes keep complete and high coverage records
+    and drop low coverage ones.
+    """
+    conditions = []
+    if filters.get("location"):
+        columns = [cols["location"]] if cols["location"] is not None else cols["location_parts"]
+        if not columns:
+            raise ValueError("no location column in the metadata")
+        conditions.append(("location", columns, filters["location"].strip().lower()))
+    if filters.get("host"):
+        if cols["host"] is None:
+            raise ValueError("no host column in the metadata")
+        conditions.append(("equals", cols["host"], filters["host"].strip().lower()))
+    for key, (meaning, start) in DATE_FILTERS.items():
+        if filters.get(key):
+            if cols[meaning] is None:
+                raise ValueError(f"no {meaning} date column in the metadata for {key}")
+            conditions.append(("after" if start else "before", cols[meaning], filters[key]))
+    for key, (column, keep) in FLAG_FILTERS.items():
+        if filters.get(key):
+            if cols[key] is None:
+                raise ValueError(f"no {column!r} column in the metadata for {key}")
+            conditions.append(("true" if keep else "false", cols[key], None))
+    return conditions
+
+
+def chunk_mask(chunk, conditions):
+    """the rows of a pandas chunk (columns by position) that meet all conditions"""
+    mask = pandas.Series(True, index=chunk.index)
+    for kind, col, value in conditions:
+        if kind == "location":
+            location = chunk[col[0]]
+            for part in col[1:]:
+                location = location + " / " + chunk[part]
+            mask &= location.str.lower().str.contains(value, regex=False)
+        elif kind == "equals":
+            mask &= chunk[col].str.lower() == value
+        elif kind == "after":
+            mask &= chunk[col] >= value
+        elif kind == "before":
+            mask &= chunk[col] <= value
+        else:
+            truthy = chunk[col].str.lower().isin(TRUE_VALUES)
+            mask &= truthy if kind == "true" else ~truthy
+    return mask
+
+
+def row_matches(row, conditions):
+    """whether a metadata row (a list of fields) meets all conditions"""
+    for kind, col, value in conditions:
+        if kind == "location":
+            if value not in " / ".join(row[c] for c in col).lower():
+                return False
+        elif kind == "equals":
+            if row[col].lower() != value:
+                return False
+        elif kind == "after":
+            if row[col] < value:
+                return False
+        elif kind == "before":
+            if row[col] > value:
+                return False
+        elif (row[col].lower() in TRUE_VALUES) != (kind == "true"):
+            return False
+    return True
+
+
+def iter_matching_rows(f, conditions, width):
+    """yield the rows (lists of fields) of a metadata stream that meet the conditions
+
+    With pandas the rows are parsed and filtered CHUNK_ROWS at a time with
+    column operations, otherwise one by one with the csv module; both give the
+    same rows.
+    """
+    if pandas is not None:
+        chunks = pandas.read_csv(f, sep="\t", header=None, names=range(width), dtype=str, quoting=csv.QUOTE_NONE,
+                                 keep_default_na=False, na_filter=False, chunksize=CHUNK_ROWS)
+        for chunk in chunks:
+            chunk = chunk.fillna("")
+            for row in chunk[chunk_mask(chunk, conditions)].itertuples(index=False, name=None):
+                yield list(row)
+    else:
+        for row in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+            row += [""] * (width - len(row))
+            if row_matches(row, conditions):
+                yield row
+
+
+def normalize_name(name):
+    """virus names without the hCoV-19/ prefix that nextmeta leaves out"""
+    name = name.strip()
+    return name[8:] if name.lower().startswith("hcov-19/") else name
+
+
+def query_snapshot(metadata_fn, fasta_fn, filters, prefix):
+    """select the records of a downloaded snapshot that pass Browse filters
+
+    Writes the matching metadata rows to <prefix>.metadata.tsv and their
+    sequences, with Browse download headers (virus name|accession|collection
+    date) on one line each, to <prefix>.fasta. Returns (files, number of
+    matching records).
+    """
+    startTime = time.time()
+    tsv_fn = f"{prefix}.metadata.tsv"
+    selected = {}
+    count = 0
+    logging.info(f"Filtering {os.path.basename(metadata_fn)}{'' if pandas else ' (without pandas)'}...")
+    with open(tsv_fn, "w") as out:
+        for f in iter_members(metadata_fn, "tsv"):
+            header = f.readline().rstrip("\n")
+            names = header.split("\t")
+            cols = metadata_columns(names)
+            conditions = filter_conditions(filters, cols)
+            if count == 0:
+                out.write(header + "\n")
+            for row in iter_matching_rows(f, conditions, len(names)):
+                out.write("\t".join(row) + "\n")
+                count += 1
+                key = normalize_name(row[cols["name"]])
+                if key not in selected:
+                    selected[key] = "|".join([
+                        row[cols["name"]],
+                        row[cols["accession"]] if cols["accession"] is not None else "",
+                        row[cols["collection"]] if cols["collection"] is not None else "",
+                    ])
+    logging.info(f"{count} record(s) pass the filters ({time.time()-startTime:.1f} secs).")
+    if not fasta_fn:
+        return [tsv_fn], count
+
+    startTime = time.time()
+    fasta_out = f"{prefix}.fasta"
+    found = 0
+    indexed = fasta_index_of(fasta_fn)
+    with open(fasta_out, "w") as out:
+        if indexed:
+            with FastaIndex(*indexed) as index:
+                for key in list(selected):
+                    name = index.find(key)
+                    if name is not None:
+                        out.write(f">{selected.pop(key)}\n{index.fetch(name)}\n")
+                        found += 1
+        else:
+            for f in iter_members(fasta_fn, "fasta"):
+                for header, seq in iter_fasta(f):
+                    key = normalize_name(header.split("|", 1)[0])
+                    if key in selected:
+                        out.write(f">{selected.pop(key)}\n{seq}\n")
+                        found += 1
+                        if not selected:
+                            break
+    if selected:
+        logging.warning(f"{len(selected)} selected record(s) have no sequence in {os.path.basename(fasta_fn)}.")
+    logging.info(f"Extracted {found} sequence(s) to {fasta_out} ({time.time()-startTime:.1f} secs).")
+    return [fasta_out, tsv_fn], count
+
+
+def iter_fasta(f):
+    """yield (header without ">", sequence on one line) of a FASTA stream"""
+    header = None
+    seq = []
+    for line in f:
+        if line.startswith(">"):
+            if header is not None:
+                yield header, "".join(seq)
+            header = line[1:].rstrip("\n")
+            seq = []
+        elif header is not None:
+            seq.append(line.strip())
+    if header is not None:
+        yield header, "".join(seq)
+
+
+def plain_fasta_name(fasta_fn):
+    """where index_fasta() keeps the decompressed FASTA of a download"""
+    name = fasta_fn
+    for ext in (".gz", ".xz", ".bz2"):
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    if name.endswith(".tar"):
+        name = name[:-4]
+    return name if download_kind(name) == "fasta" else f"{name}.fasta"
+
+
+def index_fasta(fasta_fn):
+    """build a faidx index of a downloaded FASTA, returns (plain FASTA, index)
+
+    Plain FASTA files are indexed where they are. Compressed and tarred
+    downloads are decompressed in the same single pass to a plain FASTA next
+    to them, with every sequence on one line, and that file is indexed. The
+    index is keyed on the whole header line, as GISAID virus names have
+    spaces. Up to date indexes are kept.
+    """
+    plain = plain_fasta_name(fasta_fn)
+    if plain == fasta_fn and tarfile.is_tarfile(fasta_fn):
+        plain = f"{fasta_fn}.fasta"
+    fai_fn = f"{plain}{FAI_SUFFIX}"
+    if os.path.exists(fai_fn) and os.path.getmtime(fai_fn) >= os.path.getmtime(fasta_fn):
+        logging.info(f"{os.path.basename(fai_fn)} is up to date with {os.path.basename(fasta_fn)}.")
+        return plain, fai_fn
+
+    startTime = time.time()
+    logging.info(f"Indexing {os.path.basename(fasta_fn)}...")
+    count = 0
+    with open(f"{fai_fn}.part", "w") as fai:
+        if plain == fasta_fn:
+            for entry in scan_fasta_offsets(fasta_fn):
+                fai.write("\t".join(str(field) for field in entry) + "\n")
+                count += 1
+        else:
+            offset = 0
+            with open(f"{plain}.part", "wb") as out:
+                for f in iter_members(fasta_fn, "fasta"):
+                    for header, seq in iter_fasta(f):
+                        name = header.strip()
+                        header = f">{header}\n".encode()
+                        seq = seq.encode()
+                        out.write(header + seq + b"\n")
+                        fai.write(f"{name}\t{len(seq)}\t{offset+len(header)}\t{len(seq)}\t{len(seq)+1}\n")
+                        offset += len(header) + len(seq) + 1
+                        count += 1
+            os.replace(f"{plain}.part", plain)
+    os.replace(f"{fai_fn}.part", fai_fn)
+    logging.info(f"Indexed {count} sequence(s) in {fai_fn} ({time.time()-startTime:.1f} secs).")
+    return plain, fai_fn
+
+
+def scan_fasta_offsets(fn):
+    """yield the faidx entries (name, length, offset, line bases, line width) of a plain FASTA"""
+    entry = None
+    offset = 0
+    last = None
+    with open(fn, "rb") as f:
+        for line in f:
+            if line.startswith(b">"):
+                if entry:
+                    yield entry
+                entry = [line[1:].strip().decode(), 0, offset + len(line), 0, 0]
+                last = None
+            elif entry:
+                bases = len(line.rstrip(b"\r\n"))
+                if last is not None and last != entry[3]:
+                    raise ValueError(f"{entry[0]} in {os.path.basename(fn)} has lines of different lengths")
+                if not entry[3]:
+                    entry[3:] = [bases, len(line)]
+                entry[1] += bases
+                last = bases
+            offset += len(line)
+    if entry:
+        yield entry
+
+
+def name_aliases(name):
+    """the keys a FASTA header name is found by: its virus name without hCoV-19/ and accession"""
+    parts = [part.strip() for part in name.split("|")]
+    return [normalize_name(parts[0])] + [part for part in parts[1:] if part.startswith(ACCESSION_PREFIX)]
+
+
+class FastaIndex:
+    """random access to the sequences of a FASTA indexed by index_fasta()
+
+    The FASTA is memory mapped, so fetching a sequence reads only its bytes.
+    Sequences are found by their header line, the accession in a
+    "name|accession|date" header or the virus name with or without hCoV-19/.
+    """
+
+    def __init__(self, fasta_fn, fai_fn=None):
+        self.entries = {}
+        self.aliases = {}
+        with open(fai_fn or f"{fasta_fn}{FAI_SUFFIX}") as f:
+            for line in f:
+                name, length, offset, bases, width = line.rstrip("\n").rsplit("\t", 4)
+                self.entries.setdefault(name, (int(length), int(offset), int(bases), int(width)))
+                for alias in name_aliases(name):
+                    self.aliases.setdefault(alias, name)
+        self.file = open(fasta_fn, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(fasta_fn) else b""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+    def find(self, key):
+        """the index name of an accession or virus name, None if it is not there"""
+        key = key.strip()
+        if key in self.entries:
+            return key
+        return self.aliases.get(key) or self.aliases.get(normalize_name(key))
+
+    def fetch(self, name):
+        """the sequence of an index name on one line"""
+        length, offset, bases, width = self.entries[name]
+        if not length:
+            return ""
+        lines, rest = divmod(length, bases)
+        end = offset + lines * width + rest
+        seq = self.map[offset:end]
+        if width != bases:
+            seq = seq.replace(b"\n", b"").replace(b"\r", b"")
+        return seq.decode()
+
+
+def extract_sequences(fasta_fn, keys, out_fn):
+    """write the sequences of accessions or virus names to out_fn using the index of fasta_fn
+
+    Returns the keys that are not in the FASTA.
+    """
+    startTime = time.time()
+    plain, fai_fn = index_fasta(fasta_fn)
+    missing = []
+    count = 0
+    with FastaIndex(plain, fai_fn) as index, open(out_fn, "w") as out:
+        for key in keys:
+            name = index.find(key)
+            if name is None:
+                missing.append(key)
+                continue
+            out.write(f">{name}\n{index.fetch(name)}\n")
+            count += 1
+    if missing:
+        logging.warning(f"{len(missing)} sequence(s) are not in {os.path.basename(fasta_fn)}.")
+    logging.info(f"Extracted {count} sequence(s) to {out_fn} ({(time.time()-startTime)*1000:.0f} ms).")
+    return missing
+
+
+def fasta_index_of(fasta_fn):
+    """(plain FASTA, index) of fasta_fn if index_fasta() indexed it and it has not changed since, else None"""
+    plain = plain_fasta_name(fasta_fn)
+    fai_fn = f"{plain}{FAI_SUFFIX}"
+    if os.path.exists(fai_fn) and os.path.exists(plain) and os.path.getmtime(fai_fn) >= os.path.getmtime(fasta_fn):
+        return plain, fai_fn
+    return None
+
+
+def packed_msa_name(msa_fn):
+    """where pack_msa() writes the matrix of an alignment download"""
+    name = msa_fn
+    for ext in (".gz", ".xz", ".bz2", ".tar", ".fasta", ".fa", ".fas", ".fna"):
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return f"{name}{MSA_SUFFIX}"
+
+
+def pack_msa(msa_fn, out_fn=None):
+    """convert an alignment download to a 4-bit packed matrix, returns the matrix file
+
+    Every base is one of the 16 MSA_ALPHABET codes (lowercase as uppercase,
+    anything else as N), two per byte, each row padded to a whole byte and
+    written after an MSA_HEADER with the number of rows and columns. The
+    whole header lines go to <matrix>.rows, one per line, so spaced virus
+    names and accessions can be found. Rows are read and packed one at
+    a time. Up to date matrices are kept.
+    """
+    out_fn = out_fn or packed_msa_name(msa_fn)
+    if os.path.exists(out_fn) and os.path.getmtime(out_fn) >= os.path.getmtime(msa_fn):
+        logging.info(f"{os.path.basename(out_fn)} is up to date with {os.path.basename(msa_fn)}.")
+        return out_fn
+
+    startTime = time.time()
+    logging.info(f"Packing {os.path.basename(msa_fn)}...")
+    nrows = 0
+    ncols = None
+    with open(f"{out_fn}.part", "wb") as out, open(f"{out_fn}{MSA_ROWS_SUFFIX}.part", "w") as rows:
+        out.write(bytes(MSA_HEADER.size))
+        for f in iter_members(msa_fn, "fasta"):
+            for header, seq in iter_fasta(f):
+                if ncols is None:
+                    ncols = len(seq)
+                elif len(seq) != ncols:
+                    raise ValueError(f"{header} has {len(seq)} columns instead of {ncols}, not an alignment")
+                out.write(pack_row(seq))
+                rows.write(f"{header.strip()}\n")
+                nrows += 1
+        out.seek(0)
+        out.write(MSA_HEADER.pack(MSA_MAGIC, nrows, ncols or 0))
+    os.replace(f"{out_fn}{MSA_ROWS_SUFFIX}.part", f"{out_fn}{MSA_ROWS_SUFFIX}")
+    os.replace(f"{out_fn}.part", out_fn)
+    logging.info(f"Packed {nrows} x {ncols or 0} alignment to {out_fn} "
+                 f"({os.path.getsize(out_fn)/1024**2:.1f} MB, {time.time()-startTime:.1f} secs).")
+    return out_fn
+
+
+def pack_row(seq):
+    """two 4-bit MSA_ALPHABET codes per byte, the first base in the high half"""
+    codes = seq.encode("ascii", "replace").translate(MSA_ENCODE)
+    high = codes[0::2]
+    low = codes[1::2].ljust(len(high), b"\0")
+    # the codes are below 16, so shifting the whole row by 4 bits moves every
+    # high code into the high half of its own byte
+    return ((int.from_bytes(high, "big") << 4) | int.from_bytes(low, "big")).to_bytes(len(high), "big")
+
+
+def unpack_row(packed, ncols):
+    """the bases of a packed row"""
+    value = int.from_bytes(packed, "big")
+    mask = int.from_bytes(b"\x0f" * len(packed), "big")
+    codes = bytearray(len(packed) * 2)
+    codes[0::2] = ((value >> 4) & mask).to_bytes(len(packed), "big")
+    codes[1::2] = (value & mask).to_bytes(len(packed), "big")
+    return bytes(codes[:ncols]).translate(MSA_DECODE).decode()
+
+
+class PackedMSA:
+    """a matrix written by pack_msa(), memory mapped
+
+    Rows are found by name, accession or virus name. rows() gives the packed
+    bytes of a range of rows without copying them, and row() and column()
+    decode a single sequence or alignment position, reading only the bytes of
+    that row or of that position in every row. With numpy installed, array()
+    is the whole packed matrix as a zero-copy (rows x bytes) array, which can
+    be sliced both ways.
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.file = open(fn, "rb")
+        magic, self.nrows, self.ncols = MSA_HEADER.unpack(self.file.read(MSA_HEADER.size))
+        if magic != MSA_MAGIC:
+            self.file.close()
+            raise ValueError(f"{os.path.basename(fn)} is not a packed alignment")
+        self.width = (self.ncols + 1) // 2
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self.map, "madvise"):
+            self.map.madvise(mmap.MADV_RANDOM)
+        self.view = memoryview(self.map)
+        with open(f"{fn}{MSA_ROWS_SUFFIX}") as f:
+            self.names = [line.rstrip("\n") for line in f]
+        self.index = {}
+        for num, name in enumerate(self.names):
+            self.index.setdefault(name, num)
+            for alias in name_aliases(name):
+                self.index.setdefault(alias, num)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+    def find(self, key):
+        """the row number of a name, accession or virus name, None if it is not there"""
+        key = key.strip()
+        num = self.index.get(key)
+        return num if num is not None else self.index.get(normalize_name(key))
+
+    def rows(self, start, end):
+        """the packed bytes of rows start to end (exclusive), a view into the file"""
+        return self.view[MSA_HEADER.size + start * self.width:MSA_HEADER.size + end * self.width]
+
+    def row(self, num, start=0, end=None):
+        """the bases of row num, optionally of columns start to end (exclusive) only"""
+        end = self.ncols if end is None else min(end, self.ncols)
+        first = start // 2
+        packed = self.rows(num, num + 1)[first:(end + 1) // 2]
+        return unpack_row(packed, len(packed) * 2)[start - first * 2:end - first * 2]
+
+    def column(self, pos, rows=None):
+        """the bases at 0-based alignment position pos of all rows, or of the row numbers in rows"""
+        offset = MSA_HEADER.size + pos // 2
+        shift = 0 if pos % 2 else 4
+        nums = range(self.nrows) if rows is None else rows
+        codes = bytes((self.map[offset + num * self.width] >> shift) & 0x0f for num in nums)
+        return codes.translate(MSA_DECODE).decode()
+
+    def array(self):
+        """the packed matrix as a (rows x bytes) numpy array sharing the memory map"""
+        if numpy is None:
+            raise ValueError("array() needs numpy (pip install numpy)")
+        return numpy.frombuffer(self.map, dtype=numpy.uint8, count=self.nrows * self.width,
+                                offset=MSA_HEADER.size).reshape(self.nrows, self.width)
+
+
+def snapshot_stem(fn):
+    """the name of a download without its extensions, shared by index_fasta()'s plain FASTA"""
+    name = os.path.basename(fn)
+    for ext in (".gz", ".xz", ".bz2", ".tar", ".fasta", ".fa", ".fas", ".fna", ".tsv"):
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return name
+
+
+def previous_snapshot(wd, artifact):
+    """the newest download of an artifact in wd from before the newest one, None if there is none"""
+    fns = set()
+    for pattern in SNAPSHOT_PATTERNS[artifact]:
+        fns.update(fn for fn in glob.glob(os.path.join(wd, pattern))
+                   if not fn.endswith((".part", ".http-part", FAI_SUFFIX, MSA_SUFFIX, MSA_ROWS_SUFFIX)))
+    fns = sorted(fns, key=os.path.getmtime, reverse=True)
+    stems = [snapshot_stem(fn) for fn in fns]
+    return next((fn for fn, stem in zip(fns, stems) if stem != stems[0]), None)
+
+
+def external_sort(lines, tmpdir, fields):
+    """sort TSV lines of `fields` fields on the first field, DIFF_RUN_ROWS at a time in memory
+
+    Sorted runs are written to tmpdir and merged; yields the lines split into
+    fields, the last field holding the rest of the line.
+    """
+    runs = []
+    while True:
+        run = sorted(itertools.islice(lines, DIFF_RUN_ROWS), key=lambda line: line.split("\t", 1)[0])
+        if not run:
+            break
+        fn = os.path.join(tmpdir, f"run{len(runs)}")
+        with open(fn, "w") as f:
+            f.writelines(run)
+        runs.append(fn)
+        del run
+
+    files = [open(fn) for fn in runs]
+    try:
+        for line in heapq.merge(*files, key=lambda line: line.split("\t", 1)[0]):
+            yield line.rstrip("\n").split("\t", fields - 1)
+    finally:
+        for f in files:
+            f.close()
+
+
+def snapshot_records(metadata_fn, fasta_fn, tmpdir):
+    """yield (accession, metadata hash, sequence hash, record) of a snapshot sorted by accession
+
+    The metadata and the sequences are joined on the virus name and then
+    sorted on the accession, both with external_sort(), so memory does not
+    grow with the snapshot. The metadata hash ignores the column order; the
+    sequence hash is empty for records without a sequence. The first record
+    of an accession wins.
+    """
+    def metadata_lines():
+        for f in iter_members(metadata_fn, "tsv"):
+            names = f.readline().rstrip("\n").split("\t")
+            cols = metadata_columns(names)
+            if cols["accession"] is None:
+                raise ValueError(f"no accession column ({' or '.join(ACCESSION_COLUMNS)}) in the metadata")
+            for row in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+                row += [""] * (len(names) - len(row))
+                digest = hashlib.sha1("\t".join(f"{name}={value}" for name, value in
+                                                sorted(zip(names, row))).encode()).hexdigest()
+                record = "\t".join(row)
+                yield f"{normalize_name(row[cols['name']])}\t{row[cols['accession']]}\t{digest}\t{record}\n"
+
+    def sequence_lines():
+        if not fasta_fn:
+            return
+        for f in iter_members(fasta_fn, "fasta"):
+            for header, seq in iter_fasta(f):
+                digest = hashlib.sha1(seq.upper().encode()).hexdigest()
+                yield f"{normalize_name(header.split('|', 1)[0])}\t{digest}\n"
+
+    def joined_lines():
+        sequences = external_sort(sequence_lines(), seq_dir, 2)
+        seq = next(sequences, None)
+        for name, accession, digest, record in external_sort(metadata_lines(), meta_dir, 4):
+            while seq is not None and seq[0] < name:
+                seq = next(sequences, None)
+            seq_digest = seq[1] if seq is not None and seq[0] == name else ""
+            yield f"{accession}\t{digest}\t{seq_digest}\t{record}\n"
+
+    meta_dir, seq_dir, joined_dir = (tempfile.mkdtemp(dir=tmpdir) for _ in range(3))
+    last = None
+    for accession, digest, seq_digest, record in external_sort(joined_lines(), joined_dir, 4):
+        if accession != last:
+            yield accession, digest, seq_digest, record
+            last = accession
+
+
+def metadata_header(metadata_fn):
+    """the header line of a metadata download"""
+    members = iter_members(metadata_fn, "tsv")
+    try:
+        f = next(members, None)
+        return f.readline().rstrip("\n") if f else ""
+    finally:
+        members.close()
+
+
+def diff_snapshots(old_metadata, old_fasta, new_metadata, new_fasta, prefix, tmpdir=None):
+    """compare two snapshots record by record on the accession, returns {delta: number of records}
+
+    Both snapshots are sorted on the accession by snapshot_records() and
+    merged, so memory stays bounded. The records are written, as metadata
+    rows, to <prefix>.<delta>.tsv for each of DIFF_DELTAS: the added ones and
+    the removed ones (old rows), and those whose metadata or sequence (by
+    content hash) changed. Sequences are compared only when both FASTA files
+    are given. The counts also go to <prefix>.summary.json.
+    """
+    startTime = time.time()
+    if not (old_fasta and new_fasta):
+        old_fasta = new_fasta = None
+    logging.info(f"Comparing {os.path.basename(old_metadata)} with {os.path.basename(new_metadata)}...")
+    counts = {delta: 0 for delta in DIFF_DELTAS}
+    outs = {delta: open(f"{prefix}.{delta}.tsv", "w") for delta in DIFF_DELTAS}
+    workdir = tempfile.mkdtemp(prefix="gisaid_diff_", dir=tmpdir)
+    try:
+        old_header = metadata_header(old_metadata)
+        new_header = metadata_header(new_metadata)
+        for delta, out in outs.items():
+            out.write((old_header if delta == "removed" else new_header) + "\n")
+
+        def write(delta, record):
+            outs[delta].write(record + "\n")
+            counts[delta] += 1
+
+        olds = snapshot_records(old_metadata, old_fasta, workdir)
+        news = snapshot_records(new_metadata, new_fasta, workdir)
+        old = next(olds, None)
+        new = next(news, None)
+        while old is not None or new is not None:
+            if new is None or (old is not None and old[0] < new[0]):
+                write("removed", old[3])
+                old = next(olds, None)
+            elif old is None or new[0] < old[0]:
+                write("added", new[3])
+                new = next(news, None)
+            else:
+                if old[1] != new[1]:
+                    write("metadata_changed", new[3])
+                if old[2] != new[2]:
+                    write("sequence_changed", new[3])
+                old = next(olds, None)
+                new = next(news, None)
+    finally:
+        for out in outs.values():
+            out.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(f"{prefix}.summary.json", "w") as f:
+        json.dump({"old": [old_metadata, old_fasta], "new": [new_metadata, new_fasta], "counts": counts}, f, indent=2)
+    logging.info(", ".join(f"{count} {delta.replace('_', ' ')}" for delta, count in counts.items()) +
+                 f" ({time.time()-startTime:.1f} secs).")
+    return counts
+
+
+def place_parts(row, cols):
+    """(region, country, division, location) of a metadata row"""
+    if cols["location"] is not None:
+        parts = [part.strip() for part in row[cols["location"]].split("/")]
+        parts = parts[:3] + [" / ".join(parts[3:])]
+    else:
+        parts = [row[c] for c in cols["location_parts"]]
+    parts += [""] * (4 - len(parts))
+    return [part or None for part in parts]
+
+
+def store_rows(f, cols, width):
+    """yield the STORE_COLUMNS values of the rows of a metadata stream"""
+    def field(row, key):
+        return row[cols[key]] or None if cols[key] is not None else None
+
+    for row in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+        row += [""] * (width - len(row))
+        yield [field(row, "accession"), field(row, "name")] + place_parts(row, cols) + [
+            field(row, "collection"), field(row, "submission"), field(row, "lineage"), "\t".join(row)]
+
+
+def build_store(metadata_fn, db_fn):
+    """load a downloaded metadata TSV into an indexed SQLite store, returns the number of records
+
+    The rows are streamed into the table STORE_BATCH at a time, so memory does
+    not grow with the TSV, and STORE_INDEXES are built once they are all in.
+    The store is written next to db_fn and only replaces it when complete.
+    """
+    startTime = time.time()
+    part = f"{db_fn}.part"
+    if os.path.exists(part):
+        os.remove(part)
+    db = sqlite3.connect(part)
+    count = 0
+    try:
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute("CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)")
+        db.execute("CREATE TABLE metadata ({})".format(", ".join(
+            f"{col} TEXT COLLATE NOCASE" if col in ("region", "country", "division", "location") else f"{col} TEXT"
+            for col in STORE_COLUMNS)))
+        insert = "INSERT INTO metadata VALUES ({})".format(", ".join("?" * len(STORE_COLUMNS)))
+        logging.info(f"Loading {os.path.basename(metadata_fn)} into {os.path.basename(db_fn)}...")
+        for f in iter_members(metadata_fn, "tsv"):
+            header = f.readline().rstrip("\n")
+            names = header.split("\t")
+            cols = metadata_columns(names)
+            if cols["accession"] is None:
+                raise ValueError(f"no accession column ({' or '.join(ACCESSION_COLUMNS)}) in the metadata")
+            db.execute("INSERT OR REPLACE INTO info VALUES ('header', ?)", (header,))
+            rows = store_rows(f, cols, len(names))
+            while True:
+                batch = list(itertools.islice(rows, STORE_BATCH))
+                if not batch:
+                    break
+                db.executemany(insert, batch)
+                db.commit()
+                count += len(batch)
+                logging.info(f" -- {count} record(s) loaded")
+        for name, columns in STORE_INDEXES.items():
+            db.execute(f"CREATE INDEX idx_{name} ON metadata ({', '.join(columns)})")
+        db.execute("INSERT INTO info VALUES ('source', ?)", (os.path.basename(metadata_fn),))
+        db.execute("ANALYZE")
+        db.commit()
+    finally:
+        db.close()
+    os.replace(part, db_fn)
+    logging.info(f"Stored {count} record(s) in {db_fn} ({time.time()-startTime:.1f} secs).")
+    return count
+
+
+def update_store(wd, db_fn=None):
+    """rebuild the store of wd from its newest metadata download if that is newer, returns the store or None"""
+    metadata_fn = find_snapshot(wd, "metadata")
+    if not metadata_fn:
+        return None
+    db_fn = db_fn or os.path.join(wd, STORE_DB)
+    if os.path.exists(db_fn) and os.path.getmtime(db_fn) >= os.path.getmtime(metadata_fn):
+        logging.info(f"{os.path.basename(db_fn)} is up to date with {os.path.basename(metadata_fn)}.")
+        return db_fn
+    build_store(metadata_fn, db_fn)
+    return db_fn
+
+
+def query_store(db_fn, criteria, limit=None):
+    """look records up in a store built by build_store()
+
+    criteria maps STORE_CRITERIA keys to values, lists for accession, name and
+    lineage; places match whole and ignore case. Returns (TSV header, list of
+    TSV records).
+    """
+    unknown = set(criteria) - set(STORE_CRITERIA)
+    if unknown:
+        raise ValueError(f"unknown criteria: {', '.join(sorted(unknown))}")
+    conditions = []
+    params = []
+    for key, value in criteria.items():
+        if value is None or value == []:
+            continue
+        if "{}" in STORE_CRITERIA[key]:
+            value = [value] if isinstance(value, str) else list(value)
+            conditions.append(STORE_CRITERIA[key].format(", ".join("?" * len(value))))
+            params += value
+        else:
+            conditions.append(STORE_CRITERIA[key])
+            params.append(value)
+    sql = "SELECT record FROM metadata"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+
+    db = sqlite3.connect(f"file:{db_fn}?mode=ro", uri=True)
+    try:
+        header = db.execute("SELECT value FROM info WHERE key = 'header'").fetchone()[0]
+        records = [record for record, in db.execute(sql, params)]
+    finally:
+        db.close()
+    return header, records
+
+
+def main():
+    argvs = parse_params()
+
+    if argvs.command == "query":
+        filters = {key: getattr(argvs, key) for key in
+                   ("location", "host") + tuple(DATE_FILTERS) + tuple(FLAG_FILTERS)}
+        try:
+            _, count = query_snapshot(argvs.metadata, argvs.fasta, filters, argvs.output)
+        except ValueError as e:
+            logging.error(e)
+            sys.exit(1)
+        if not count:
+            logging.error("No data found.")
+            sys.exit(1)
+    elif argvs.command == "store":
+        try:
+            build_store(argvs.metadata, argvs.db)
+        except ValueError as e:
+            logging.error(e)
+            sys.exit(1)
+    elif argvs.command == "index":
+        try:
+            index_fasta(argvs.fasta)
+        except ValueError as e:
+            logging.error(e)
+            sys.exit(1)
+    elif argvs.command == "extract":
+        keys = [key.strip() for key in (argvs.accessions or "").split(",") if key.strip()]
+        if argvs.input:
+            with open(argvs.input) as f:
+                keys += [line.strip() for line in f if line.strip()]
+        if not keys:
+            logging.error("No accession or virus name entered (-a or -i).")
+            sys.exit(1)
+        try:
+            missing = extract_sequences(argvs.fasta, keys, argvs.output)
+        except ValueError as e:
+            logging.error(e)
+            sys.exit(1)
+        if len(missing) == len(keys):
+            logging.error("No data found.")
+            sys.exit(1)
+    elif argvs.command == "pack":
+        try:
+            pack_msa(argvs.fasta)
+        except ValueError as e:
+            logging.error(e)
+            sys.exit(1)
+    elif argvs.command == "site":
+        with PackedMSA(argvs.matrix) as msa:
+            positions = [int(pos) for pos in argvs.positions.split(",")]
+            if not all(1 <= pos <= msa.ncols for pos in positions):
+                logging.error(f"Positions must be between 1 and {msa.ncols}.")
+                sys.exit(1)
+            if argvs.accessions:
+                keys = [key.strip() for key in argvs.accessions.split(",")]
+                rows = [msa.find(key) for key in keys]
+                for key in [key for key, num in zip(keys, rows) if num is None]:
+                    logging.warning(f"{key} is not in {os.path.basename(argvs.matrix)}.")
+                rows = [num for num in rows if num is not None]
+            else:
+                rows = range(msa.nrows)
+            columns = [msa.column(pos - 1, rows) for pos in positions]
+            print("\t".join(["name"] + [str(pos) for pos in positions]))
+            for num, bases in zip(rows, zip(*columns)):
+                print("\t".join((msa.names[num],) + bases))
+        return
+    elif argvs.command == "diff":
+        try:
+            diff_snapshots(argvs.old_metadata, argvs.old_fasta, argvs.new_metadata, argvs.new_fasta,
+                           argvs.output, argvs.tmpdir)
+        except ValueError as e:
+            logging.error(e)
+            sys.exit(1)
+    elif argvs.command == "lookup":
+        if not os.path.exists(argvs.db):
+            logging.error(f"No store at {argvs.db}, build it with the store command first.")
+            sys.exit(1)
+        criteria = {key: getattr(argvs, key) for key in STORE_CRITERIA}
+        for key in ("accession", "name", "lineage"):
+            if criteria[key]:
+                criteria[key] = [value.strip() for value in criteria[key].split(",")]
+        startTime = time.time()
+        header, records = query_store(argvs.db, criteria, argvs.limit)
+        print(header)
+        for record in records:
+            print(record)
+        logging.info(f"{len(records)} record(s) in {(time.time()-startTime)*1000:.0f} ms.")
+        return
+    logging.info("Completed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,10 @@ import time
 import sys
 import argparse as ap
 import json
+import tempfile
 from selenium import webdriver
 #from selenium.common.exceptions import InvalidSessionIdException
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
@@ -14,6 +16,14 @@ from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
+# implicit wait applied to required element lookups in seconds
+IMPLICIT_WAIT = 20
+# how long a popup window may take to show up
+POPUP_TIMEOUT = 3
+GISAID_URL = 'https://platform.gisaid.org/epi3/frontend'
+# cookie fields accepted by WebDriver add_cookie()
+SESSION_COOKIE_KEYS = ("name", "value", "path", "domain", "secure", "httpOnly", "expiry", "sameSite")
+
 
 def parse_params():
     p = ap.ArgumentParser(prog='gisaid_EpiCoV_uploader.py',
@@ -47,6 +57,14 @@ def parse_params():
                    metavar='[INT]', type=int, required=False, default=3,
                    help="time interval between retries in second(s). Default is 3 seconds.")
 
+    p.add_argument('--session',
+                   metavar='[FILE]', type=str, required=False, default=None,
+                   help="keep the login session in this file and reuse it in later runs.")
+
+    p.add_argument('--url',
+                   metavar='[URL]', type=str, required=False, default=GISAID_URL,
+                   help=f"address of the GISAID site. Default is {GISAID_URL}.")
+
     p.add_argument('--headless',
                    action='store_true', help='turn on headless mode')
 
@@ -54,7 +72,85 @@ def parse_params():
     return args_parsed
 
 
-def fill_EpiCoV_upload(uname, upass, seq, metadata, to, rt, iv, headless):
+def read_session(session):
+    """the state saved by write_session(), None if there is none"""
+    if not os.path.exists(session):
+        return None
+    try:
+        with open(session) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print(f"Ignoring unreadable session file {session}.")
+        return None
+
+
+def write_session(session, state):
+    """save the state of a logged in session"""
+    # the file holds login credentials in effect, keep it private; mkstemp
+    # creates it with 0600 and the rename keeps concurrent readers safe
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(session)))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, session)
+
+
+def save_session(driver, session):
+    """save cookies, local storage and the current page of a logged in session"""
+    write_session(session, {
+        "saved": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "url": driver.current_url,
+        "cookies": driver.get_cookies(),
+        "localStorage": driver.execute_script("return Object.assign({}, window.localStorage);"),
+    })
+
+
+def apply_session(driver, state):
+    """load the cookies and local storage of a saved session into the browser"""
+    for cookie in state.get("cookies", []):
+        cookie = {k: v for k, v in cookie.items() if k in SESSION_COOKIE_KEYS}
+        if "expiry" in cookie:
+            cookie["expiry"] = int(cookie["expiry"])
+        try:
+            driver.add_cookie(cookie)
+        except WebDriverException:
+            # some drivers refuse a leading dot in the cookie domain
+            cookie.pop("domain", None)
+            try:
+                driver.add_cookie(cookie)
+            except WebDriverException:
+                pass
+    driver.execute_script(
+        "for (const [k, v] of Object.entries(arguments[0])) { window.localStorage.setItem(k, v); }",
+        state.get("localStorage", {}))
+
+
+def session_expired(driver, implicit=IMPLICIT_WAIT):
+    """whether the page after restoring a session is the login form instead of the main page"""
+    return bool(probe_element(driver, By.NAME, 'login', implicit=implicit)
+                or not probe_element(driver, By.XPATH, "//div[@id='main_nav']", implicit=implicit))
+
+
+def restore_session(wait, driver, session, url):
+    """load cookies and local storage saved by save_session(), returns True if still logged in"""
+    state = read_session(session)
+    if state is None:
+        return False
+    apply_session(driver, state)
+
+    driver.get(state.get("url") or url)
+    waiting_sys_timer(wait)
+
+    # an expired session lands on the login form again
+    if session_expired(driver):
+        print("Saved session expired.")
+        driver.delete_all_cookies()
+        driver.get(url)
+        waiting_sys_timer(wait)
+        return False
+    return True
+
+
+def fill_EpiCoV_upload(uname, upass, seq, metadata, to, rt, iv, headless, session=None, url=GISAID_URL):
     """Download sequences and metadata from EpiCoV GISAID"""
 
     # add sequence to metadata
@@ -81,25 +177,28 @@ def fill_EpiCoV_upload(uname, upass, seq, metadata, to, rt, iv, headless):
     driver = webdriver.Firefox(firefox_profile=profile, options=options)
 
     # driverwait
-    driver.implicitly_wait(20)
+    driver.implicitly_wait(IMPLICIT_WAIT)
     wait = WebDriverWait(driver, to)
 
     # open GISAID
     print("Opening website GISAID...")
-    driver.get('https://platform.gisaid.org/epi3/frontend')
+    driver.get(url)
     waiting_sys_timer(wait)
     print(driver.title)
     assert 'GISAID' in driver.title
 
-    # login
-    print("Logining to GISAID...")
-    username = driver.find_element_by_name('login')
-    username.send_keys(uname)
-    password = driver.find_element_by_name('password')
-    password.send_keys(upass)
-    driver.execute_script("return doLogin();")
+    if session and restore_session(wait, driver, session, url):
+        print("Restored GISAID session...")
+    else:
+        # login
+        print("Logining to GISAID...")
+        username = driver.find_element_by_name('login')
+        username.send_keys(uname)
+        password = driver.find_element_by_name('password')
+        password.send_keys(upass)
+        driver.execute_script("return doLogin();")
 
-    waiting_sys_timer(wait)
+        waiting_sys_timer(wait)
 
     # navigate to EpiFlu
     print("Navigating to EpiCoV...")
@@ -108,6 +207,34 @@ def fill_EpiCoV_upload(uname, upass, seq, metadata, to, rt, iv, headless):
 
     waiting_sys_timer(wait)
 
+    if session:
+        save_session(driver, session)
+
+    messages = upload_EpiCoV(wait, driver, metadata, submit=headless)
+
+    if not headless:
+        # wait until the user to close browser
+        print("Please review the form and submit for review...")
+        while True:
+            try:
+                _ = driver.window_handles
+            except:
+                print("Browser closed by user.")
+                break
+            time.sleep(1)
+    else:
+        for msg in messages:
+            print(msg)
+
+    # close driver
+    driver.quit()
+
+
+def upload_EpiCoV(wait, driver, metadata, submit=True):
+    """fill the single upload form in a logged in EpiCoV page and submit it
+
+    Returns the messages the form shows after submitting.
+    """
     # access uploading page
     print("Accessing uploading page...")
     upload_tab = wait.until(EC.element_to_be_clickable(
@@ -117,8 +244,8 @@ def fill_EpiCoV_upload(uname, upass, seq, metadata, to, rt, iv, headless):
 
     # WARNING: different users might have different uploading options
     try:
-        iframe = driver.find_element_by_xpath("//iframe")
-        if iframe.is_displayed() and iframe.get_attribute('id').startswith('sysoverlay'):
+        iframe = probe_element(driver, By.XPATH, "//iframe", POPUP_TIMEOUT)
+        if iframe and iframe.is_displayed() and iframe.get_attribute('id').startswith('sysoverlay'):
             print("Popup window detected...")
             driver.switch_to.frame(iframe)
             button = wait.until(
@@ -181,28 +308,17 @@ def fill_EpiCoV_upload(uname, upass, seq, metadata, to, rt, iv, headless):
     
     waiting_sys_timer(wait)
 
-    if not headless:
-        # wait until the user to close browser
-        print("Please review the form and submit for review...")
-        while True:
-            try:
-                _ = driver.window_handles
-            except:
-                print("Browser closed by user.")
-                break
-            time.sleep(1)
-    else:
+    messages = []
+    if submit:
         button = driver.find_element_by_xpath('//button[contains(text(), "Submit for Review")]')
         button.click()
         waiting_sys_timer(wait)
         
-        warnings = driver.find_elements_by_xpath( "//div[@class='sys-form-fi-message']")
+        warnings = probe_elements(driver, By.XPATH, "//div[@class='sys-form-fi-message']")
         for msg in warnings:
             if msg.is_displayed():
-                print(msg.text)
-
-    # close driver
-    driver.quit()
+                messages.append(msg.text)
+    return messages
 
 
 def parseMetadata(metadata):
@@ -246,6 +362,29 @@ def waiting_table_to_get_ready(wait, sec=1):
     time.sleep(sec)
 
 
+def probe_element(driver, by, value, timeout=0, implicit=IMPLICIT_WAIT):
+    """look up an element that may be absent without paying the implicit wait"""
+    elements = probe_elements(driver, by, value, timeout, implicit)
+    return elements[0] if elements else None
+
+
+def probe_elements(driver, by, value, timeout=0, implicit=IMPLICIT_WAIT):
+    """look up elements that may be absent, returns an empty list after `timeout` secs
+
+    The implicit wait of the caller is set back afterwards.
+    """
+    driver.implicitly_wait(0)
+    try:
+        endTime = time.time() + timeout
+        while True:
+            elements = driver.find_elements(by, value)
+            if elements or time.time() >= endTime:
+                return elements
+            time.sleep(0.05)
+    finally:
+        driver.implicitly_wait(implicit)
+
+
 def download_finished(file, timeout=60):
     sec = 0
     while sec < timeout:
@@ -272,6 +411,8 @@ def main():
         argvs.retry,
         argvs.interval,
         argvs.headless,
+        argvs.session,
+        argvs.url,
     )
     print("Completed.")
 
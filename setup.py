@@ -10,7 +10,8 @@ setup(
     author_email='po-e@lanl.gov',
     packages=find_packages(),
     python_requires='>=3.6',
-    scripts=['gisaid_EpiCoV_downloader.py'],
+    scripts=['gisaid_EpiCoV_downloader.py', 'gisaid_EpiCoV_snapshot.py'],
+    py_modules=['gisaid_EpiCoV_uploader', 'gisaid_EpiCoV_snapshot'],
     url='https://github.com/poeli/EpiCoV_downloader',
     license='LICENSE',
     description='This is a GISAID downloader to retrieve EpiCoV sequences and the table.',
@@ -20,6 +21,9 @@ setup(
     install_requires=[
         "selenium"
     ],
+    extras_require={
+        "local": ["pandas"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
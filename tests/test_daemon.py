@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import queue
+
+import pytest
+
+pytest.importorskip("selenium")
+
+import gisaid_EpiCoV_downloader as downloader
+
+
+class Stop(Exception):
+    pass
+
+
+class JobQueue:
+    """hands out the given jobs, then stops the worker"""
+
+    def __init__(self, *jobs):
+        self.jobs = list(jobs)
+        self.requeued = []
+
+    def get(self, timeout=None):
+        if not self.jobs:
+            raise Stop()
+        return self.jobs.pop(0)
+
+    def put(self, item):
+        self.requeued.append(item)
+
+
+def start_worker(monkeypatch, tmp_path, run_job, *jobs):
+    argvs = argparse.Namespace(outdir=str(tmp_path), normal=False, ffbin=None, lean=False,
+                               username="u", password="p", session=None,
+                               timeout=90, retry=1, interval=0)
+    monkeypatch.setattr(downloader, "open_browser", lambda *args: object())
+    monkeypatch.setattr(downloader, "login_EpiCoV", lambda *args: None)
+    monkeypatch.setattr(downloader, "run_job", run_job)
+    staging = tmp_path / ".worker-0"
+    # leftovers of a crashed job
+    (staging / "partial" / "nested").mkdir(parents=True)
+    (staging / "gisaid_hcov-19.tar.part").write_bytes(b"x")
+    replies = [queue.Queue() for _ in jobs]
+    with pytest.raises(Stop):
+        downloader.browser_worker(0, JobQueue(*zip(jobs, replies)), argvs, {})
+    return staging, [reply.get_nowait() for reply in replies]
+
+
+def download(driver, to, wd, job, rt, iv):
+    assert os.listdir(wd) == []
+    fn = os.path.join(wd, "metadata.tsv")
+    with open(fn, "w") as f:
+        f.write("accession\n")
+    timer = downloader.StageTimer(wd, "metadata")
+    timer.lap("complete")
+    timer.write(fn)
+    return [fn]
+
+
+def read_timings(wd):
+    with open(os.path.join(str(wd), downloader.TIMINGS)) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_job_keeps_its_files_and_timings(monkeypatch, tmp_path):
+    outdir = str(tmp_path / "job")
+    staging, replies = start_worker(monkeypatch, tmp_path, download, {"type": "artifacts", "outdir": outdir})
+
+    assert replies == [{"status": "ok", "files": [os.path.join(outdir, "metadata.tsv")]}]
+    assert os.listdir(str(staging)) == []
+    timings = read_timings(outdir)
+    assert [(t["artifact"], t["status"], t["file"]) for t in timings] == \
+        [("metadata", "ok", os.path.join(outdir, "metadata.tsv"))]
+
+
+def test_failed_job_keeps_its_timings(monkeypatch, tmp_path):
+    def fail(driver, to, wd, job, rt, iv):
+        downloader.StageTimer(wd, "sequences").write(None)
+        raise downloader.NoDataFound("No data found.")
+
+    outdir = str(tmp_path / "job")
+    staging, replies = start_worker(monkeypatch, tmp_path, fail, {"type": "query", "outdir": outdir})
+
+    assert replies == [{"status": "error", "error": "No data found."}]
+    assert [(t["artifact"], t["status"]) for t in read_timings(outdir)] == [("sequences", "failed")]
+    assert not os.path.exists(os.path.join(str(staging), downloader.TIMINGS))
+
+
+def test_leftovers_that_cannot_be_removed(monkeypatch, tmp_path):
+    def refuse(path):
+        raise PermissionError(13, "Permission denied", path)
+    monkeypatch.setattr(downloader.shutil, "rmtree", refuse)
+
+    def run_job(driver, to, wd, job, rt, iv):
+        assert os.listdir(wd) == ["partial"]
+        return []
+
+    staging, replies = start_worker(monkeypatch, tmp_path, run_job, {"type": "artifacts"})
+    assert replies == [{"status": "ok", "files": []}]
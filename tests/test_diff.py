@@ -0,0 +1,70 @@
+import json
+import os
+
+import gisaid_EpiCoV_snapshot as snapshot
+
+HEADER = "Virus name\tAccession ID\tCollection date\tLocation\n"
+
+
+def row(num, date="2020-03-01", location="Asia / Hong Kong"):
+    return f"hCoV-19/Hong Kong/HK-{num}/2020\tEPI_ISL_{1000 + num}\t{date}\t{location}"
+
+
+def write_snapshot(tmp_path, name, rows, seqs):
+    metadata = tmp_path / f"{name}.tsv"
+    with open(metadata, "w") as f:
+        f.write(HEADER + "".join(r + "\n" for r in rows))
+    fasta = tmp_path / f"{name}.fasta"
+    with open(fasta, "w") as f:
+        for num, seq in seqs.items():
+            f.write(f">hCoV-19/Hong Kong/HK-{num}/2020|EPI_ISL_{1000 + num}|2020-03-01\n{seq}\n")
+    return str(metadata), str(fasta)
+
+
+def read_delta(prefix, delta):
+    with open(f"{prefix}.{delta}.tsv") as f:
+        return f.read().splitlines()[1:]
+
+
+def test_diff_over_many_sorted_runs(tmp_path, monkeypatch):
+    # two lines per sorted run, so every side is merged from several runs
+    monkeypatch.setattr(snapshot, "DIFF_RUN_ROWS", 2)
+    seqs = {num: "ACGT" * 3 for num in range(1, 9)}
+    old = write_snapshot(tmp_path, "old", [row(num) for num in (5, 3, 1, 7, 2, 8, 4)], seqs)
+    new_rows = [row(num) for num in (8, 1, 2, 4, 6, 7)] + [row(3, date="2020-03-02")]
+    new_seqs = dict(seqs)
+    new_seqs[4] = "TTTT" * 3
+    new = write_snapshot(tmp_path, "new", new_rows, new_seqs)
+    tmpdir = tmp_path / "tmp"
+    tmpdir.mkdir()
+    prefix = str(tmp_path / "diff")
+
+    counts = snapshot.diff_snapshots(*old, *new, prefix, str(tmpdir))
+    assert counts == {"added": 1, "removed": 1, "metadata_changed": 1, "sequence_changed": 1}
+    assert read_delta(prefix, "added") == [row(6)]
+    assert read_delta(prefix, "removed") == [row(5)]
+    assert read_delta(prefix, "metadata_changed") == [row(3, date="2020-03-02")]
+    assert read_delta(prefix, "sequence_changed") == [row(4)]
+    with open(f"{prefix}.summary.json") as f:
+        assert json.load(f)["counts"] == counts
+    # the sorted runs are gone
+    assert os.listdir(tmpdir) == []
+
+
+def test_first_record_of_a_duplicate_accession_wins(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "DIFF_RUN_ROWS", 1)
+    old = write_snapshot(tmp_path, "old", [row(1), row(2)], {})
+    new = write_snapshot(tmp_path, "new", [row(1), row(2), row(2, location="Asia / China")], {})
+    prefix = str(tmp_path / "diff")
+    counts = snapshot.diff_snapshots(old[0], None, new[0], None, prefix, str(tmp_path))
+    assert counts == {"added": 0, "removed": 0, "metadata_changed": 0, "sequence_changed": 0}
+
+
+def test_external_sort_merges_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "DIFF_RUN_ROWS", 3)
+    lines = [f"{key}\tx\ty z\n" for key in "qwertyuiopasdfg"]
+    merged = list(snapshot.external_sort(iter(lines), str(tmp_path), 3))
+    assert [fields[0] for fields in merged] == sorted("qwertyuiopasdfg")
+    assert merged[0] == ["a", "x", "y z"]
+    # five runs of three lines, removed by the caller with its tmpdir
+    assert len(os.listdir(tmp_path)) == 5
@@ -0,0 +1,169 @@
+import os
+
+import pytest
+
+pytest.importorskip("selenium")
+
+import gisaid_EpiCoV_downloader as downloader
+
+
+class FailingBackend:
+    def __init__(self, error):
+        self.error = error
+        self.calls = []
+
+    def open(self):
+        self.calls.append("open")
+
+    def login(self, uname, upass, session=None):
+        self.calls.append("login")
+
+    def download_artifacts(self, *args):
+        raise self.error
+
+    def export_metrics(self, started, status, metrics=None, trace=None):
+        self.calls.append(f"metrics:{status}")
+
+    def close(self):
+        self.calls.append("close")
+
+
+@pytest.mark.parametrize("error", [
+    downloader.DownloadTimeout("No download started in 60 secs.", [], []),
+    AssertionError("not the EpiCoV page"),
+])
+def test_failed_run_exports_metrics_and_closes(monkeypatch, tmp_path, error):
+    backend = FailingBackend(error)
+    monkeypatch.setattr(downloader, "SeleniumBackend", lambda *args: backend)
+    with pytest.raises((SystemExit, AssertionError)):
+        downloader.download_gisaid_EpiCoV("u", "p", False, str(tmp_path), None, "Human", None, None, None, None,
+                                          False, False, False, 90, 1, 0, False, None)
+    assert backend.calls[-2:] == ["metrics:failed", "close"]
+
+
+@pytest.mark.parametrize("url", [
+    "https://www.epicov.org/epi3/frontend",
+    "http://127.0.0.1:9/epi3/frontend",
+])
+def test_http_backend_refuses_sites_other_than_the_mock(monkeypatch, tmp_path, url):
+    monkeypatch.setattr(downloader, "GISAID_URL", url)
+    backend = downloader.HttpBackend(str(tmp_path))
+    with pytest.raises(downloader.EpiCoVError, match="only works with gisaid_EpiCoV_mock_server.py"):
+        backend.open()
+
+
+class Refused(Exception):
+    pass
+
+
+class RefusingLimiter:
+    def acquire(self):
+        raise Refused()
+
+
+def test_clients_keep_their_own_url_and_limiter(tmp_path):
+    defaults = (downloader.GISAID_URL, downloader.RATE_LIMITER)
+    limiter = RefusingLimiter()
+    first = downloader.EpiCoVClient("u", "p", str(tmp_path / "first"), backend="http",
+                                    url="http://127.0.0.1:9/epi3/frontend", limiter=limiter)
+    second = downloader.EpiCoVClient("u", "p", str(tmp_path / "second"), backend="http",
+                                     url="http://127.0.0.1:10/epi3/frontend")
+    assert first.backend.url("state") == "http://127.0.0.1:9/mock/state"
+    assert second.backend.url("state") == "http://127.0.0.1:10/mock/state"
+    assert second.backend.limiter is downloader.RATE_LIMITER
+    # the requests of the first client go through its own limiter
+    with pytest.raises(Refused):
+        first.backend.call("state")
+    assert (downloader.GISAID_URL, downloader.RATE_LIMITER) == defaults
+
+
+class UploadDriver:
+    def __init__(self):
+        self.waits = []
+
+    def implicitly_wait(self, secs):
+        self.waits.append(secs)
+
+
+def test_upload_restores_the_implicit_wait(monkeypatch, tmp_path):
+    driver = UploadDriver()
+
+    def upload_EpiCoV(wait, driver, metadata):
+        driver.implicitly_wait(downloader.uploader.IMPLICIT_WAIT)
+        return ["submitted"]
+    monkeypatch.setattr(downloader.uploader, "upload_EpiCoV", upload_EpiCoV)
+    backend = downloader.SeleniumBackend(str(tmp_path), False, None, 90)
+    backend.driver = driver
+    assert backend.upload("seq.fasta", {}) == ["submitted"]
+    assert driver.waits[-1] == downloader.IMPLICIT_WAIT
+
+
+def test_wait_until_restores_the_callers_implicit_wait():
+    driver = UploadDriver()
+    polls = []
+
+    def ready(driver):
+        polls.append(driver)
+        return len(polls) >= 3 and "button"
+    assert downloader.wait_until(driver, ready, "test button", 5, implicit=7) == "button"
+    assert polls == [driver] * 3
+    assert driver.waits == [0, 7]
+
+    with pytest.raises(downloader.TimeoutException, match="not ready in 0.1 secs"):
+        downloader.wait_until(driver, lambda driver: None, "test spinner", 0.1)
+    assert driver.waits[-1] == downloader.IMPLICIT_WAIT
+
+
+class NoIframeDriver(UploadDriver):
+    def find_element(self, by, value):
+        raise downloader.NoSuchElementException(value)
+
+
+def test_iframe_backs_off_only_between_attempts(monkeypatch):
+    delays = []
+
+    def retry_delay(step, attempt, iv, limiter=None):
+        delays.append(attempt)
+        return 0
+    monkeypatch.setattr(downloader, "retry_delay", retry_delay)
+    with pytest.raises(downloader.EpiCoVError, match="Failed to open the download window"):
+        downloader.waiting_for_iframe(NoIframeDriver(), 0.01, 3, 0)
+    assert delays == [1, 2]
+
+
+@pytest.mark.parametrize("args", [["--version"], ["-u", "u", "-p", "p", "--connect", "127.0.0.1:9", "-l", "USA"]])
+def test_no_rate_state_file_without_a_rate_limit(monkeypatch, tmp_path, args):
+    monkeypatch.setattr(downloader, "GISAID_URL", downloader.GISAID_URL)
+    monkeypatch.setattr(downloader, "RATE_LIMITER", downloader.RATE_LIMITER)
+    ratefile = tmp_path / "cache" / "ratelimit.json"
+    monkeypatch.setattr("sys.argv", ["gisaid_EpiCoV_downloader.py", "--ratefile", str(ratefile)] + args)
+    with pytest.raises((SystemExit, OSError, downloader.EpiCoVError)):
+        downloader.main()
+    downloader.RATE_LIMITER.failed(3, 3)
+    assert not (tmp_path / "cache").exists()
+
+
+def test_backoff_is_capped(monkeypatch):
+    limiter = downloader.RateLimiter()
+    for attempt in range(1, 10):
+        limiter.failed(attempt, 3)
+    monkeypatch.setattr(downloader.random, "uniform", lambda low, high: high)
+    assert limiter.failed(2, 3) == 3 / downloader.RATE_MIN_FACTOR
+    assert limiter.failed(5000, 3) == downloader.BACKOFF_MAX
+
+
+@pytest.mark.parametrize("lean", [False, True])
+def test_lean_browser_gets_the_lean_prefs(monkeypatch, tmp_path, lean):
+    started = []
+
+    class Firefox(UploadDriver):
+        def __init__(self, firefox_profile, options, firefox_binary):
+            super().__init__()
+            with open(os.path.join(firefox_profile.path, "user.js")) as f:
+                started.append(f.read())
+    monkeypatch.setattr(downloader.webdriver, "Firefox", Firefox)
+
+    driver = downloader.open_browser(str(tmp_path), False, None, lean)
+    assert driver.waits == [downloader.IMPLICIT_WAIT]
+    assert str(tmp_path) in started[0]
+    assert ('user_pref("permissions.default.image", 2);' in started[0]) == lean
@@ -0,0 +1,107 @@
+import hashlib
+import http.server
+import json
+import re
+import threading
+
+import pytest
+
+pytest.importorskip("selenium")
+
+import gisaid_EpiCoV_downloader as downloader
+
+DATA = bytes(range(256)) * 40
+CHUNK = 1000
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        rng = self.headers.get("Range")
+        m = re.match(r"bytes=(\d+)-(\d+)", rng or "")
+        with server.lock:
+            server.requests.append(rng)
+        if m and server.ranges:
+            start, end = int(m.group(1)), min(int(m.group(2)), len(DATA) - 1)
+            body = DATA[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{server.total or len(DATA)}")
+        else:
+            body = DATA
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Disposition", 'attachment; filename="data.bin"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.ranges = True
+    httpd.total = None
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}/data.bin"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_ranged_download_in_parallel(server, tmp_path):
+    target = str(tmp_path / "data.bin")
+    assert downloader.fetch_url(server.url, target, connections=4, chunk_size=CHUNK, iv=0) == target
+    with open(target, "rb") as f:
+        assert f.read() == DATA
+    ranges = [r for r in server.requests if r != "bytes=0-0"]
+    assert len(ranges) == -(-len(DATA) // CHUNK)
+    assert not (tmp_path / "data.bin.http-part").exists()
+    assert not (tmp_path / "data.bin.http.json").exists()
+
+
+def test_resume_fetches_only_missing_chunks(server, tmp_path):
+    target = str(tmp_path / "data.bin")
+    # an interrupted transfer: chunk 0 done, chunk 1 recorded but corrupt
+    part = DATA[:CHUNK] + b"x" * CHUNK + bytes(len(DATA) - 2 * CHUNK)
+    with open(f"{target}.http-part", "wb") as f:
+        f.write(part)
+    with open(f"{target}.http.json", "w") as f:
+        json.dump({"size": len(DATA), "chunk_size": CHUNK, "chunks": {
+            "0": hashlib.sha256(DATA[:CHUNK]).hexdigest(),
+            "1": hashlib.sha256(DATA[CHUNK:2 * CHUNK]).hexdigest(),
+        }}, f)
+    downloader.http_download(server.url, target, {}, len(DATA), True, 2, CHUNK, iv=0)
+    with open(target, "rb") as f:
+        assert f.read() == DATA
+    assert "bytes=0-999" not in server.requests
+    assert "bytes=1000-1999" in server.requests
+
+
+def test_server_without_ranges_is_read_in_one_stream(server, tmp_path):
+    server.ranges = False
+    target = str(tmp_path / "data.bin")
+    assert downloader.http_probe(downloader.threading.local(), server.url, {})[1:] == (len(DATA), False, "data.bin")
+    server.requests.clear()
+    downloader.fetch_url(server.url, target, connections=4, chunk_size=CHUNK, iv=0)
+    with open(target, "rb") as f:
+        assert f.read() == DATA
+    assert server.requests == ["bytes=0-0", None]
+
+
+def test_unknown_total_is_read_in_one_stream(server, tmp_path):
+    server.total = "*"
+    target = str(tmp_path / "data.bin")
+    assert downloader.http_probe(downloader.threading.local(), server.url, {})[1:] == (None, False, "data.bin")
+    server.requests.clear()
+    downloader.fetch_url(server.url, target, connections=4, chunk_size=CHUNK, iv=0)
+    with open(target, "rb") as f:
+        assert f.read() == DATA
+    assert server.requests == ["bytes=0-0", None]
@@ -0,0 +1,71 @@
+import pytest
+
+pytest.importorskip("selenium")
+
+import gisaid_EpiCoV_downloader as downloader
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+
+class FakeDriver:
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.quit_called = False
+
+    @property
+    def current_url(self):
+        if not self.alive:
+            raise WebDriverException("browser is gone")
+        return "about:blank"
+
+    def quit(self):
+        self.quit_called = True
+
+
+def flaky_run_job(failures, error):
+    calls = []
+
+    def run_job(driver, to, wd, job, rt, iv, url=None, limiter=None):
+        calls.append(driver)
+        if len(calls) <= failures:
+            raise error(driver)
+        return []
+    return run_job, calls
+
+
+@pytest.fixture(autouse=True)
+def no_delay(monkeypatch):
+    monkeypatch.setattr(downloader, "retry_delay", lambda step, attempt, iv, limiter=None: 0)
+
+
+def test_timeout_on_given_browser_is_retried(monkeypatch, tmp_path):
+    main = FakeDriver()
+    run_job, calls = flaky_run_job(1, lambda driver: TimeoutException("slow page"))
+    monkeypatch.setattr(downloader, "run_job", run_job)
+    jobs = [{"type": "query", "outdir": str(tmp_path / f"job{num}")} for num in range(3)]
+
+    def start_browser(num):
+        raise AssertionError("the given browser still works")
+
+    results = downloader.run_job_pool(jobs, 1, 5, 0, [(main, None, str(tmp_path))], start_browser)
+    assert results == [[], [], []]
+    assert calls == [main] * 4
+    assert not main.quit_called
+
+
+def test_dead_given_browser_is_replaced(monkeypatch, tmp_path):
+    main = FakeDriver()
+    spare = FakeDriver()
+
+    def crash(driver):
+        driver.alive = False
+        return WebDriverException("browser crashed")
+    run_job, calls = flaky_run_job(1, crash)
+    monkeypatch.setattr(downloader, "run_job", run_job)
+    jobs = [{"type": "query", "outdir": str(tmp_path / "job")}]
+
+    results = downloader.run_job_pool(jobs, 1, 5, 0, [(main, None, str(tmp_path))],
+                                      lambda num: (spare, None, str(tmp_path)))
+    assert results == [[]]
+    assert calls == [main, spare]
+    assert not main.quit_called
+    assert spare.quit_called
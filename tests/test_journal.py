@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+pytest.importorskip("selenium")
+
+import gisaid_EpiCoV_downloader as downloader
+
+PARAMS = {"location": "USA", "host": "Human"}
+
+
+def finished_run(tmp_path):
+    fn = str(tmp_path / downloader.JOURNAL)
+    export = tmp_path / "export.tsv"
+    export.write_text("a\tb\n")
+    journal = downloader.Journal(fn, PARAMS)
+    journal.record("export metadata", [str(export)], {"count": 1})
+    return fn, export
+
+
+def test_resume_skips_finished_steps(tmp_path):
+    fn, export = finished_run(tmp_path)
+    journal = downloader.Journal(fn, PARAMS, resume=True)
+    assert journal.done("export metadata") == [str(export)]
+    assert journal.entry("export metadata")["data"] == {"count": 1}
+    assert journal.done("export fasta") is None
+
+
+def test_resume_redoes_steps_whose_files_changed(tmp_path):
+    fn, export = finished_run(tmp_path)
+    export.write_text("a\tb\nc\td\n")
+    assert downloader.Journal(fn, PARAMS, resume=True).done("export metadata") is None
+
+
+def test_other_params_start_a_fresh_journal(tmp_path):
+    fn, export = finished_run(tmp_path)
+    journal = downloader.Journal(fn, dict(PARAMS, location="Japan"), resume=True)
+    assert journal.done("export metadata") is None
+    with open(fn) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 1 and lines[0]["params"]["location"] == "Japan"
+
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    fn, export = finished_run(tmp_path)
+    with open(fn, "a") as f:
+        f.write('{"step": "export fasta", "files": [{"pa')
+    journal = downloader.Journal(fn, PARAMS, resume=True)
+    assert journal.done("export metadata") == [str(export)]
+    assert journal.done("export fasta") is None
+    journal.record("export fasta", [str(export)])
+    assert downloader.Journal(fn, PARAMS, resume=True).done("export fasta") == [str(export)]
@@ -0,0 +1,152 @@
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("selenium")
+
+import gisaid_EpiCoV_downloader as downloader
+
+
+def parse(monkeypatch, tmp_path, fn, *options):
+    monkeypatch.setattr(sys, "argv", ["gisaid_EpiCoV_downloader.py", "-u", "u", "-p", "p",
+                                      "-o", str(tmp_path), "--manifest", fn] + list(options))
+    return downloader.parse_params()
+
+
+def write(tmp_path, name, text):
+    fn = str(tmp_path / name)
+    with open(fn, "w") as f:
+        f.write(text)
+    return fn
+
+
+def test_json_list(monkeypatch, tmp_path):
+    fn = write(tmp_path, "manifest.json", json.dumps([
+        {"name": "hk", "location": "Asia / Hong Kong", "substart": "2021-01-01"},
+        {"location": "Africa / South Africa", "outdir": "sa/2021", "highcoverage": True},
+    ]))
+    argvs = parse(monkeypatch, tmp_path, fn)
+    jobs = downloader.read_manifest(fn, argvs)
+
+    assert [job["name"] for job in jobs] == ["hk", "query-2"]
+    assert [job["step"] for job in jobs] == ["query:hk", "query:query-2"]
+    assert jobs[0]["outdir"] == os.path.join(str(tmp_path), "hk")
+    assert jobs[1]["outdir"] == os.path.join(str(tmp_path), "sa/2021")
+    assert jobs[0]["substart"] == "2021-01-01"
+    assert jobs[0]["highcoverage"] is False and jobs[1]["highcoverage"] is True
+    assert all(job["type"] == "query" and job["http"] is None for job in jobs)
+
+
+def test_yaml_defaults(monkeypatch, tmp_path):
+    pytest.importorskip("yaml")
+    fn = write(tmp_path, "manifest.yaml", "\n".join([
+        "defaults:",
+        "  substart: 2021-01-01",
+        "  complete: true",
+        "queries:",
+        "  - name: hk",
+        "    location: Asia / Hong Kong",
+        "  - name: sa",
+        "    location: Africa / South Africa",
+        "    subend: 2021-01-31",
+        "    complete: false",
+        "",
+    ]))
+    argvs = parse(monkeypatch, tmp_path, fn)
+    hk, sa = downloader.read_manifest(fn, argvs)
+
+    # unquoted YAML dates come back as strings
+    assert hk["substart"] == sa["substart"] == "2021-01-01"
+    assert sa["subend"] == "2021-01-31" and hk["subend"] is None
+    assert hk["complete"] is True and sa["complete"] is False
+
+
+def test_cli_defaults(monkeypatch, tmp_path):
+    fn = write(tmp_path, "manifest.json", json.dumps({
+        "defaults": {"colstart": "2020-12-01"},
+        "queries": [{"name": "hk", "location": "Asia / Hong Kong"},
+                    {"name": "env", "colstart": "2021-02-01", "host": "Environment"}],
+    }))
+    argvs = parse(monkeypatch, tmp_path, fn, "-ht", "Mink", "-cg", "-ss", "2021-01-01", "--http")
+    hk, env = downloader.read_manifest(fn, argvs)
+
+    assert hk["host"] == "Mink" and env["host"] == "Environment"
+    assert hk["complete"] is True and env["complete"] is True
+    assert hk["substart"] == env["substart"] == "2021-01-01"
+    # the defaults of the manifest beat those of the command line
+    assert hk["colstart"] == "2020-12-01" and env["colstart"] == "2021-02-01"
+    assert hk["http"] == downloader.http_options(argvs)
+
+
+@pytest.mark.parametrize("queries, message", [
+    ([{"name": "hk", "location": "Asia", "country": "China"}], "hk: unknown keys country"),
+    ([{"name": "hk", "location": "Asia"}, {"name": "hk", "location": "Europe"}], "used twice"),
+    ([{"name": "hk", "substart": "01/01/2021"}], "is not YYYY-MM-DD"),
+    ([{"name": "hk", "host": "Human"}], "no time range or location"),
+    ([], "no queries"),
+])
+def test_rejected(monkeypatch, tmp_path, queries, message):
+    fn = write(tmp_path, "manifest.json", json.dumps(queries))
+    argvs = parse(monkeypatch, tmp_path, fn)
+    with pytest.raises(downloader.EpiCoVError, match=message):
+        downloader.read_manifest(fn, argvs)
+
+
+def test_yaml_without_pyyaml(monkeypatch, tmp_path):
+    fn = write(tmp_path, "manifest.yml", "- name: hk\n  location: Asia\n")
+    argvs = parse(monkeypatch, tmp_path, fn)
+    # a None entry makes `import yaml` raise ImportError
+    monkeypatch.setitem(sys.modules, "yaml", None)
+    with pytest.raises(downloader.EpiCoVError, match="need PyYAML"):
+        downloader.read_manifest(fn, argvs)
+
+
+def test_run_manifest_stops_on_a_bad_manifest(monkeypatch, tmp_path):
+    fn = write(tmp_path, "manifest.json", json.dumps([{"name": "hk", "colour": "red"}]))
+    argvs = parse(monkeypatch, tmp_path, fn)
+
+    def refuse(*args, **kwargs):
+        raise AssertionError("no browser for a bad manifest")
+
+    monkeypatch.setattr(downloader, "SeleniumBackend", refuse)
+    assert downloader.run_manifest(argvs) is False
+    assert not os.path.exists(os.path.join(str(tmp_path), downloader.JOURNAL))
+
+
+def test_run_manifest(monkeypatch, tmp_path):
+    fn = write(tmp_path, "manifest.json", json.dumps([
+        {"name": "hk", "location": "Asia / Hong Kong"},
+        {"name": "sa", "location": "Africa / South Africa"},
+    ]))
+    argvs = parse(monkeypatch, tmp_path, fn, "-cg")
+    ran = []
+
+    class Backend:
+        def __init__(self, *args):
+            pass
+
+        def open(self):
+            pass
+
+        def login(self, uname, upass, session=None):
+            pass
+
+        def run_jobs(self, jobs, nw, rt, iv, journal=None, report=None):
+            for num, job in enumerate(jobs):
+                ran.append((job["name"], job["complete"]))
+                report[num] = {"status": "ok" if job["name"] == "hk" else "failed", "files": []}
+
+        def export_metrics(self, started, status, metrics, trace):
+            pass
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(downloader, "SeleniumBackend", Backend)
+    assert downloader.run_manifest(argvs) is True
+    assert ran == [("hk", True), ("sa", True)]
+    with open(os.path.join(str(tmp_path), downloader.MANIFEST_SUMMARY)) as f:
+        summary = json.load(f)
+    assert [(row["name"], row["status"]) for row in summary] == [("hk", "ok"), ("sa", "failed")]
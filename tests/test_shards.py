@@ -0,0 +1,57 @@
+import datetime
+
+import pytest
+
+pytest.importorskip("selenium")
+
+import gisaid_EpiCoV_downloader as downloader
+
+
+def day(num):
+    return (datetime.date(2021, 1, 1) + datetime.timedelta(days=num)).isoformat()
+
+
+def day_after(date):
+    return (datetime.datetime.strptime(date, "%Y-%m-%d").date() + datetime.timedelta(days=1)).isoformat()
+
+
+def counter(per_day):
+    """count() of bisect_windows over records per day, keeping the windows asked for"""
+    asked = []
+
+    def count(start, end):
+        asked.append((start, end))
+        return sum(n for d, n in per_day.items() if start <= d <= end)
+    return count, asked
+
+
+def test_windows_are_split_until_under_the_limit():
+    per_day = {day(num): num % 5 + 1 for num in range(31)}
+    count, _ = counter(per_day)
+    windows = downloader.bisect_windows([(day(0), day(30))], count, 10)
+    assert len(windows) > 1
+    assert all(count(start, end) <= 10 for start, end in windows)
+
+
+def test_windows_stay_contiguous():
+    per_day = {day(num): 3 for num in range(40)}
+    count, _ = counter(per_day)
+    windows = downloader.bisect_windows([(day(0), day(19)), (day(20), day(39))], count, 7)
+    assert windows[0][0] == day(0) and windows[-1][1] == day(39)
+    for (_, end), (start, _) in zip(windows, windows[1:]):
+        assert day_after(end) == start
+    assert all(start <= end for start, end in windows)
+
+
+def test_a_single_day_over_the_limit_is_kept():
+    per_day = {day(0): 1, day(1): 50, day(2): 1}
+    count, asked = counter(per_day)
+    windows = downloader.bisect_windows([(day(0), day(2))], count, 10)
+    assert windows == [(day(0), day(0)), (day(1), day(1)), (day(2), day(2))]
+    assert len(asked) < 10
+
+
+def test_empty_windows_are_dropped_and_unknown_counts_kept():
+    count, _ = counter({day(5): 20, day(6): 20})
+    assert downloader.bisect_windows([(day(0), day(7))], count, 25) == [(day(4), day(5)), (day(6), day(7))]
+    assert downloader.bisect_windows([(day(0), day(7))], lambda start, end: None, 25) == [(day(0), day(7))]
@@ -0,0 +1,64 @@
+import gisaid_EpiCoV_snapshot as snapshot
+
+# GISAID virus names have spaces
+RECORDS = [
+    ("hCoV-19/Hong Kong/HK-1/2020", "EPI_ISL_1001", "2020-03-01", "Asia / Hong Kong", "ACGTACGTAA"),
+    ("hCoV-19/Hong Kong/HK-2/2020", "EPI_ISL_1002", "2020-03-02", "Asia / Hong Kong", "CCGTACGTAA"),
+    ("hCoV-19/South Africa/SA-1/2020", "EPI_ISL_1003", "2020-03-03", "Africa / South Africa", "GCGTACGTAA"),
+]
+
+
+def write_snapshot(tmp_path):
+    metadata = tmp_path / "metadata.tsv"
+    with open(metadata, "w") as f:
+        f.write("Virus name\tAccession ID\tCollection date\tLocation\tHost\n")
+        for name, accession, date, location, _ in RECORDS:
+            f.write(f"{name}\t{accession}\t{date}\t{location}\tHuman\n")
+    fasta = tmp_path / "sequences.fasta"
+    with open(fasta, "w") as f:
+        for name, accession, date, _, seq in RECORDS:
+            f.write(f">{name}|{accession}|{date}\n{seq[:6]}\n{seq[6:]}\n")
+    return str(metadata), str(fasta)
+
+
+def test_index_keeps_spaced_names(tmp_path):
+    _, fasta = write_snapshot(tmp_path)
+    plain, fai = snapshot.index_fasta(fasta)
+    with snapshot.FastaIndex(plain, fai) as index:
+        assert len(index.entries) == len(RECORDS)
+        for name, accession, date, _, seq in RECORDS:
+            assert index.find(accession) == f"{name}|{accession}|{date}"
+            assert index.find(name) == f"{name}|{accession}|{date}"
+            assert index.fetch(index.find(accession)) == seq
+
+
+def test_extract_spaced_names(tmp_path):
+    _, fasta = write_snapshot(tmp_path)
+    out = str(tmp_path / "out.fasta")
+    missing = snapshot.extract_sequences(fasta, [accession for _, accession, _, _, _ in RECORDS], out)
+    assert missing == []
+    with open(out) as f:
+        assert [header for header, _ in snapshot.iter_fasta(f)] == ["|".join(r[:3]) for r in RECORDS]
+
+
+def test_query_same_with_index(tmp_path):
+    metadata, fasta = write_snapshot(tmp_path)
+    filters = {"location": "asia", "host": "Human"}
+    _, count = snapshot.query_snapshot(metadata, fasta, filters, str(tmp_path / "scan"))
+    snapshot.index_fasta(fasta)
+    _, indexed_count = snapshot.query_snapshot(metadata, fasta, filters, str(tmp_path / "indexed"))
+    assert count == indexed_count == 2
+    with open(tmp_path / "scan.fasta") as scan, open(tmp_path / "indexed.fasta") as indexed:
+        assert scan.read() == indexed.read()
+
+
+def test_packed_msa_finds_spaced_names(tmp_path):
+    _, fasta = write_snapshot(tmp_path)
+    matrix = snapshot.pack_msa(fasta, str(tmp_path / "msa.msa4"))
+    with snapshot.PackedMSA(matrix) as msa:
+        assert msa.nrows == len(RECORDS)
+        for num, (name, accession, _, _, seq) in enumerate(RECORDS):
+            assert msa.find(accession) == num
+            assert msa.find(name) == num
+            assert msa.row(num) == seq
+        assert msa.column(0) == "".join(seq[0] for _, _, _, _, seq in RECORDS)
@@ -0,0 +1,138 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("selenium")
+
+import gisaid_EpiCoV_downloader as downloader
+
+# what firefox saves for each artifact of NEXTSTRAIN_ARTIFACTS
+FILES = {
+    "metadata": "metadata_tsv_2021_01_01.tar.xz",
+    "FASTA": "sequences_fasta_2021_01_01.tar.xz",
+    "MSA full": "msa_2021_01_01.tar.xz",
+    "MSA unmasked": "msa_unmasked_2021_01_01.tar.xz",
+    "MSA masked": "msa_masked_2021_01_01.tar.xz",
+}
+TRANSFER_SECS = 0.2
+
+
+class Element:
+    def __init__(self, browser, name):
+        self.browser = browser
+        self.name = name
+
+    def click(self):
+        self.browser.clicks.append(self.name)
+        if self.name == "download button":
+            self.browser.start_download()
+
+
+class SwitchTo:
+    def frame(self, frame):
+        pass
+
+    def default_content(self):
+        pass
+
+
+class Browser:
+    """the Downloads section of EpiCoV: Download saves the artifact picked last through a .part file"""
+
+    def __init__(self, wd):
+        self.wd = wd
+        self.switch_to = SwitchTo()
+        self.clicks = []
+        self.artifact = None
+        self.transfers = []
+
+    def find_element_by_xpath(self, xpath):
+        return Element(self, "checkbox" if "sys-event-hook" in xpath else "back button")
+
+    def start_download(self):
+        fn = os.path.join(self.wd, FILES[self.artifact])
+        with open(fn, "wb"):
+            pass
+        with open(f"{fn}.part", "wb") as f:
+            f.write(b"x" * 1000)
+        timer = threading.Timer(TRANSFER_SECS, os.replace, (f"{fn}.part", fn))
+        timer.start()
+        self.transfers.append(timer)
+
+
+@pytest.fixture
+def browser(monkeypatch, tmp_path):
+    browser = Browser(str(tmp_path))
+
+    def wait_until(driver, locator, name, timeout, settle=0, implicit=downloader.IMPLICIT_WAIT):
+        if name == "artifact button":
+            browser.artifact = next(name for _, name, xpath in downloader.NEXTSTRAIN_ARTIFACTS if xpath == locator[1])
+        return Element(browser, name)
+    # wait_until() gets the (By.XPATH, xpath) locators
+    monkeypatch.setattr(downloader.EC, "element_to_be_clickable", lambda locator: locator)
+    monkeypatch.setattr(downloader, "wait_until", wait_until)
+    monkeypatch.setattr(downloader, "waiting_sys_timer", lambda driver, to, sec=0: None)
+    monkeypatch.setattr(downloader, "waiting_for_iframe", lambda driver, to, rt, iv, limiter=None: "iframe")
+    monkeypatch.setattr(downloader, "wait_download_started",
+                        functools.partial(downloader.wait_download_started, poll=0.01))
+    monkeypatch.setattr(downloader, "track_downloads", functools.partial(downloader.track_downloads, poll=0.02))
+    yield browser
+    for timer in browser.transfers:
+        timer.join()
+
+
+def read_timings(wd):
+    with open(os.path.join(str(wd), downloader.TIMINGS)) as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.mark.parametrize("cc", [False, True])
+def test_stages_of_each_download(browser, tmp_path, cc):
+    startTime = time.time()
+    fns = downloader.download_nextstrain(browser, 90, str(tmp_path), 1, 0, cc, keys=["metadata", "fasta"])
+
+    assert sorted(os.path.basename(fn) for fn in fns) == sorted([FILES["metadata"], FILES["FASTA"]])
+    assert browser.clicks == ["downloads button"] + ["artifact button", "checkbox", "download button"] * 2 + \
+        ["back button"]
+    timings = read_timings(tmp_path)
+    assert [t["artifact"] for t in timings] == ["metadata", "FASTA"]
+    for t in timings:
+        assert list(t["stages"]) == ["click", "terms", "start", "complete"]
+        assert t["status"] == "ok" and t["bytes"] == 1000
+        assert t["file"] == os.path.join(str(tmp_path), FILES[t["artifact"]])
+        assert t["stages"]["complete"] >= TRANSFER_SECS / 2
+        assert t["total"] == pytest.approx(sum(t["stages"].values()), abs=0.01)
+        assert t["total"] <= time.time() - startTime
+
+
+def test_failed_download_is_timed(browser, monkeypatch, tmp_path):
+    def no_download(wd, existing, timeout=60, poll=0.5):
+        raise downloader.DownloadTimeout(f"No download started in {timeout} secs.", [], [])
+    monkeypatch.setattr(downloader, "wait_download_started", no_download)
+
+    with pytest.raises(downloader.DownloadTimeout):
+        downloader.download_nextstrain(browser, 90, str(tmp_path), 1, 0, keys=["fasta"])
+    timings = read_timings(tmp_path)
+    assert [(t["artifact"], t["status"], list(t["stages"])) for t in timings] == \
+        [("FASTA", "failed", ["click", "terms"])]
+
+
+def test_artifacts_option(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["gisaid_EpiCoV_downloader.py", "--artifacts", " Metadata, msa-masked,"])
+    assert downloader.parse_params().artifacts == ["metadata", "msa-masked"]
+
+    monkeypatch.setattr(sys, "argv", ["gisaid_EpiCoV_downloader.py", "--artifacts", "metadata,tree"])
+    with pytest.raises(SystemExit):
+        downloader.parse_params()
+
+
+def test_artifacts_select_the_downloads(browser, tmp_path):
+    fns = downloader.download_nextstrain(browser, 90, str(tmp_path), 1, 0, keys=["msa-masked"])
+
+    assert fns == [os.path.join(str(tmp_path), FILES["MSA masked"])]
+    assert [t["artifact"] for t in read_timings(tmp_path)] == ["MSA masked"]
@@ -0,0 +1,62 @@
+import os
+
+import gisaid_EpiCoV_snapshot as snapshot
+
+HEADER = "Virus name\tAccession ID\tCollection date\tSubmission date\tLocation\tPango lineage\n"
+ROWS = [
+    "hCoV-19/Hong Kong/HK-1/2020\tEPI_ISL_1001\t2020-03-01\t2020-03-10\tAsia / Hong Kong\tB.1",
+    "hCoV-19/Hong Kong/HK-2/2020\tEPI_ISL_1002\t2020-03-02\t2020-03-11\tAsia / Hong Kong\tB.1.1",
+    "hCoV-19/South Africa/SA-1/2020\tEPI_ISL_1003\t2020-03-03\t2020-03-12\tAfrica / South Africa / Gauteng\tB.1.351",
+    "hCoV-19/South Africa/SA-2/2020\tEPI_ISL_1004\t2020-04-03\t2020-04-12\tAfrica / South Africa / Western Cape\tB.1.351",
+]
+
+
+def write_metadata(fn, rows, mtime):
+    with open(fn, "w") as f:
+        f.write(HEADER + "".join(row + "\n" for row in rows))
+    os.utime(fn, (mtime, mtime))
+    return str(fn)
+
+
+def test_build_and_lookup(tmp_path):
+    metadata = write_metadata(tmp_path / "metadata_tsv_2021_01_01.tsv", ROWS, 1000)
+    db = str(tmp_path / snapshot.STORE_DB)
+    assert snapshot.build_store(metadata, db) == len(ROWS)
+    header, records = snapshot.query_store(db, {"accession": ["EPI_ISL_1002", "EPI_ISL_1004"]})
+    assert header == HEADER.rstrip("\n")
+    assert sorted(records) == [ROWS[1], ROWS[3]]
+    # places match whole and ignore case
+    assert snapshot.query_store(db, {"division": "gauteng"})[1] == [ROWS[2]]
+    assert snapshot.query_store(db, {"lineage": "B.1.351"}, limit=1)[1] in ([ROWS[2]], [ROWS[3]])
+    assert not os.path.exists(f"{db}.part")
+
+
+def test_update_follows_the_newest_download(tmp_path):
+    write_metadata(tmp_path / "metadata_tsv_2021_01_01.tsv", ROWS, 1000)
+    db = snapshot.update_store(str(tmp_path))
+    assert db == str(tmp_path / snapshot.STORE_DB)
+    os.utime(db, (2000, 2000))
+    # nothing newer, the store is kept
+    assert snapshot.update_store(str(tmp_path)) == db
+    assert os.path.getmtime(db) == 2000
+
+    changed = ROWS[0].replace("\tB.1", "\tB.1.1.7")
+    write_metadata(tmp_path / "metadata_tsv_2021_02_01.tsv", [changed, ROWS[1], ROWS[2]], 3000)
+    assert snapshot.update_store(str(tmp_path)) == db
+    assert snapshot.query_store(db, {"accession": "EPI_ISL_1001"})[1] == [changed]
+    assert snapshot.query_store(db, {"accession": "EPI_ISL_1004"})[1] == []
+    assert len(snapshot.query_store(db, {})[1]) == 3
+
+
+def test_lookup_matches_query_snapshot(tmp_path):
+    metadata = write_metadata(tmp_path / "metadata.tsv", ROWS, 1000)
+    db = str(tmp_path / snapshot.STORE_DB)
+    snapshot.build_store(metadata, db)
+    filters = {"location": "South Africa", "colstart": "2020-03-02", "subend": "2020-03-31"}
+    (tsv,), count = snapshot.query_snapshot(metadata, None, filters, str(tmp_path / "query"))
+    with open(tsv) as f:
+        selected = f.read().splitlines()[1:]
+    _, records = snapshot.query_store(db, {"country": "south africa", "colstart": "2020-03-02",
+                                           "subend": "2020-03-31"})
+    assert count == 1
+    assert sorted(records) == sorted(selected) == [ROWS[2]]
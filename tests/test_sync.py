@@ -0,0 +1,112 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("selenium")
+
+import gisaid_EpiCoV_downloader as downloader
+
+HEADER = "Virus name\tAccession ID\tCollection date\tLocation\tSubmission date\n"
+# the submissions on EpiCoV: (virus name, accession, submission date)
+SUBMISSIONS = [
+    ("hCoV-19/Hong Kong/HK-1/2021", "EPI_ISL_1001", "2021-01-01"),
+    ("hCoV-19/Hong Kong/HK-2/2021", "EPI_ISL_1002", "2021-01-03"),
+    ("hCoV-19/South Africa/SA-1/2021", "EPI_ISL_1003", "2021-01-03"),
+    ("hCoV-19/South Africa/SA-2/2021", "EPI_ISL_1004", "2021-01-05"),
+]
+
+
+class SyncBackend:
+    """answers queries from the submissions up to `today`, like a Browse download"""
+
+    def __init__(self, wd, today):
+        self.wd = wd
+        self.today = today
+        self.substarts = []
+
+    def open(self):
+        pass
+
+    def login(self, uname, upass, session=None):
+        pass
+
+    def query(self, query, rt, iv, journal=None, http=None):
+        self.substarts.append(query["substart"])
+        records = [r for r in SUBMISSIONS if query["substart"] <= r[2] <= self.today]
+        if not records:
+            raise downloader.NoDataFound("No data found.")
+        prefix = os.path.join(self.wd, f"gisaid_hcov-19_{len(self.substarts)}")
+        with open(f"{prefix}.tsv", "w") as f:
+            f.write(HEADER + "".join(f"{name}\t{acc}\t2020-12-01\tAsia\t{date}\n" for name, acc, date in records))
+        with open(f"{prefix}.fasta", "w") as f:
+            f.write("".join(f">{name}|{acc}|2020-12-01\nACGT\n" for name, acc, _ in records))
+        return [f"{prefix}.fasta", f"{prefix}.tsv"]
+
+    def export_metrics(self, started, status, metrics=None, trace=None):
+        pass
+
+    def close(self):
+        pass
+
+
+def sync(monkeypatch, wd, today, ss=None):
+    backend = SyncBackend(str(wd), today)
+    monkeypatch.setattr(downloader, "SeleniumBackend", lambda *args: backend)
+    downloader.download_gisaid_EpiCoV("u", "p", False, str(wd), None, "Human", None, None, ss, None,
+                                      False, False, False, 90, 1, 0, True, None, sync=True)
+    return backend
+
+
+def master(wd):
+    with open(wd / f"{downloader.SYNC_MASTER}.metadata.tsv") as f:
+        rows = f.read().splitlines()[1:]
+    with open(wd / f"{downloader.SYNC_MASTER}.fasta") as f:
+        headers = [line for line in f.read().splitlines() if line.startswith(">")]
+    return [row.split("\t")[1] for row in rows], headers
+
+
+def mark(wd):
+    with open(wd / downloader.SYNC_STATE) as f:
+        return json.load(f)["high_water_mark"]
+
+
+def test_first_sync_needs_a_start_date(monkeypatch, tmp_path):
+    with pytest.raises(SystemExit):
+        sync(monkeypatch, tmp_path, "2021-01-03")
+    assert not (tmp_path / downloader.SYNC_STATE).exists()
+
+
+def test_sync_moves_the_mark_without_duplicates(monkeypatch, tmp_path):
+    backend = sync(monkeypatch, tmp_path, "2021-01-03", ss="2021-01-01")
+    assert backend.substarts == ["2021-01-01"]
+    assert mark(tmp_path) == "2021-01-03"
+    accessions, headers = master(tmp_path)
+    assert accessions == ["EPI_ISL_1001", "EPI_ISL_1002", "EPI_ISL_1003"]
+
+    # the next run starts at the mark, so the records of that day come again
+    backend = sync(monkeypatch, tmp_path, "2021-01-05")
+    assert backend.substarts == ["2021-01-03"]
+    assert mark(tmp_path) == "2021-01-05"
+    accessions, headers = master(tmp_path)
+    assert accessions == ["EPI_ISL_1001", "EPI_ISL_1002", "EPI_ISL_1003", "EPI_ISL_1004"]
+    assert headers == [f">{name}|{acc}|2020-12-01" for name, acc, _ in SUBMISSIONS]
+
+
+def test_sync_without_new_submissions_keeps_the_mark(monkeypatch, tmp_path):
+    sync(monkeypatch, tmp_path, "2021-01-05", ss="2021-01-04")
+    assert mark(tmp_path) == "2021-01-05"
+    sync(monkeypatch, tmp_path, "2021-01-05")
+    assert mark(tmp_path) == "2021-01-05"
+    assert master(tmp_path)[0] == ["EPI_ISL_1004"]
+
+
+def test_sync_master_rebuilds_missing_keys(tmp_path):
+    download = tmp_path / "download.tsv"
+    with open(download, "w") as f:
+        f.write(HEADER + "hCoV-19/Hong Kong/HK-1/2021\tEPI_ISL_1001\t2020-12-01\tAsia\t2021-01-01\n")
+    downloader.sync_master(str(tmp_path), [str(download)], "2020-12-31")
+    os.remove(tmp_path / f"{downloader.SYNC_MASTER}.metadata.tsv.keys")
+    downloader.sync_master(str(tmp_path), [str(download)], None)
+    assert master(tmp_path)[0] == ["EPI_ISL_1001"]
+    assert mark(tmp_path) == "2021-01-01"
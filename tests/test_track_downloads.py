@@ -0,0 +1,67 @@
+import os
+import threading
+
+import pytest
+
+pytest.importorskip("selenium")
+
+import gisaid_EpiCoV_downloader as downloader
+
+
+def write(wd, name, data):
+    with open(os.path.join(str(wd), name), "wb") as f:
+        f.write(data)
+
+
+def crashed_run(wd, placeholder=True):
+    """the files firefox left behind when a run crashed mid-transfer"""
+    if placeholder:
+        write(wd, "gisaid_hcov-19.tar", b"")
+    write(wd, "gisaid_hcov-19.tar.part", b"x" * 100)
+    return downloader.scan_download_dir(str(wd))
+
+
+def test_stale_part_does_not_hold_a_new_download(tmp_path):
+    # the placeholder was cleaned up, the new download takes its name
+    existing = crashed_run(tmp_path, placeholder=False)
+
+    def download():
+        write(tmp_path, "gisaid_hcov-19.tar", b"y" * 200)
+
+    timer = threading.Timer(0.05, download)
+    timer.start()
+    try:
+        completed = downloader.track_downloads(str(tmp_path), existing, 1, waitTime=5, poll=0.01)
+    finally:
+        timer.cancel()
+    assert completed == [os.path.join(str(tmp_path), "gisaid_hcov-19.tar")]
+
+
+def test_stale_part_is_not_pending(tmp_path):
+    existing = crashed_run(tmp_path)
+    write(tmp_path, "metadata.tsv.part", b"z" * 10)
+
+    with pytest.raises(downloader.DownloadTimeout) as e:
+        downloader.track_downloads(str(tmp_path), existing, 1, waitTime=0.1, poll=0.01)
+    assert e.value.completed == []
+    assert e.value.pending == [os.path.join(str(tmp_path), "metadata.tsv")]
+
+
+def test_part_renamed_on_completion(tmp_path):
+    existing = downloader.scan_download_dir(str(tmp_path))
+    write(tmp_path, "metadata.tsv", b"")
+    write(tmp_path, "metadata.tsv.part", b"z" * 10)
+
+    def finish():
+        os.replace(os.path.join(str(tmp_path), "metadata.tsv.part"),
+                   os.path.join(str(tmp_path), "metadata.tsv"))
+
+    timer = threading.Timer(0.05, finish)
+    timer.start()
+    try:
+        times = {}
+        completed = downloader.track_downloads(str(tmp_path), existing, 1, waitTime=5, poll=0.01, times=times)
+    finally:
+        timer.cancel()
+    assert completed == [os.path.join(str(tmp_path), "metadata.tsv")]
+    assert list(times) == ["metadata.tsv"]